@@ -42,7 +42,8 @@ class FieldIndexForwardSort:
         self.dbkey = dbkey
         self.index = self.get_index()
         self.numdocs = self.index._num_docs.value
-        self.dbkey = dbkey
+        # the prefix of the names of the files written
+        self.name = dbkey
         # the set of rlens and limits are series generated via
         # exponents to the power of the base base, e.g.  [4, 16, 64,
         # 256, 1024, 4096, 16384, 65535 ] if numdocs = 65708 and the
@@ -68,12 +69,12 @@ class FieldIndexForwardSort:
         return root[self.dbkey]
 
     def __call__(self):
-        if not os.path.exists('%s.pck' % self.dbkey):
+        if not os.path.exists('%s.pck' % self.name):
             self.bench()
         self.chart()
 
     def bench(self):
-        tf = open('%s.txt' % self.dbkey, 'w')
+        tf = open('%s.txt' % self.name, 'w')
 
         def output(msg):
             tf.write(msg + '\n')
@@ -91,11 +92,7 @@ class FieldIndexForwardSort:
             output('for %s' % rlen)
             output('-----------------------------------')
 
-            control = []
-            for k, s in self.index._fwd_index.items():
-                for docid in s:
-                    if docid in docids:
-                        control.append(docid)
+            control = self.control(docids)
 
             capture = {}
             result = None
@@ -104,18 +101,30 @@ class FieldIndexForwardSort:
                 for limit in self.limits:
                     t, result = timer(fn, docids, limit)
                     result = list(result)
-                    if control[:limit] != result:
+                    if not self.same(control[:limit], result):
                         raise AssertionError((control[:limit], result))
                     data.append(t)
                     output('%0.6f %s at limit %s' % (t, name, limit))
 
             main.append({'rlen':rlen, 'capture':capture})
 
-        cPickle.dump(main, open('%s.pck' % self.dbkey, 'w'))
+        cPickle.dump(main, open('%s.pck' % self.name, 'w'))
+
+    def control(self, docids):
+        # the docids sorted the slow and obvious way
+        control = []
+        for k, s in self.index._fwd_index.items():
+            for docid in s:
+                if docid in docids:
+                    control.append(docid)
+        return control
+
+    def same(self, control, result):
+        return control == result
 
     def chart(self):
 
-        self.main = cPickle.load(open('%s.pck' % self.dbkey))
+        self.main = cPickle.load(open('%s.pck' % self.name))
 
         for chartable in self.main:
             self.detailchart(chartable)
@@ -169,7 +178,7 @@ class FieldIndexForwardSort:
             ar.add_plot(
                 line_plot.T(label="%s" % sortname, data=linedata)
                 )
-        fd = open('detail-%s-%s.pdf' % (self.dbkey, chartable['rlen']), 'w')
+        fd = open('detail-%s-%s.pdf' % (self.name, chartable['rlen']), 'w')
         can = canvas.init(fd, 'pdf')
         ar.draw(can)
         tb.draw(can)
@@ -234,7 +243,7 @@ class FieldIndexForwardSort:
                 print "test percentage %0.2f: (%s wrong out of %s)" % (
                     test_percent, test_wrong, test_total)
 
-        comparename = 'compare-%s-%s-beats-%s' % (self.dbkey,
+        comparename = 'compare-%s-%s-beats-%s' % (self.name,
                                                   sortname1, sortname2)
 
         xaxis=axis.X(label='Doc Ratio (rlen//numdocs)',
@@ -265,6 +274,29 @@ class FieldIndexForwardSort:
         tb.draw(can)
         can.close()
 
+class FieldIndexReverseSort(FieldIndexForwardSort):
+    """ Benchmark and compare the field index reverse sort algorithms """
+
+    def __init__(self, limitbase=2, rlenbase=2, dbfn='sort.db', dbkey='65536'):
+        FieldIndexForwardSort.__init__(self, limitbase, rlenbase, dbfn, dbkey)
+        self.name = 'reverse-%s' % dbkey
+        self.sorts = (
+            ('nbest', self.index.nbest_descending),
+            ('rvscan', self.index.scan_reverse),
+            ('timsort', self.index.timsort_descending)
+            )
+
+    def control(self, docids):
+        control = FieldIndexForwardSort.control(self, docids)
+        control.reverse()
+        return control
+
+    def same(self, control, result):
+        # the algorithms order docids having the same value differently
+        rev_index = self.index._rev_index
+        return ([rev_index[docid] for docid in control] ==
+                [rev_index[docid] for docid in result])
+
 def timer(fn, *args, **kw):
     times = []
     for x in range(7):
@@ -311,7 +343,38 @@ def series(numdocs, base):
     exp = int(math.ceil(math.log(numdocs) / math.log(base)))
     return [ pow(base, x) for x in range(1, exp) ]
 
+def calibrate(dbfn='sort.db', dbkey='65536', repeat=3):
+    """ Measure the sort algorithm crossover points of the field index
+    stored under ``dbkey`` in ``dbfn`` and save the decision table on
+    the index (see ``CatalogFieldIndex.calibrate_sort``); the index
+    then uses it to choose its sort algorithm. """
+    import transaction
+    from ZODB.FileStorage.FileStorage import FileStorage
+    from ZODB.DB import DB
+    db = DB(FileStorage(dbfn), cache_size=300000)
+    c = db.open()
+    index = c.root()[dbkey]
+    table = index.calibrate_sort(repeat=int(repeat))
+    transaction.commit()
+    for direction in ('forward', 'reverse'):
+        print direction
+        print '-----------------------------------'
+        for docratio, columns, unlimited in table[direction]:
+            print '%0.6f %s %s' % (docratio, unlimited, ' '.join(
+                ['%0.6f:%s' % column for column in columns]))
+    db.close()
+
 def main(argv=sys.argv):
+    # "sortbench.py calibrate [dbfn [dbkey [repeat]]]" stores a decision
+    # table on the index instead of charting the sort algorithms
+    # "sortbench.py reverse" charts the reverse sort algorithms
+    if argv[1:2] == ['calibrate']:
+        calibrate(*argv[2:])
+        return
+    if argv[1:2] == ['reverse']:
+        bench = FieldIndexReverseSort()
+        bench()
+        return
     bench = FieldIndexForwardSort()
     bench()
 
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+_marker = object()
+
+
+class LRUCache(object):
+    """ A thread-safe mapping which forgets its least recently used
+    entries.
+
+    Each entry has a cost (1 unless ``set`` is told otherwise); entries
+    are evicted once there are more than ``maxsize`` of them or once
+    their costs add up to more than ``maxcost``.  An entry which costs
+    more than ``maxcost`` by itself is never stored.  ``hits``,
+    ``misses`` and ``evictions`` count what happened to the cache since
+    it was created or last cleared."""
+
+    def __init__(self, maxsize=100, maxcost=None):
+        if maxsize < 1:
+            raise ValueError('maxsize must be 1 or greater')
+        self.maxsize = maxsize
+        self.maxcost = maxcost
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._data = OrderedDict()
+            self.cost = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _marker)
+            if entry is _marker:
+                self.misses += 1
+                return default
+            # reinsert to mark the entry as the most recently used one
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, cost=1):
+        maxcost = self.maxcost
+        with self._lock:
+            self._remove(key)
+            if maxcost is not None and cost > maxcost:
+                return
+            self._data[key] = (value, cost)
+            self.cost += cost
+            data = self._data
+            while (len(data) > self.maxsize or
+                   (maxcost is not None and self.cost > maxcost)):
+                _, (_, oldcost) = data.popitem(last=False)
+                self.cost -= oldcost
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, _marker)
+        if entry is not _marker:
+            self.cost -= entry[1]
@@ -1,4 +1,8 @@
+import inspect
+import itertools
+
 import BTrees
+from BTrees.Length import Length
 from persistent.mapping import PersistentMapping
 import transaction
 
@@ -6,7 +10,10 @@ from zope.interface import implementer
 
 from repoze.catalog.interfaces import ICatalog
 from repoze.catalog.interfaces import ICatalogIndex
+from repoze.catalog.cache import LRUCache
 from repoze.catalog.compat import text_type
+from repoze.catalog.setops import PROBE_LIMIT
+from repoze.catalog.setops import intersection
 
 
 @implementer(ICatalog)
@@ -14,6 +21,12 @@ class Catalog(PersistentMapping):
 
     family = BTrees.family32
 
+    # While the query result cache is enabled, _generations maps the name
+    # of each index to a Length which is incremented whenever the index is
+    # written to through the catalog.
+    _generations = None
+    _query_cache_limits = None
+
     def __init__(self, family=None):
         PersistentMapping.__init__(self)
         if family is not None:
@@ -21,6 +34,7 @@ class Catalog(PersistentMapping):
 
     def clear(self):
         """ Clear all indexes in this catalog. """
+        self._invalidate()
         for index in self.values():
             index.clear()
 
@@ -28,12 +42,49 @@ class Catalog(PersistentMapping):
         """Register the document represented by ``obj`` in indexes of
         this catalog using docid ``docid``."""
         assertint(docid)
+        self._invalidate()
         for index in self.values():
             index.index_doc(docid, obj)
 
+    def index_docs(self, docs, batch_size=10000):
+        """Register each document in ``docs``, an iterable of ``(docid,
+        obj)`` pairs, in the indexes of this catalog.
+
+        The documents are handed to the indexes in batches of up to
+        ``batch_size`` pairs.  Each index runs its discriminator once
+        per document and may load a whole batch at once (see the
+        ``index_docs`` method of the field and keyword indexes), which
+        is much faster than calling ``index_doc`` for every document
+        when building or rebuilding a large catalog.
+
+        If a document can't be indexed, the field and keyword indexes
+        raise the error before changing anything for its batch; indexes
+        and batches handled before stay indexed, as with ``index_doc``."""
+        self._invalidate()
+        batch = []
+        for docid, obj in docs:
+            assertint(docid)
+            batch.append((docid, obj))
+            if len(batch) >= batch_size:
+                self._index_batch(batch)
+                batch = []
+        if batch:
+            self._index_batch(batch)
+
+    def _index_batch(self, batch):
+        for index in self.values():
+            index_docs = getattr(index, 'index_docs', None)
+            if index_docs is None:
+                # an index that can only index one document at a time
+                for docid, obj in batch:
+                    index.index_doc(docid, obj)
+            else:
+                index_docs(batch)
+
     def unindex_doc(self, docid):
         """Unregister the document id from indexes of this catalog."""
         assertint(docid)
+        self._invalidate()
         for index in self.values():
             index.unindex_doc(docid)
 
@@ -41,10 +92,19 @@ class Catalog(PersistentMapping):
         """ Reindex the document referenced by docid using the object
         passed in as ``obj`` (typically just does the equivalent of
         ``unindex_doc``, then ``index_doc``, but specialized indexes
-        can override the method that this API calls to do less work. """
+        can override the method that this API calls to do less work.
+
+        Indexes leave themselves untouched if the indexed value of
+        ``obj`` didn't change.  Return a list of the names of the
+        indexes which did change; an index whose ``reindex_doc`` method
+        doesn't return False is assumed to have changed."""
         assertint(docid)
-        for index in self.values():
-            index.reindex_doc(docid, obj)
+        changed = []
+        for name, index in self.items():
+            if index.reindex_doc(docid, obj) is not False:
+                changed.append(name)
+        self._invalidate(changed)
+        return changed
 
     def __setitem__(self, name, index):
         """ Add an object which implements
@@ -52,7 +112,120 @@ class Catalog(PersistentMapping):
         No other type of object may be added to a catalog."""
         if not ICatalogIndex.providedBy(index):
             raise ValueError('%s does not provide ICatalogIndex')
-        return PersistentMapping.__setitem__(self, name, index)
+        PersistentMapping.__setitem__(self, name, index)
+        self._invalidate([name])
+
+    def enable_query_cache(self, maxsize=100, maxdocids=1000000):
+        """ Cache the results of :meth:`query`.
+
+        The cache keeps the results of up to ``maxsize`` queries holding
+        at most ``maxdocids`` docids between them, dropping the least
+        recently used results first.  It lives in memory, one cache per
+        ZODB connection, while the setting is stored in the catalog.
+
+        A cached result is used only while none of the indexes the query
+        uses has been written to through the catalog's ``index_doc``,
+        ``index_docs``, ``unindex_doc``, ``reindex_doc`` or ``clear``
+        methods since; to keep track of that, every such write increments
+        a persistent counter for each index it touches.  Indexes written
+        to directly must be invalidated with :meth:`invalidate_index`.
+        The cache is bypassed for queries against indexes with changes
+        which haven't been committed yet.
+
+        Cached results are shared between queries, so they must not be
+        modified."""
+        if self._generations is None:
+            generations = self.family.OO.BTree()
+            for name in self.keys():
+                generations[name] = Length()
+            self._generations = generations
+        self._query_cache_limits = (maxsize, maxdocids)
+
+    def disable_query_cache(self):
+        """ Stop caching the results of :meth:`query`. """
+        self._generations = None
+        self._query_cache_limits = None
+
+    @property
+    def query_cache(self):
+        """ The :class:`repoze.catalog.cache.LRUCache` holding the query
+        results cached for this connection, or None if the query cache
+        is disabled."""
+        limits = self._query_cache_limits
+        if limits is None:
+            return None
+        cache = getattr(self, '_v_query_cache', None)
+        if cache is None or (cache.maxsize, cache.maxcost) != limits:
+            cache = self._v_query_cache = LRUCache(*limits)
+        return cache
+
+    def invalidate_index(self, name):
+        """ Invalidate the cached query results which depend on the index
+        named ``name``. """
+        self._invalidate([name])
+
+    def _invalidate(self, names=None):
+        generations = self._generations
+        if generations is None:
+            return
+        if names is None:
+            names = self.keys()
+        for name in names:
+            generation = generations.get(name)
+            if generation is None:
+                generations[name] = Length()
+            else:
+                generation.change(1)
+
+    def _query_generations(self, queryobject):
+        # Return the current generations of the indexes used by the query,
+        # or None if some of those indexes have uncommitted changes.
+        generations = self._generations
+        if self._p_changed:
+            return None
+        result = []
+        for name in sorted(queryobject._index_names()):
+            generation = generations.get(name)
+            if generation is None or generation._p_changed:
+                return None
+            if self._p_jar is not None and generation._p_jar is None:
+                # added in the current transaction
+                return None
+            result.append((name, generation()))
+        return tuple(result)
+
+    def _evaluate(self, queryobject, names):
+        # Comparators which occur more than once in the query are applied
+        # only once (see ``Comparator._apply_once``).
+        self._v_shared_results = {}
+        try:
+            return queryobject._apply(self, names)
+        finally:
+            del self._v_shared_results
+
+    def _apply_query(self, queryobject, names):
+        cache = self.query_cache
+        if cache is None:
+            return self._evaluate(queryobject, names)
+        key = queryobject._cache_key(names)
+        if key is not None:
+            generations = self._query_generations(queryobject)
+            if generations is None:
+                key = None
+            else:
+                key = (generations, key)
+                try:
+                    hash(key)
+                except TypeError:
+                    # the query contains an unhashable value
+                    key = None
+        if key is None:
+            return self._evaluate(queryobject, names)
+        result = cache.get(key)
+        if result is None:
+            result = self._evaluate(queryobject, names)
+            cache.set(key, result, len(result))
+        return result
 
     def search(self, **query):
         """ Use the query terms to perform a query.  Return a tuple of
@@ -85,26 +258,32 @@ class Catalog(PersistentMapping):
             index_query_order = query.pop('index_query_order')
 
         if index_query_order is None:
-            # unordered query (use apply)
+            # unordered query (use apply, then apply_intersect once the
+            # results intersected so far are small)
+            result = None
             results = []
             for index_name, index_query in query.items():
                 index = self.get(index_name)
                 if index is None:
                     raise ValueError('No such index %s' % index_name)
-                r = index.apply(index_query)
+                if result is not None:
+                    result = r = index.apply_intersect(index_query, result)
+                else:
+                    r = index.apply(index_query)
                 if not r:
                     # empty results, bail early; intersect will be null
                     return EMPTY_RESULT
 
-                results.append((len(r), r))
-
-            if not results:
-                return EMPTY_RESULT
+                if result is None:
+                    results.append(r)
+                    if len(r) <= PROBE_LIMIT:
+                        # intersected from smallest to largest
+                        result = intersection(results, self.family)
 
-            results.sort(key=lambda x: x[0])  # order from smallest to largest
-            _, result = results.pop(0)
-            for _, r in results:
-                _, result = self.family.IF.weightedIntersection(result, r)
+            if result is None:
+                if not results:
+                    return EMPTY_RESULT
+                result = intersection(results, self.family)
 
             if not result:
                 EMPTY_RESULT
@@ -128,34 +307,178 @@ class Catalog(PersistentMapping):
         return self.sort_result(result, sort_index, limit, sort_type, reverse)
 
     def sort_result(self, result, sort_index=None, limit=None, sort_type=None,
-                    reverse=False):
+                    reverse=False, offset=0):
 
         numdocs = total = len(result)
 
         if sort_index:
-            index = self[sort_index]
-            result = index.sort(result, reverse=reverse, limit=limit,
-                                sort_type=sort_type)
-            if limit:
-                numdocs = min(numdocs, limit)
+            index = self._sort_index(sort_index)
+            result = _sort(index, result, reverse, limit, sort_type, offset)
+            numdocs = _page_size(numdocs, limit, offset)
         return ResultSetSize(numdocs, total), result
 
     def query(self, queryobject, sort_index=None, limit=None, sort_type=None,
-              reverse=False, names=None):
+              reverse=False, names=None, offset=0):
         """ Use the arguments to perform a query.  Return a tuple of
-        (num, resultseq)."""
+        (num, resultseq).
+
+        ``resultseq`` is a :class:`ResultSet`: the matching docids are
+        found right away, but they are sorted only once rows are taken
+        from it, and then only as many as are needed, so that
+        ``resultseq[20:30]`` sorts just enough docids to produce the
+        third page of ten.
+
+        If ``sort_index`` is given, the first ``offset`` sorted docids
+        are skipped and ``resultseq`` holds at most ``limit`` of the
+        docids after them."""
         try:
-            from repoze.catalog.query import parse_query
+            from repoze.catalog.query import parse_query_cached
             if isinstance(queryobject, text_type):
-                queryobject = parse_query(queryobject)
+                queryobject = parse_query_cached(queryobject)
         except ImportError:  # pragma NO COVERAGE
             pass
-        results = queryobject._apply(self, names)
-        return self.sort_result(results, sort_index, limit, sort_type, reverse)
+        results = self._apply_query(queryobject, names)
+
+        numdocs = total = len(results)
+        sort = None
+
+        if sort_index:
+            index = self._sort_index(sort_index)
+
+            def sort(docids, limit, offset):
+                return _sort(index, docids, reverse, limit, sort_type, offset)
+
+            numdocs = _page_size(numdocs, limit, offset)
+        else:
+            offset = 0
+        return (ResultSetSize(numdocs, total),
+                ResultSet(results, numdocs, sort, limit, offset))
 
     def apply(self, query):
         return self.search(**query)
 
+    def _sort_index(self, sort_index):
+        # the index to sort by: ``sort_index`` is either the name of an
+        # index or a sequence of (index name, reverse) pairs
+        if isinstance(sort_index, (list, tuple)):
+            return MultiIndexSort(
+                [(self[name], reverse) for name, reverse in sort_index],
+                self.family)
+        return self[sort_index]
+
+class MultiIndexSort(object):
+    """ Sorts docids by several indexes: ``keys`` is a sequence of
+    ``(index, reverse)`` pairs, the first of which decides the order of
+    docids, the second the order of docids which the first one can't
+    tell apart, and so on.
+
+    All but the last of the indexes have to provide a ``sort_groups``
+    method, like the field index does.  Ties are only broken within
+    each group of docids having the same value in the indexes before,
+    and with a ``limit`` no more groups are sorted than are needed to
+    produce that many docids.  Like sorting by a single index, docids
+    without a value in the first index are left out of the results;
+    docids without a value in a later index come last among the docids
+    they tie with."""
+
+    def __init__(self, keys, family=BTrees.family32):
+        keys = list(keys)
+        if not keys:
+            raise ValueError('no sort keys')
+        for index, reverse in keys[:-1]:
+            if not hasattr(index, 'sort_groups'):
+                raise ValueError('%r cannot break ties for another index' %
+                                 index)
+        self.keys = keys
+        self.family = family
+
+    def sort(self, docids, reverse=False, limit=None, sort_type=None,
+             offset=0):
+        """ Sort ``docids``, skipping ``offset`` of them and returning
+        at most ``limit`` after that.  If ``reverse`` is true, the order
+        of each of the sort keys is reversed.  Each index chooses its
+        own sort algorithm, so passing a ``sort_type`` raises
+        ValueError. """
+        if sort_type is not None:
+            raise ValueError('sort_type is not supported when sorting by '
+                             'several indexes')
+        keys = [(index, bool(key_reverse) != bool(reverse))
+                for index, key_reverse in self.keys]
+        stop = None
+        if limit is not None:
+            stop = offset + limit
+        result = self._sort(keys, docids, stop, True)
+        return itertools.islice(result, offset, stop)
+
+    def _sort(self, keys, docids, limit, first):
+        # generate the docids sorted by the keys, at least ``limit`` of
+        # them if there are as many
+        IF = self.family.IF
+        (index, reverse), keys = keys[0], keys[1:]
+        n = 0
+        if not keys:
+            result = index.sort(docids, reverse=reverse, limit=limit)
+            found = []
+            for docid in result:
+                yield docid
+                found.append(docid)
+            n = len(found)
+            found = IF.Set(found)
+        else:
+            groups = []
+            for group in index.sort_groups(docids, reverse=reverse,
+                                           limit=limit):
+                groups.append(group)
+                if len(group) == 1:
+                    result = group
+                else:
+                    remaining = None
+                    if limit is not None:
+                        remaining = limit - n
+                    result = self._sort(keys, group, remaining, False)
+                for docid in result:
+                    yield docid
+                    n += 1
+                if limit is not None and n >= limit:
+                    return
+            found = IF.multiunion(groups)
+        if not first and (limit is None or n < limit):
+            # ties without a value in this index go last
+            if len(found) < len(docids):
+                for docid in IF.difference(docids, found):
+                    yield docid
+
+def _sort(index, docids, reverse, limit, sort_type, offset):
+    # only pass an offset along when there is one, so that sort indexes
+    # which don't support offsets keep working without them
+    if not offset:
+        return index.sort(docids, reverse=reverse, limit=limit,
+                          sort_type=sort_type)
+    if _takes_offset(index.sort):
+        return index.sort(docids, reverse=reverse, limit=limit,
+                          sort_type=sort_type, offset=offset)
+    # sort the docids before the offset too and skip them here
+    stop = None
+    if limit is not None:
+        stop = offset + limit
+    result = index.sort(docids, reverse=reverse, limit=stop,
+                        sort_type=sort_type)
+    return itertools.islice(result, offset, stop)
+
+def _takes_offset(sort):
+    # does the sort method of an index accept an ``offset`` argument?
+    try:
+        spec = inspect.getfullargspec(sort)
+    except AttributeError:  # pragma NO COVERAGE (Python 2)
+        spec = inspect.getargspec(sort)
+    return 'offset' in spec[0] or spec[2] is not None
+
+def _page_size(numdocs, limit, offset):
+    numdocs = max(numdocs - offset, 0)
+    if limit:
+        numdocs = min(numdocs, limit)
+    return numdocs
+
 def assertint(docid):
     if not isinstance(docid, int):
         raise ValueError('%r is not an integer value; document ids must be '
@@ -217,4 +540,124 @@ def ResultSetSize(i, total):
     size.total = total
     return size
 
+class ResultSet(object):
+    """ The docids found by :meth:`Catalog.query`, in order.
+
+    The docids are sorted lazily, when they are first iterated over or
+    indexed; slicing the result set asks the sort index for no more
+    docids than the slice needs.  The sorted docids are kept, so
+    iterating over the result set again or taking further slices only
+    sorts again if more docids are needed than were sorted before, keeping
+    the docids sorted before in front.
+
+    ``len()`` of a result set is the number of docids it holds (the
+    query limit and offset applied) and its ``total`` attribute the number of
+    docids the query matched.  ``docids`` is the unsorted set of all
+    matching docids (weighted, if the query included a text query)."""
+
+    def __init__(self, docids, numdocs, sort=None, limit=None, offset=0):
+        self.docids = docids
+        self.total = len(docids)
+        self._numdocs = numdocs
+        self._sort = sort
+        self._limit = limit
+        self._offset = offset
+        self._rows = []
+        self._source = None
+        self._source_limit = None
+
+    def __len__(self):
+        return self._numdocs
+
+    def __bool__(self):
+        return self._numdocs > 0
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        numdocs = self._numdocs
+        if len(self._rows) < numdocs and self._too_few(numdocs):
+            # sort all of the rows rather than the few asked for so far
+            self._start(self._limit)
+        i = 0
+        while i < numdocs:
+            if i == len(self._rows) and not self._fetch(1):
+                return
+            yield self._rows[i]
+            i += 1
+
+    def __getitem__(self, index):
+        numdocs = self._numdocs
+        if isinstance(index, slice):
+            start, stop, step = index.indices(numdocs)
+            if step < 0:
+                # stop may be -1 here, which can't be used as a list index
+                rows = self._fill(start + 1)
+                return [rows[i] for i in range(start, stop, step)
+                        if i < len(rows)]
+            if start >= stop:
+                return []
+            if start > len(self._rows) and self._sort is not None:
+                # a later page: let the sort index skip the rows before
+                # it instead of sorting and keeping all of them
+                rows = list(self._sort(self.docids, stop - start,
+                                       self._offset + start))
+                return rows[::step]
+            rows = self._fill(stop)
+            return rows[start:stop:step]
+        if index < 0:
+            index += numdocs
+        if not 0 <= index < numdocs:
+            raise IndexError('result set index out of range')
+        rows = self._fill(index + 1)
+        if index >= len(rows):
+            raise IndexError('result set index out of range')
+        return rows[index]
+
+    def __contains__(self, docid):
+        if self._numdocs == self.total:
+            return docid in self.docids
+        return docid in self._fill(self._numdocs)
+
+    def _start(self, limit):
+        if self._sort is None:
+            source = iter(self.docids)
+        else:
+            source = iter(self._sort(self.docids, limit, self._offset))
+        rows = self._rows
+        if rows:
+            # sorting again may order ties differently; keep the rows
+            # already sorted and go on with the docids not among them
+            seen = set(rows)
+            source = (docid for docid in source if docid not in seen)
+        self._source = source
+        self._source_limit = limit
+
+    def _too_few(self, n):
+        # is the current source unable to produce n rows?
+        if self._source is None:
+            return True
+        source_limit = self._source_limit
+        return bool(source_limit) and source_limit < n
+
+    def _fetch(self, n):
+        # append up to n more rows; return the number appended
+        rows = self._rows
+        before = len(rows)
+        rows.extend(itertools.islice(self._source, n))
+        return len(rows) - before
+
+    def _fill(self, n):
+        # sort at least the first n rows (fewer if there aren't as many)
+        n = min(n, self._numdocs)
+        if len(self._rows) >= n:
+            return self._rows
+        if self._too_few(n):
+            if n < self._numdocs:
+                self._start(n)
+            else:
+                self._start(self._limit)
+        self._fetch(n - len(self._rows))
+        return self._rows
+
 EMPTY_RESULT = ResultSetSize(0, 0), ()
@@ -1,10 +1,33 @@
+import math
+
 from persistent import Persistent
 from ZODB.broken import Broken
 import BTrees
 
 from repoze.catalog.compat import text_type
+from repoze.catalog.roaring import roaring_set_type
+from repoze.catalog.setops import difference
+from repoze.catalog.setops import intersection
 
 _marker = ()
+_missing = object()
+
+# maps the name of each negated query type to the query type it negates
+_NEGATIONS = {
+    'NotEq': 'Eq',
+    'NotAny': 'Any',
+    'NotAll': 'All',
+    'NotInRange': 'InRange',
+    'DoesNotContain': 'Contains',
+    }
+
+# Constants of the probe-or-materialize cost model worked out in
+# benchmark/intersection.py: forward (value) lookups are FUDGE times as
+# expensive as reverse (docid) lookups, and OO/IO BTree buckets hold about
+# OOB/IOB items on average.
+FUDGE = 17.0
+OOB = 125
+IOB = 250
 
 
 class CatalogIndex(object):
@@ -20,21 +43,61 @@ class CatalogIndex(object):
         self.discriminator = discriminator
         self._not_indexed = self.family.IF.Set()
 
-    def index_doc(self, docid, object):
+    # True if the docid sets of the index are stored compressed (see
+    # enable_compression)
+    _compressed = False
+
+    # the docids of all documents known to the index, indexed or not
+    # (see docids); None until an index made by an older version of this
+    # package is first changed
+    _all_docids = None
+
+    def clear(self):
+        super(CatalogIndex, self).clear()
+        self._all_docids = self.family.IF.TreeSet(self._not_indexed)
+
+    def enable_compression(self):
+        """ Store the docid sets of this index compressed.
+
+        The docid sets are replaced by sets which are pickled the way
+        roaring bitmaps are laid out (see :mod:`repoze.catalog.roaring`);
+        in memory they remain ``IF.Set`` objects, so querying the index
+        works as before.  This makes large, dense docid sets much smaller
+        in the database, at the cost of storing each docid set as a
+        single record and of more CPU when loading and storing it."""
+        self._compressed = True
+        self._convert_docid_sets()
+
+    def disable_compression(self):
+        """ Store the docid sets of this index as plain BTrees sets
+        again. """
+        self._compressed = False
+        self._convert_docid_sets()
+
+    def _convert_docid_sets(self):
+        """ Replace the docid sets of the index with ones made by
+        ``_new_docid_set``. """
+        raise NotImplementedError(
+            "Compression is not supported for %s" % type(self).__name__)
+
+    def _new_docid_set(self, docids=(), type=None):
+        """ Return a new docid set holding ``docids`` for the index:
+        compressed if compression is enabled, else of ``type`` (an
+        ``IF.TreeSet`` by default). """
+        if self._compressed:
+            return roaring_set_type(self.family)(docids)
+        if type is None:
+            type = self.family.IF.TreeSet
+        return type(docids)
+
+    def discriminate(self, object, default):
+        """ Return the value of ``object`` that this index indexes, or
+        ``default`` if the object has no such value. """
         if callable(self.discriminator):
-            value = self.discriminator(object, _marker)
-        else:
-            value = getattr(object, self.discriminator, _marker)
-
-        if value is _marker:
-            # unindex the previous value
-            super(CatalogIndex, self).unindex_doc(docid)
-
-            # Store docid in set of unindexed docids
-            self._not_indexed.add(docid)
-
-            return None
+            return self.discriminator(object, default)
+        return getattr(object, self.discriminator, default)
 
+    def _check_value(self, value):
         if isinstance(value, Persistent):
             raise ValueError('Catalog cannot index persistent object %s' %
                              value)
@@ -43,24 +106,142 @@ class CatalogIndex(object):
             raise ValueError('Catalog cannot index broken object %s' %
                              value)
 
+    def index_doc(self, docid, object):
+        return self._index_value(docid, self.discriminate(object, _marker))
+
+    def _index_value(self, docid, value):
+        """ Index ``value`` (the result of ``discriminate``) for
+        ``docid``. """
+        if value is _marker:
+            if docid in self._not_indexed:
+                # nothing changed; don't write anything
+                return None
+
+            if self._is_indexed(docid):
+                # unindex the previous value
+                self.unindex_doc(docid)
+
+            # Store docid in set of unindexed docids
+            self._not_indexed.add(docid)
+            self._update_all_docids(docid)
+
+            return None
+
+        self._check_value(value)
+
         if docid in self._not_indexed:
             # Remove from set of unindexed docs if it was in there.
             self._not_indexed.remove(docid)
 
-        return super(CatalogIndex, self).index_doc(docid, value)
+        result = super(CatalogIndex, self).index_doc(docid, value)
+        self._update_all_docids(docid)
+        return result
+
+    def index_docs(self, docs):
+        """ Index each ``(docid, object)`` pair in the iterable ``docs``.
+
+        This is equivalent to calling ``index_doc`` for every pair;
+        indexes which can load many documents more cheaply than one at
+        a time override it. """
+        for docid, object in docs:
+            self.index_doc(docid, object)
+
+    def _discriminate_docs(self, docs):
+        """ Run the discriminator over each ``(docid, object)`` pair in
+        ``docs`` and return a dictionary mapping docids to the values to
+        index and a list of the docids of documents without a value.  If
+        a docid occurs more than once, its last object wins.  Nothing is
+        written to the index here, so a discriminator or value raising
+        an error leaves the index as it was. """
+        values = {}
+        for docid, object in docs:
+            value = self.discriminate(object, _marker)
+            if value is not _marker:
+                self._check_value(value)
+            values[docid] = value
+        missing = [docid for docid, value in values.items()
+                   if value is _marker]
+        for docid in missing:
+            del values[docid]
+        return values, missing
+
+    def _index_missing(self, docids):
+        """ Record each of ``docids`` as a document without a value, as
+        ``index_doc`` does. """
+        for docid in docids:
+            self._index_value(docid, _marker)
 
     def unindex_doc(self, docid):
         _not_indexed = self._not_indexed
         if docid in _not_indexed:
             _not_indexed.remove(docid)
         super(CatalogIndex, self).unindex_doc(docid)
+        self._update_all_docids(docid)
 
     def reindex_doc(self, docid, object):
-        """ Default reindex_doc implementation """
+        """ Default reindex_doc implementation.  Leaves the index alone
+        if the value of ``object`` is the one already indexed for
+        ``docid``.  Return True if the index changed, False if it
+        didn't. """
+        value = self.discriminate(object, _marker)
+        if value is _marker:
+            if docid in self._not_indexed:
+                return False
+        else:
+            self._check_value(value)
+            if (docid not in self._not_indexed and
+                    self._has_value(docid, value)):
+                return False
+        self._reindex_value(docid, value)
+        return True
+
+    def _reindex_value(self, docid, value):
         self.unindex_doc(docid)
-        self.index_doc(docid, object)
+        self._index_value(docid, value)
+
+    def _has_value(self, docid, value):
+        """ Return True if ``docid`` is indexed under ``value`` already,
+        so that indexing ``value`` again wouldn't change the index. """
+        return False
 
     def docids(self):
+        """ Return the docids of all documents known to the index, those
+        indexed with a value as well as those without one.
+
+        This is the set the index keeps up to date itself; it must not be
+        changed, nor handed out as a query result. """
+        all_docids = self._all_docids
+        if all_docids is None:
+            return self._compute_docids()
+        return all_docids
+
+    def _is_indexed(self, docid):
+        """ Return True if ``docid`` is indexed with a value.  Subclasses
+        override this with something cheaper. """
+        return docid in self._indexed()
+
+    def _update_all_docids(self, docid):
+        """ Add ``docid`` to or remove it from the set of all docids known
+        to the index after it changed; build the set first if the index
+        doesn't have one yet. """
+        all_docids = self._all_docids
+        if all_docids is None:
+            self._all_docids = self.family.IF.TreeSet(self._compute_docids())
+        elif docid in self._not_indexed or self._is_indexed(docid):
+            all_docids.insert(docid)
+        elif docid in all_docids:
+            all_docids.remove(docid)
+
+    def _add_all_docids(self, docids):
+        """ Add the newly indexed ``docids`` to the set of all docids
+        known to the index. """
+        all_docids = self._all_docids
+        if all_docids is None:
+            self._all_docids = self.family.IF.TreeSet(self._compute_docids())
+        else:
+            all_docids.update(docids)
+
+    def _compute_docids(self):
         not_indexed = self._not_indexed
         indexed = self._indexed()
         if len(not_indexed) == 0:
@@ -72,17 +253,127 @@ class CatalogIndex(object):
 
     def apply_intersect(self, query, docids):
         """ Default apply_intersect implementation """
+        if docids is not None:
+            operation = self._operation(query)
+            if operation is not None:
+                operator, args = operation
+                return self.apply_intersect_op(operator, docids, *args)
         result = self.apply(query)
         if docids is None:
             return result
-        return self.family.IF.weightedIntersection(result, docids)[1]
+        return intersection([result, docids], self.family)
+
+    def apply_intersect_op(self, operator, docids, *args):
+        """ Run the query method named ``'apply' + operator`` with
+        ``args`` and return its results intersected with the ``docids``
+        set that is supplied.  If ``docids`` is None, return the bare
+        query results.
+
+        When ``docids`` is small compared to the index, indexes which
+        can check a single docid against a query (see ``_matcher``)
+        probe each docid instead of computing the full query result.
+        Negated queries take the docids matching the positive query away
+        from ``docids`` rather than building their complement in all of
+        the docids of the index."""
+        if docids is not None:
+            positive = _NEGATIONS.get(operator)
+            match = self._matcher(positive or operator, *args)
+            if match is not None and self._probe_wins(operator, docids, *args):
+                result = self._probe(docids, match, positive is not None)
+                if hasattr(docids, 'items'):
+                    # keep the weights of a weighted (text) result
+                    result = intersection([result, docids], self.family)
+                return result
+            if positive is not None:
+                excluded = getattr(self, 'apply%s' % positive)(*args)
+                all_docids = self.docids()
+                if not all_docids:
+                    return self.family.IF.Set()
+                # the complement is taken within the docids of this index
+                docids = intersection([docids, all_docids], self.family)
+                return difference(docids, [excluded], self.family)
+        result = getattr(self, 'apply%s' % operator)(*args)
+        if docids is None:
+            return result
+        return intersection([result, docids], self.family)
+
+    def _operation(self, query):
+        """ Translate an ``apply`` query into an ``(operator, args)``
+        tuple suitable for ``apply_intersect_op``, or return None if the
+        index doesn't know how. """
+        return None
+
+    def _matcher(self, operator, *args):
+        """ Return a callable which accepts a value stored in the
+        ``_rev_index`` of this index and returns True if a document
+        indexed with that value matches the query ``'apply' + operator``
+        with ``args``.  Return None if the query can't be checked one
+        document at a time.  Subclasses provide matchers by implementing
+        methods named ``'_match' + operator``. """
+        method = getattr(self, '_match%s' % operator, None)
+        if method is None:
+            return None
+        return method(*args)
+
+    def _probe_wins(self, operator, docids, *args):
+        """ Return True if looking up each of ``docids`` in the reverse
+        index is expected to be cheaper than computing the query result
+        and intersecting it with ``docids``. """
+        n1 = len(docids)
+        numdocs = max(self.documentCount(), 2)
+        n2 = self.estimate(operator, *args)
+        if n2 is None:
+            n2 = numdocs
+        probe_cost = n1 * math.log(numdocs, IOB)
+        materialize_cost = FUDGE * math.log(numdocs, OOB) + max(n1, n2)
+        return probe_cost < materialize_cost
+
+    def _probe(self, docids, match, negate=False):
+        rev_index = self._rev_index
+        not_indexed = self._not_indexed
+        result = []
+        for docid in docids:
+            value = rev_index.get(docid, _missing)
+            if value is _missing:
+                # documents without a value only match negated queries
+                if negate and docid in not_indexed:
+                    result.append(docid)
+            elif match(value) != negate:
+                result.append(docid)
+        return self.family.IF.Set(result)
+
+    def estimate(self, operator, *args):
+        """ Return an estimate of the number of docids that the query
+        method named ``'apply' + operator`` would return when called
+        with ``args`` (e.g. ``estimate('Eq', 'foo')`` estimates
+        ``applyEq('foo')``), or ``None`` if the index can't tell
+        cheaply.  The query planner uses these estimates to decide in
+        which order to evaluate the children of ``And`` and ``Or``
+        nodes.
+
+        Subclasses provide estimates for a query type by implementing
+        a method named ``'_estimate' + operator``; negated query types
+        are estimated as the complement of their positive form."""
+        positive = _NEGATIONS.get(operator)
+        if positive is not None:
+            estimate = self.estimate(positive, *args)
+            if estimate is None:
+                return None
+            numdocs = self.documentCount() + len(self._not_indexed)
+            return max(numdocs - estimate, 0)
+        method = getattr(self, '_estimate%s' % operator, None)
+        if method is None:
+            return None
+        return method(*args)
 
     def _negate(self, assertion, *args, **kw):
         positive = assertion(*args, **kw)
         all = self.docids()
         if len(positive) == 0:
-            return all
-        return self.family.IF.difference(all, positive)
+            # a copy, as callers may change the result (or unindex the
+            # docids in it while iterating over it)
+            return self.family.IF.Set(all)
+        return difference(all, [positive], self.family)
 
     def applyContains(self, *args, **kw):
         raise NotImplementedError(
@@ -142,3 +433,4 @@ class CatalogIndex(object):
         docids = self.family.IF.Set(docids)
         indexed = self.family.IF.Set(self._indexed())
         self._not_indexed = self.family.IF.difference(docids, indexed)
+        self._all_docids = self.family.IF.TreeSet(self._compute_docids())
@@ -3,15 +3,16 @@ try:
 except ImportError:  # pragma no cover
     from md5 import new as md5
 
+import heapq
+
 from persistent import Persistent
 from zope.interface import implementer
 
+from repoze.catalog.indexes.common import _marker
 from repoze.catalog.indexes.keyword import CatalogKeywordIndex
 from repoze.catalog.interfaces import ICatalogIndex
 from repoze.catalog.compat import text_type
 
-_marker = ()
-
 
 @implementer(ICatalogIndex)
 class CatalogFacetIndex(CatalogKeywordIndex):
@@ -52,16 +53,17 @@ class CatalogFacetIndex(CatalogKeywordIndex):
         """ Pass in an integer document id and an object supporting a
         sequence of facet specifiers ala ['style:gucci:handbag'] via
         the discriminator"""
+        return self._index_value(docid, self.discriminate(object, _marker))
 
-        if callable(self.discriminator):
-            value = self.discriminator(object, _marker)
-        else:
-            value = getattr(object, self.discriminator, _marker)
-
+    def _index_value(self, docid, value):
         if value is _marker:
-            # unindex the previous value
-            self.unindex_doc(docid)
+            if docid in self._not_indexed:
+                return None
+            if self._is_indexed(docid):
+                # unindex the previous value
+                self.unindex_doc(docid)
             self._not_indexed.add(docid)
+            self._update_all_docids(docid)
             return None
 
         if isinstance(value, Persistent):
@@ -75,33 +77,65 @@ class CatalogFacetIndex(CatalogKeywordIndex):
         if old is not None:
             self.unindex_doc(docid)
 
-        changed = False
-
-        for facet in value:
-            L = []
-            categories = facet.split(':')
-            for category in categories:
-                L.append(category)
-                facet_candidate = ':'.join(L)
-                for fac in self.facets:
-                    if fac == facet_candidate:
-                        changed = True
-                        fwset = self._fwd_index.get(fac)
-                        if fwset is None:
-                            fwset = self.family.IF.Set()
-                            self._fwd_index[fac] = fwset
-                        fwset.insert(docid)
-                        revset = self._rev_index.get(docid)
-                        if revset is None:
-                            revset = self.family.OO.Set()
-                            self._rev_index[docid] = revset
-                        revset.insert(fac)
-
-        if changed:
+        facets = self._expand(value)
+
+        for fac in facets:
+            fwset = self._fwd_index.get(fac)
+            if fwset is None:
+                fwset = self._new_docid_set((), self.family.IF.Set)
+                self._fwd_index[fac] = fwset
+            fwset.insert(docid)
+            revset = self._rev_index.get(docid)
+            if revset is None:
+                revset = self.family.OO.Set()
+                self._rev_index[docid] = revset
+            revset.insert(fac)
+
+        if facets:
             self._num_docs.change(1)
 
+        self._update_all_docids(docid)
         return value
 
+    def _convert_docid_sets(self):
+        fwd_index = self._fwd_index
+        for facet in list(fwd_index.keys()):
+            fwd_index[facet] = self._new_docid_set(
+                fwd_index[facet], self.family.IF.Set)
+
+    def _has_value(self, docid, value):
+        old = self._rev_index.get(docid)
+        facets = self._expand(value)
+        if old is None:
+            return not facets
+        return list(old) == list(self.family.OO.Set(facets))
+
+    def _expand(self, value):
+        """ Return the facets of this index named by the facet
+        specifiers in ``value`` or by their ancestors. """
+        facets = []
+        for facet in value:
+            facets.extend(self._expand_facet(facet))
+        return facets
+
+    def _expand_facet(self, facet):
+        all_facets = self.facets
+        expanded = []
+        L = []
+        for category in facet.split(':'):
+            L.append(category)
+            facet_candidate = ':'.join(L)
+            if facet_candidate in all_facets:
+                expanded.append(facet_candidate)
+        return expanded
+
+    def index_docs(self, docs):
+        """ Index each ``(docid, object)`` pair in the iterable ``docs``
+        by calling ``index_doc`` for it; facet specifiers are expanded
+        per document, so the keyword index bulk loader doesn't apply. """
+        for docid, object in docs:
+            self.index_doc(docid, object)
+
     def counts(self, docids, omit_facets=()):
         """ Given a set of docids (usually returned from query),
         provide count information for further facet narrowing.
@@ -120,11 +154,19 @@ class CatalogFacetIndex(CatalogKeywordIndex):
         include_facets = self.family.OO.difference(self.facets,
                                                    effective_omits)
 
+        if _count_by_facet(len(include_facets), len(docids)):
+            return self._counts_by_facet(docids, include_facets)
+        return self._counts_by_docid(docids, include_facets)
+
+    def _counts_by_docid(self, docids, include_facets):
+        # look up the facets of each docid
         counts = {}
         isect_cache = {}
 
         for docid in docids:
             available_facets = self._rev_index.get(docid)
+            if available_facets is None:
+                continue
             ck = cachekey(available_facets)
             appropriate_facets = isect_cache.get(ck)
             if appropriate_facets is None:
@@ -138,6 +180,135 @@ class CatalogFacetIndex(CatalogKeywordIndex):
 
         return counts
 
+    def _counts_by_facet(self, docids, include_facets):
+        # intersect the docids of each facet with the docids
+        IF = self.family.IF
+        if not isinstance(docids, (IF.Set, IF.TreeSet, IF.Bucket, IF.BTree)):
+            docids = IF.Set(docids)
+        fwd_index = self._fwd_index
+        intersection = IF.intersection
+        counts = {}
+
+        for facet in include_facets:
+            facet_docids = fwd_index.get(facet)
+            if facet_docids is None:
+                continue
+            count = len(intersection(facet_docids, docids))
+            if count:
+                counts[facet] = count
+
+        return counts
+
+    def tree(self, docids, limit=None, depth=None):
+        """ Given a set of docids (usually returned from query), return
+        a :class:`FacetNode` counting them by facet hierarchy: its
+        children are the top-level facets, their children the facets
+        one level below, and so on.  The children of a node are only
+        counted when they are first asked for.
+
+        At most ``limit`` children are returned for each node (the ones
+        with the most docids), and nodes ``depth`` levels below the
+        returned node have no children; both default to no limit."""
+        IF = self.family.IF
+        if not isinstance(docids, (IF.Set, IF.TreeSet, IF.Bucket, IF.BTree)):
+            docids = IF.Set(docids)
+        return FacetNode(self, None, docids, limit, depth)
+
+    def _facet_children(self):
+        # Map each facet of this index (and None, for the top-level
+        # facets) to the facets whose nearest ancestor among the facets
+        # of this index it is.
+        children = {}
+        all_facets = self.facets
+        for fac in all_facets:
+            parent = None
+            categories = fac.split(':')[:-1]
+            while categories:
+                candidate = ':'.join(categories)
+                if candidate in all_facets:
+                    parent = candidate
+                    break
+                categories.pop()
+            children.setdefault(parent, []).append(fac)
+        return children
+
+
+class FacetNode(object):
+    """ A node of the facet tree returned by
+    :meth:`CatalogFacetIndex.tree`.
+
+    ``facet`` is the facet of the node (None for the root), ``name`` the
+    last category of the facet, ``docids`` the docids of the tree having
+    the facet and ``count`` their number.  ``children`` is the list of
+    child nodes having any docids, most docids first."""
+
+    def __init__(self, index, facet, docids, limit=None, depth=None,
+                 facet_children=None):
+        self.index = index
+        # shared by the nodes of a tree, computed when first needed
+        self._facet_children = facet_children
+        self.facet = facet
+        self.docids = docids
+        self.count = len(docids)
+        self.limit = limit
+        self.depth = depth
+        self._children = None
+
+    @property
+    def name(self):
+        if self.facet is None:
+            return None
+        return self.facet.split(':')[-1]
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = self._expand()
+        return self._children
+
+    def _expand(self):
+        depth = self.depth
+        if depth is not None:
+            if depth < 1:
+                return []
+            depth -= 1
+        index = self.index
+        fwd_index = index._fwd_index
+        intersection = index.family.IF.intersection
+        facet_children = self._facet_children
+        if facet_children is None:
+            facet_children = index._facet_children()
+        counted = []
+        for facet in facet_children.get(self.facet, ()):
+            facet_docids = fwd_index.get(facet)
+            if facet_docids is None:
+                continue
+            facet_docids = intersection(facet_docids, self.docids)
+            if facet_docids:
+                counted.append((len(facet_docids), facet, facet_docids))
+        # most docids first, then by facet
+        key = lambda item: (-item[0], item[1])
+        if self.limit is not None:
+            counted = heapq.nsmallest(self.limit, counted, key=key)
+        else:
+            counted.sort(key=key)
+        return [FacetNode(index, facet, facet_docids, self.limit, depth,
+                          facet_children)
+                for (count, facet, facet_docids) in counted]
+
+    def __repr__(self):
+        return '<FacetNode %r (%d)>' % (self.facet, self.count)
+
+
+def _count_by_facet(numfacets, numdocids):
+    """ Return True if counting facets by intersecting the docids of
+    each facet with the result is expected to be cheaper than looking
+    up the facets of each docid in the result.  Fitted to timings of
+    both: looking up the facets of a docid costs about as much as an
+    intersection with a small docid set, and intersecting adds about
+    1/2000 of that for each docid of the result. """
+    return numfacets * (1 + numdocids / 2000.0) < numdocids
+
 
 def cachekey(set):
     h = md5()
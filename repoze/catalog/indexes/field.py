@@ -1,6 +1,10 @@
 import bisect
 import heapq
 import itertools
+import math
+import operator
+import random
+import time
 
 from zope.interface import implementer
 
@@ -10,10 +14,16 @@ from repoze.catalog.interfaces import ICatalogIndex
 from repoze.catalog.indexes.common import CatalogIndex
 from repoze.catalog import RangeValue
 from repoze.catalog.compat import text_type
+from repoze.catalog.roaring import roaring_set_type
 
 _marker = []
 
+# the largest gap left between the ranks of neighbouring values (see
+# CatalogFieldIndex.enable_ranks)
+RANK_STEP = 1 << 16
+
 FWSCAN = 'fwscan'
+RVSCAN = 'rvscan'
 NBEST = 'nbest'
 TIMSORT = 'timsort'
 
@@ -49,6 +59,14 @@ class CatalogFieldIndex(CatalogIndex, FieldIndex):
     - NotInRange
     """
 
+    # the sort algorithm decision table made by ``calibrate_sort``;
+    # None means the built-in curve fits choose the algorithm
+    sort_table = None
+
+    # docid -> rank and value -> rank BTrees (see enable_ranks), or None
+    _ranks = None
+    _value_ranks = None
+
     def __init__(self, discriminator):
         if not callable(discriminator):
             if not isinstance(discriminator, text_type):
@@ -58,9 +76,177 @@ class CatalogFieldIndex(CatalogIndex, FieldIndex):
         self._not_indexed = self.family.IF.Set()
         self.clear()
 
-    def reindex_doc(self, docid, value):
+    def clear(self):
+        super(CatalogFieldIndex, self).clear()
+        if self._ranks is not None:
+            self._ranks = self.family.II.BTree()
+            self._value_ranks = self.family.OI.BTree()
+
+    def enable_ranks(self):
+        """ Maintain a rank table for sorting.
+
+        The rank table maps each indexed docid to an integer rank which
+        sorts like the value of the document, so that ``timsort`` and
+        ``nbest`` compare integers instead of arbitrary values and find
+        them in a single intersection instead of one reverse index
+        lookup per docid.  Ranks are spread out with gaps between them,
+        so that a new value usually gets a rank between those of its
+        neighbours without renumbering any other value; only once a gap
+        is used up are all ranks renumbered.  The table costs an extra
+        BTree write for every document indexed. """
+        self._renumber()
+
+    def disable_ranks(self):
+        """ Stop maintaining the rank table and sort by value again. """
+        self._ranks = None
+        self._value_ranks = None
+
+    def _renumber(self):
+        # (re)build the rank tables from the forward index, spreading
+        # the ranks of its values evenly around zero over half of the
+        # integer range, to leave room for new values at both ends
+        family = self.family
+        fwd_index = self._fwd_index
+        numvalues = len(fwd_index)
+        step = min(RANK_STEP,
+                   (family.maxint - family.minint) // (2 * (numvalues + 1)))
+        rank = -(step * numvalues // 2)
+        ranks = family.II.BTree()
+        value_ranks = family.OI.BTree()
+        for value, docids in fwd_index.items():
+            value_ranks[value] = rank
+            ranks.update(dict.fromkeys(docids, rank))
+            rank += step
+        self._ranks = ranks
+        self._value_ranks = value_ranks
+
+    def _rank_value(self, value):
+        # Return the rank of ``value``, an indexed value, giving it one
+        # between the ranks of its neighbours if it has none yet.
+        value_ranks = self._value_ranks
+        rank = value_ranks.get(value)
+        if rank is not None:
+            return rank
+        lo = hi = None
+        if value is None:
+            # None is the lowest key, but maxKey(None) and minKey(None)
+            # mean no bound at all
+            if value_ranks:
+                hi = value_ranks[value_ranks.minKey()]
+        else:
+            try:
+                # value isn't in value_ranks, so this is the next lower one
+                lo = value_ranks[value_ranks.maxKey(value)]
+            except ValueError:
+                pass
+            try:
+                hi = value_ranks[value_ranks.minKey(value)]
+            except ValueError:
+                pass
+        rank = _rank_between(lo, hi, self.family)
+        if rank is None:
+            # no room left between the neighbours
+            self._renumber()
+            return self._value_ranks[value]
+        value_ranks[value] = rank
+        return rank
+
+    def _index_value(self, docid, value):
+        result = super(CatalogFieldIndex, self)._index_value(docid, value)
+        if self._ranks is None and not self._compressed:
+            return result
+        value = self._rev_index.get(docid, _marker)
+        if value is _marker:
+            return result
+        if self._ranks is not None:
+            self._ranks[docid] = self._rank_value(value)
+        if self._compressed:
+            docids = self._fwd_index[value]
+            if not isinstance(docids, roaring_set_type(self.family)):
+                # the base index made a new, uncompressed set
+                self._fwd_index[value] = self._new_docid_set(docids)
+        return result
+
+    def _convert_docid_sets(self):
+        fwd_index = self._fwd_index
+        for value in list(fwd_index.keys()):
+            fwd_index[value] = self._new_docid_set(fwd_index[value])
+
+    def _ranked(self, docids):
+        # a mapping of those of ``docids`` which are indexed to their
+        # ranks
+        II = self.family.II
+        return II.weightedIntersection(self._ranks, II.Set(docids), 1, 0)[1]
+
+    def _reindex_value(self, docid, value):
         # the base index's index_doc method special-cases a reindex
-        return self.index_doc(docid, value)
+        self._index_value(docid, value)
+
+    def _has_value(self, docid, value):
+        return docid in self._fwd_index.get(value, ())
+
+    def index_docs(self, docs):
+        """ Index each ``(docid, object)`` pair in the iterable ``docs``.
+
+        Rather than inserting documents one at a time, the new entries
+        are sorted by value and each run of docids sharing a value is
+        added to the forward index at once; the reverse index is then
+        updated in docid order.  If any of the objects can't be indexed,
+        the error is raised before anything is written. """
+        rev_index = self._rev_index
+        fwd_index = self._fwd_index
+        not_indexed = self._not_indexed
+        values, missing = self._discriminate_docs(docs)
+        stale = []
+        added = []
+        for docid, value in values.items():
+            if docid in rev_index:
+                if docid in fwd_index.get(value, ()):
+                    # already up to date
+                    continue
+                stale.append(docid)
+            added.append((docid, value))
+
+        # comparing the values here, rather than while writing them,
+        # raises TypeError for those which can't be compared before
+        # anything is written
+        added.sort(key=_value_order)
+        runs = []
+        for value, run in itertools.groupby(added, key=_second):
+            fwd_index.get(value)
+            runs.append((value, [docid for docid, _ in run]))
+
+        self._index_missing(missing)
+        for docid in stale:
+            self.unindex_doc(docid)
+        if not added:
+            return
+
+        values = []
+        for value, docids in runs:
+            set = fwd_index.get(value)
+            if set is None:
+                fwd_index[value] = self._new_docid_set(docids)
+            else:
+                set.update(docids)
+            values.append(value)
+            for docid in docids:
+                if docid in not_indexed:
+                    not_indexed.remove(docid)
+
+        added.sort(key=_first)
+        rev_index.update(added)
+        self._num_docs.change(len(added))
+        self._add_all_docids([docid for docid, _ in added])
+
+        if self._ranks is not None:
+            # rank all of the values first, as ranking one of them may
+            # renumber the others
+            for value in values:
+                self._rank_value(value)
+            value_ranks = self._value_ranks
+            self._ranks.update(
+                [(docid, value_ranks[value]) for docid, value in added])
 
     def unindex_doc(self, docid):
         """See interface IInjection.
@@ -74,6 +260,7 @@ class CatalogFieldIndex(CatalogIndex, FieldIndex):
         rev_index = self._rev_index
         value = rev_index.get(docid, _marker)
         if value is _marker:
+            self._update_all_docids(docid)
             return  # not in index
 
         del rev_index[docid]
@@ -90,12 +277,25 @@ class CatalogFieldIndex(CatalogIndex, FieldIndex):
         if not set:
             del self._fwd_index[value]
 
+        if self._ranks is not None:
+            self._ranks.pop(docid, None)
+            if not set:
+                self._value_ranks.pop(value, None)
+
         self._num_docs.change(-1)
+        self._update_all_docids(docid)
+
+    def _is_indexed(self, docid):
+        return docid in self._rev_index
 
     def _indexed(self):
         return list(self._rev_index.keys())
 
-    def sort(self, docids, reverse=False, limit=None, sort_type=None):
+    def sort(self, docids, reverse=False, limit=None, sort_type=None,
+             offset=0):
+        """ Return the ``docids`` sorted by their values in this index,
+        skipping the first ``offset`` of them and returning no more than
+        ``limit`` after that. """
         if not docids:
             return []
 
@@ -108,12 +308,20 @@ class CatalogFieldIndex(CatalogIndex, FieldIndex):
             if limit < 1:
                 raise ValueError('limit must be 1 or greater')
 
+        offset = int(offset)
+        if offset < 0:
+            raise ValueError('offset must be 0 or greater')
+        if offset >= len(docids):
+            return []
+
         if reverse:
-            return self.sort_reverse(docids, limit, numdocs, sort_type)
+            return self.sort_reverse(docids, limit, numdocs, sort_type,
+                                     offset)
         else:
-            return self.sort_forward(docids, limit, numdocs, sort_type)
+            return self.sort_forward(docids, limit, numdocs, sort_type,
+                                     offset)
 
-    def sort_forward(self, docids, limit, numdocs, sort_type=None):
+    def sort_forward(self, docids, limit, numdocs, sort_type=None, offset=0):
 
         rlen = len(docids)
 
@@ -123,12 +331,21 @@ class CatalogFieldIndex(CatalogIndex, FieldIndex):
 
         if sort_type is None:
 
-            if fwscan_wins(limit, rlen, numdocs):
+            # every algorithm has to find the rows it skips before it
+            # can return the ones it doesn't, so they are chosen based
+            # on the number of rows up to the end of the page
+            stop = _stop(limit, offset)
+
+            if self.sort_table is not None:
+                sort_type = choose_sort_type(
+                    self.sort_table['forward'], stop, rlen, numdocs)
+
+            elif fwscan_wins(stop, rlen, numdocs):
                 # forward scan beats both n-best and timsort reliably
                 # if this is true
                 sort_type = FWSCAN
 
-            elif limit and nbest_ascending_wins(limit, rlen, numdocs):
+            elif stop and nbest_ascending_wins(stop, rlen, numdocs):
                 # nbest beats timsort reliably if this is true
                 sort_type = NBEST
 
@@ -136,61 +353,203 @@ class CatalogFieldIndex(CatalogIndex, FieldIndex):
                 sort_type = TIMSORT
 
         if sort_type == FWSCAN:
-            return self.scan_forward(docids, limit)
+            return self.scan_forward(docids, limit, offset)
         elif sort_type == NBEST:
             if limit is None:
                 raise ValueError('nbest requires a limit')
-            return self.nbest_ascending(docids, limit)
+            return self.nbest_ascending(docids, limit, offset)
         elif sort_type == TIMSORT:
-            return self.timsort_ascending(docids, limit)
+            return self.timsort_ascending(docids, limit, offset)
         else:
             raise ValueError('Unknown sort type %s' % sort_type)
 
-    def sort_reverse(self, docids, limit, numdocs, sort_type=None):
+    def sort_reverse(self, docids, limit, numdocs, sort_type=None, offset=0):
         if sort_type is None:
-            # XXX this needs work.
             rlen = len(docids)
-            if limit:
-                if (limit < 300) or (limit / float(rlen) > 0.09):
+            stop = _stop(limit, offset)
+            if self.sort_table is not None:
+                sort_type = choose_sort_type(
+                    self.sort_table['reverse'], stop, rlen, numdocs)
+            elif fwscan_wins(stop, rlen, numdocs):
+                # scanning from the largest value down costs about as
+                # much as a forward scan does
+                sort_type = RVSCAN
+            # XXX this needs work.
+            elif stop:
+                if (stop < 300) or (stop / float(rlen) > 0.09):
                     sort_type = NBEST
                 else:
                     sort_type = TIMSORT
             else:
                 sort_type = TIMSORT
 
-        if sort_type == NBEST:
+        if sort_type == RVSCAN:
+            return self.scan_reverse(docids, limit, offset)
+        elif sort_type == NBEST:
             if limit is None:
                 raise ValueError('nbest requires a limit')
-            return self.nbest_descending(docids, limit)
+            return self.nbest_descending(docids, limit, offset)
         elif sort_type == TIMSORT:
-            return self.timsort_descending(docids, limit)
+            return self.timsort_descending(docids, limit, offset)
         else:
             raise ValueError('Unknown sort type %s' % sort_type)
 
-    def scan_forward(self, docids, limit=None):
+    def sort_groups(self, docids, reverse=False, limit=None):
+        """ Yield those of ``docids`` which are indexed, grouped by
+        value: each group is a set of the docids having the same value,
+        and the groups come in the order of their values (descending if
+        ``reverse`` is true).  Stop early if ``limit`` is given and the
+        groups yielded so far hold at least ``limit`` docids.  Sorting
+        by several indexes uses this to break ties of this index. """
+        numdocs = self._num_docs.value
+        if not docids or not numdocs:
+            return
+        intersection = self.family.IF.intersection
+        fwd_index = self._fwd_index
+        if fwscan_wins(limit, len(docids), numdocs):
+            # scan the forward index, as a forward or reverse scan would
+            if reverse:
+                sets = _reversed_values(fwd_index, self.family.OO.Bucket)
+            else:
+                sets = fwd_index.values()
+        else:
+            # sort as usual, then take the docids having each of the
+            # values found (including those which the limit cut off)
+            rev_index = self._rev_index
+            sorted_docids = self.sort(docids, reverse=reverse, limit=limit)
+            sets = (fwd_index[value] for value, run in
+                    itertools.groupby(sorted_docids, key=rev_index.get))
+        n = 0
+        for set in sets:
+            group = intersection(set, docids)
+            if group:
+                yield group
+                n += len(group)
+                if limit and n >= limit:
+                    return
+
+    def calibrate_sort(self, rlens=None, limits=None, repeat=3, base=4,
+                       random=random):
+        """ Time the sort algorithms of this index against each other
+        and store the fastest one for each combination of result size
+        and limit in ``sort_table``, which ``sort`` then uses instead of
+        its built-in curve fits to choose an algorithm.  Return the
+        table.
+
+        ``rlens`` are the result sizes and ``limits`` the limits to
+        measure; both default to powers of ``base`` up to the number of
+        documents in the index.  Results are random samples of the
+        indexed docids, and each sort is timed ``repeat`` times, keeping
+        the fastest time.  Calibrating a large index takes a while, as
+        every sort algorithm is run over results of up to the size of
+        the whole index; it is meant to be done once on the machine the
+        index is deployed on (see ``benchmark/sortbench.py``), and
+        again once the index has grown a lot.  Setting ``sort_table``
+        to None goes back to the built-in curve fits.
+        """
+        numdocs = self._num_docs.value
+        if not numdocs:
+            raise ValueError('cannot calibrate an empty index')
+        if rlens is None:
+            rlens = _series(numdocs, base)
+        if limits is None:
+            limits = _series(numdocs, base)
+        all_docids = list(self._rev_index.keys())
+        forward = []
+        reverse = []
+        for rlen in sorted(set(rlens)):
+            rlen = min(rlen, numdocs)
+            docids = self.family.IF.Set(random.sample(all_docids, rlen))
+            forward.append(self._calibrate_row(
+                docids, numdocs, limits, repeat,
+                {FWSCAN: self.scan_forward,
+                 NBEST: self.nbest_ascending,
+                 TIMSORT: self.timsort_ascending}))
+            reverse.append(self._calibrate_row(
+                docids, numdocs, limits, repeat,
+                {RVSCAN: self.scan_reverse,
+                 NBEST: self.nbest_descending,
+                 TIMSORT: self.timsort_descending}))
+        self.sort_table = {
+            'numdocs': numdocs,
+            'forward': tuple(forward),
+            'reverse': tuple(reverse),
+            }
+        return self.sort_table
+
+    def _calibrate_row(self, docids, numdocs, limits, repeat, sorts):
+        # one row of a decision table: the result size ratio, the
+        # fastest algorithm for each limit ratio and the fastest one
+        # without a limit
+        def fastest(limit):
+            timings = []
+            for sort_type, sort in sorted(sorts.items()):
+                if limit is None and sort_type == NBEST:
+                    continue
+                timings.append((_time(sort, docids, limit, repeat), sort_type))
+            return min(timings)[1]
+
+        rlen = len(docids)
+        columns = []
+        for limit in sorted(set(limits)):
+            if limit < rlen:
+                columns.append((limit / float(numdocs), fastest(limit)))
+        return (rlen / float(numdocs), tuple(columns), fastest(None))
+
+    def scan_forward(self, docids, limit=None, offset=0):
+        return self._scan(self._fwd_index.values(), docids, limit, offset)
+
+    def scan_reverse(self, docids, limit=None, offset=0):
+        """ Like ``scan_forward``, but walk the forward index from its
+        largest value down. """
+        values = _reversed_values(self._fwd_index, self.family.OO.Bucket)
+        return self._scan(values, docids, limit, offset)
+
+    def _scan(self, sets, docids, limit, offset):
+        # the docids in ``docids`` which are in ``sets``, a sequence of
+        # docid sets of the forward index, in order
         def in_docids(value):
             return value in docids
 
+        sets = iter(sets)
+        head = ()
+        if offset:
+            # Skip a whole value at a time: intersecting the docids
+            # having a value with ``docids`` counts the rows to skip
+            # without checking every docid in Python.
+            intersection = self.family.IF.intersection
+            for set in sets:
+                matched = intersection(set, docids)
+                if len(matched) > offset:
+                    head = itertools.islice(matched, offset, None)
+                    break
+                offset -= len(matched)
+
         return itertools.islice(
-            filter(
-                in_docids, itertools.chain.from_iterable(
-                    self._fwd_index.values()
-                )
+            itertools.chain(
+                head, filter(in_docids, itertools.chain.from_iterable(sets))
             ),
             limit,
         )
 
-    def nbest_ascending(self, docids, limit):
+    def nbest_ascending(self, docids, limit, offset=0):
         if limit is None:  # pragma NO COVERAGE
             raise RuntimeError('n-best used without limit')
 
+        if self._ranks is not None:
+            ranked = self._ranked(docids)
+            pairs = zip(ranked.values(), ranked.keys())
+            for rank, docid in heapq.nsmallest(limit + offset, pairs)[offset:]:
+                yield docid
+            return
+
         # lifted from heapq.nsmallest
 
         h = nsort(docids, self._rev_index)
         it = iter(h)
-        result = sorted(itertools.islice(it, 0, limit))
+        result = sorted(itertools.islice(it, 0, limit + offset))
         if not result:  # pragma NO COVERAGE
-            raise StopIteration
+            return
         insort = bisect.insort
         pop = result.pop
         los = result[-1]    # los --> Largest of the nsmallest
@@ -201,37 +560,49 @@ class CatalogFieldIndex(CatalogIndex, FieldIndex):
             pop()
             los = result[-1]
 
-        for value, docid in result:
+        for value, docid in result[offset:]:
             yield docid
 
-    def nbest_descending(self, docids, limit):
+    def nbest_descending(self, docids, limit, offset=0):
         if limit is None:  # pragma NO COVERAGE
             raise RuntimeError('N-Best used without limit')
-        iterable = nsort(docids, self._rev_index)
-        for value, docid in heapq.nlargest(limit, iterable):
+        if self._ranks is not None:
+            ranked = self._ranked(docids)
+            iterable = zip(ranked.values(), ranked.keys())
+        else:
+            iterable = nsort(docids, self._rev_index)
+        for value, docid in heapq.nlargest(limit + offset, iterable)[offset:]:
             yield docid
 
-    def timsort_ascending(self, docids, limit):
-        return self._timsort(docids, limit, reverse=False)
+    def timsort_ascending(self, docids, limit, offset=0):
+        return self._timsort(docids, limit, reverse=False, offset=offset)
 
-    def timsort_descending(self, docids, limit):
-        return self._timsort(docids, limit, reverse=True)
+    def timsort_descending(self, docids, limit, offset=0):
+        return self._timsort(docids, limit, reverse=True, offset=offset)
 
-    def _timsort(self, docids, limit=None, reverse=False):
+    def _timsort(self, docids, limit=None, reverse=False, offset=0):
         n = 0
         marker = _marker
 
         def not_marker(docid):
             return self._rev_index.get(docid, marker) is not marker
 
+        if self._ranks is not None:
+            ranked = self._ranked(docids)
+            docids = ranked.keys()
+            key = ranked.__getitem__
+        else:
+            docids = filter(not_marker, docids)
+            key = self._rev_index.get
+
         for docid in itertools.islice(
             sorted(
-                filter(not_marker, docids),
-                key=self._rev_index.get,
+                docids,
+                key=key,
                 reverse=reverse,
             ),
-            0,
-            limit,
+            offset,
+            _stop(limit, offset),
         ):
             yield docid
             if limit and n >= limit:
@@ -304,6 +675,116 @@ class CatalogFieldIndex(CatalogIndex, FieldIndex):
                 start, end, excludemin=excludemin, excludemax=excludemax)
         )
 
+    def _operation(self, query):
+        if isinstance(query, dict):
+            if query.get('operator', 'or') != 'or':
+                return None
+            query = query['query']
+        elif isinstance(query, tuple) and len(query) == 2:
+            # b/w compat range query
+            query = RangeValue(*query)
+        if isinstance(query, RangeValue):
+            return 'InRange', query.as_tuple()
+        if isinstance(query, (list, tuple)):
+            for value in query:
+                if isinstance(value, RangeValue):
+                    return None
+            return 'Any', (query,)
+        return 'Eq', (query,)
+
+    def _matchEq(self, value):
+        if value is None or isinstance(value, (dict, list, tuple, RangeValue)):
+            # applyEq treats these as Any or range queries (None as a
+            # range without bounds)
+            return None
+        return lambda stored: stored == value
+
+    def _matchAny(self, values):
+        values = list(values)
+        for value in values:
+            if value is None or isinstance(value, RangeValue):
+                return None
+        return lambda stored: stored in values
+
+    def _matchGt(self, min_value):
+        return self._matchInRange(min_value, None, excludemin=True)
+
+    def _matchGe(self, min_value):
+        return self._matchInRange(min_value, None)
+
+    def _matchLt(self, max_value):
+        return self._matchInRange(None, max_value, excludemax=True)
+
+    def _matchLe(self, max_value):
+        return self._matchInRange(None, max_value)
+
+    def _matchInRange(self, start, end, excludemin=False, excludemax=False):
+        def match(stored):
+            if stored is None:
+                # None sorts before any other key in an OOBTree
+                return start is None
+            if start is not None:
+                if stored < start or (excludemin and stored == start):
+                    return False
+            if end is not None:
+                if stored > end or (excludemax and stored == end):
+                    return False
+            return True
+        return match
+
+    def _estimateEq(self, value):
+        if isinstance(value, (dict, list, tuple, RangeValue)):
+            # applyEq treats these as Any or range queries
+            return None
+        return len(self._fwd_index.get(value, ()))
+
+    def _estimateAny(self, values):
+        estimates = [self._estimateEq(value) for value in values]
+        if None in estimates:
+            return None
+        return min(sum(estimates), self._num_docs.value)
+
+    def _estimateGt(self, min_value):
+        return self._estimateInRange(min_value, None)
+
+    _estimateGe = _estimateGt
+
+    def _estimateLt(self, max_value):
+        return self._estimateInRange(None, max_value)
+
+    _estimateLe = _estimateLt
+
+    def _estimateInRange(self, start, end, excludemin=False,
+                         excludemax=False):
+        # Counting the docids in a range means walking it; instead
+        # guess that each bound of the range excludes half of the
+        # documents in the index.
+        estimate = self._num_docs.value
+        if start is not None:
+            estimate //= 2
+        if end is not None:
+            estimate //= 2
+        return estimate
+
+
+_first = operator.itemgetter(0)
+_second = operator.itemgetter(1)
+
+
+def _value_order(item):
+    # sort key for (docid, value) pairs: by value, then docid.  None
+    # sorts before everything else, as it does in the forward BTree.
+    docid, value = item
+    return (value is not None, value, docid)
+
+
+def _stop(limit, offset):
+    # the number of sorted rows needed to skip ``offset`` of them and
+    # then return ``limit`` more
+    if limit is None:
+        return None
+    return offset + limit
+
 
 def nsort(docids, rev_index):
     for docid in docids:
@@ -313,6 +794,101 @@ def nsort(docids, rev_index):
             continue
 
 
+def choose_sort_type(table, limit, rlen, numdocs):
+    """
+    Look up the sort algorithm for a limit/rlen/numdocs tuple in a
+    decision table made by ``CatalogFieldIndex.calibrate_sort``.  Sizes
+    are compared as ratios of the number of documents in the index, so
+    that a table stays useful while the index grows, and the nearest
+    measured ratios (on a logarithmic scale) are used.
+    """
+    docratio, columns, unlimited = _nearest(table, rlen / float(numdocs))
+    if not limit or limit >= rlen or not columns:
+        # the whole result has to be sorted
+        return unlimited
+    return _nearest(columns, limit / float(numdocs))[1]
+
+
+def _nearest(rows, ratio):
+    # the row of ``rows`` (sorted by ratio) whose ratio is nearest to
+    # ``ratio`` on a logarithmic scale
+    i = bisect.bisect_left(rows, (ratio,))
+    if i == len(rows):
+        return rows[-1]
+    if i == 0:
+        return rows[0]
+    below, above = rows[i - 1], rows[i]
+    if math.log(ratio / below[0]) <= math.log(above[0] / ratio):
+        return below
+    return above
+
+
+def _reversed_values(tree, bucket_type):
+    # Yield the values of an OOBTree from its largest key down.  BTrees
+    # can only be iterated over in ascending order, so instead walk the
+    # nodes of the tree (as found in their pickle state) from the right;
+    # only the buckets which are reached are loaded from the database.
+    state = tree.__getstate__()
+    if state is None:
+        # an empty tree
+        return
+    # the state of an inner node is ((child, key, child, ...), bucket),
+    # that of a tree small enough to have a single bucket is
+    # ((bucket state,),)
+    for child in reversed(state[0][::2]):
+        if isinstance(child, tuple):
+            items = child[0]
+        elif isinstance(child, bucket_type):
+            items = child.__getstate__()[0]
+        else:
+            for value in _reversed_values(child, bucket_type):
+                yield value
+            continue
+        # items is (key, value, key, value, ...)
+        for i in range(len(items) - 1, 0, -2):
+            yield items[i]
+
+
+def _rank_between(lo, hi, family):
+    # a rank between the ranks ``lo`` and ``hi`` of the neighbours of a
+    # new value (None if it has no neighbour on that side), no further
+    # than RANK_STEP from a single neighbour; None if there is no room
+    if lo is None and hi is None:
+        return 0
+    if lo is None:
+        rank = max(hi - RANK_STEP, (family.minint + hi) // 2)
+    elif hi is None:
+        rank = min(lo + RANK_STEP, (lo + family.maxint + 1) // 2)
+    else:
+        rank = (lo + hi) // 2
+    if rank == lo or rank == hi:
+        return None
+    return rank
+
+
+def _series(numdocs, base):
+    # powers of base up to and including numdocs
+    series = []
+    n = base
+    while n < numdocs:
+        series.append(n)
+        n *= base
+    series.append(numdocs)
+    return series
+
+
+def _time(sort, docids, limit, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for docid in sort(docids, limit):
+            pass
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
 def fwscan_wins(limit, rlen, numdocs):
     """
     Primitive curve-fitting to see if forward scan will beat both
@@ -41,13 +41,132 @@ class CatalogKeywordIndex(CatalogIndex, KeywordIndex):
         self._not_indexed = self.family.IF.Set()
         self.clear()
 
-    def reindex_doc(self, docid, value):
+    def _reindex_value(self, docid, value):
         # the base index' index_doc method special-cases a reindex
-        return self.index_doc(docid, value)
+        self._index_value(docid, value)
+
+    def _has_value(self, docid, value):
+        old = self._rev_index.get(docid)
+        if not value:
+            return old is None
+        if old is None or isinstance(value, str):
+            return False
+        return list(old) == list(self.family.OO.Set(self.normalize(value)))
+
+    def index_docs(self, docs):
+        """ Index each ``(docid, object)`` pair in the iterable ``docs``.
+
+        The docids of all new documents are collected per keyword, so
+        that each keyword's docid set is built or extended once per call
+        instead of once per document.  If any of the objects can't be
+        indexed, the error is raised before anything is written. """
+        rev_index = self._rev_index
+        fwd_index = self._fwd_index
+        not_indexed = self._not_indexed
+        OOSet = self.family.OO.Set
+        values, missing = self._discriminate_docs(docs)
+        emptied = []
+        stale = []
+        added = []
+        postings = {}
+        for docid in sorted(values):
+            seq = values[docid]
+            if isinstance(seq, str):
+                raise TypeError('seq argument must be a list/tuple of strings')
+            old = rev_index.get(docid)
+            if not seq:
+                emptied.append(docid)
+                continue
+            words = OOSet(self.normalize(seq))
+            if old is not None:
+                if list(old) == list(words):
+                    # already up to date
+                    continue
+                stale.append(docid)
+            added.append((docid, words))
+            for word in words:
+                docids = postings.get(word)
+                if docids is None:
+                    postings[word] = [docid]
+                else:
+                    docids.append(docid)
+
+        # comparing the keywords here, rather than while writing them,
+        # raises TypeError for those which can't be compared before
+        # anything is written
+        words = sorted(postings)
+        for word in words:
+            fwd_index.get(word)
+
+        self._index_missing(missing)
+        for docid in emptied:
+            if docid in rev_index:
+                self.unindex_doc(docid)
+            else:
+                if docid in not_indexed:
+                    not_indexed.remove(docid)
+                self._update_all_docids(docid)
+        for docid in stale:
+            self.unindex_doc(docid)
+        if not added:
+            return
+
+        for docid, _ in added:
+            if docid in not_indexed:
+                not_indexed.remove(docid)
+        for word in words:
+            docids = postings[word]
+            word_idx = fwd_index.get(word)
+            if word_idx is None:
+                fwd_index[word] = self._new_docid_set(
+                    docids, self._docid_set_type(len(docids)))
+            else:
+                word_idx.update(docids)
+                self._grow_docid_set(word, word_idx)
+
+        rev_index.update(added)
+        self._num_docs.change(len(added))
+        self._add_all_docids([docid for docid, _ in added])
+
+    def _insert_forward(self, docid, words):
+        # the base index would turn a compressed docid set into a TreeSet
+        # once it grows
+        fwd_index = self._fwd_index
+        for word in words:
+            word_idx = fwd_index.get(word)
+            if word_idx is None:
+                fwd_index[word] = word_idx = self._new_docid_set(
+                    (), self.family.IF.Set)
+            word_idx.insert(docid)
+            self._grow_docid_set(word, word_idx)
+
+    def _docid_set_type(self, size):
+        # the type of an uncompressed docid set holding ``size`` docids
+        if size >= self.tree_threshold:
+            return self.family.IF.TreeSet
+        return self.family.IF.Set
+
+    def _grow_docid_set(self, word, word_idx):
+        # turn a Set which grew too big into a TreeSet
+        IF = self.family.IF
+        if (not self._compressed and
+                not isinstance(word_idx, IF.TreeSet) and
+                len(word_idx) >= self.tree_threshold):
+            self._fwd_index[word] = IF.TreeSet(word_idx)
+
+    def _convert_docid_sets(self):
+        fwd_index = self._fwd_index
+        for word in list(fwd_index.keys()):
+            docids = fwd_index[word]
+            fwd_index[word] = self._new_docid_set(
+                docids, self._docid_set_type(len(docids)))
 
     def _indexed(self):
         return list(self._rev_index.keys())
 
+    def _is_indexed(self, docid):
+        return docid in self._rev_index
+
     def applyAny(self, values):
         return self.apply({'query': values, 'operator': 'or'})
 
@@ -58,3 +177,54 @@ class CatalogKeywordIndex(CatalogIndex, KeywordIndex):
 
     def applyEq(self, value):
         return self.apply([value])
+
+    def _operation(self, query):
+        operator = 'and'
+        if isinstance(query, dict):
+            operator = query.get('operator', operator)
+            query = query['query']
+        if isinstance(query, text_type):
+            query = [query]
+        if operator == 'or':
+            return 'Any', (query,)
+        elif operator == 'and':
+            return 'All', (query,)
+        return None
+
+    def _matchEq(self, value):
+        return self._matchAll([value])
+
+    def _matchAny(self, values):
+        values = self.normalize(values)
+        def match(stored):
+            for value in values:
+                if value in stored:
+                    return True
+            return False
+        return match
+
+    def _matchAll(self, values):
+        values = self.normalize(values)
+        def match(stored):
+            for value in values:
+                if value not in stored:
+                    return False
+            return bool(values)
+        return match
+
+    def _estimateEq(self, value):
+        return self._estimateAll([value])
+
+    def _estimateAny(self, values):
+        fwd_index = self._fwd_index
+        estimate = sum([len(fwd_index.get(value, ()))
+                        for value in self.normalize(values)])
+        return min(estimate, self._num_docs.value)
+
+    def _estimateAll(self, values):
+        fwd_index = self._fwd_index
+        lengths = [len(fwd_index.get(value, ()))
+                   for value in self.normalize(values)]
+        if not lengths:
+            return 0
+        return min(lengths)
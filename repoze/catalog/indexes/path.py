@@ -7,11 +7,10 @@ from BTrees.Length import Length
 
 from repoze.catalog.interfaces import ICatalogIndex
 from repoze.catalog.indexes.common import CatalogIndex
+from repoze.catalog.indexes.common import _marker
 from repoze.catalog.compat import text_type
 from six.moves import range
 
-_marker = ()
-
 
 @implementer(ICatalogIndex)
 class CatalogPathIndex(CatalogIndex):
@@ -55,6 +54,7 @@ class CatalogPathIndex(CatalogIndex):
         self._index = self.family.OO.BTree()
         self._unindex = self.family.IO.BTree()
         self._length = Length(0)
+        self._all_docids = self.family.IF.TreeSet(self._not_indexed)
 
     def insertEntry(self, comp, id, level):
         """Insert an entry.
@@ -68,24 +68,33 @@ class CatalogPathIndex(CatalogIndex):
             self._index[comp] = self.family.IO.BTree()
 
         if level not in self._index[comp]:
-            self._index[comp][level] = self.family.IF.TreeSet()
+            self._index[comp][level] = self._new_docid_set()
 
         self._index[comp][level].insert(id)
         if level > self._depth:
             self._depth = level
 
+    def _convert_docid_sets(self):
+        for levels in self._index.values():
+            for level in list(levels.keys()):
+                levels[level] = self._new_docid_set(levels[level])
+
     def index_doc(self, docid, object):
-        if callable(self.discriminator):
-            value = self.discriminator(object, _marker)
-        else:
-            value = getattr(object, self.discriminator, _marker)
+        return self._index_value(docid, self.discriminate(object, _marker))
 
+    def _index_value(self, docid, value):
         if value is _marker:
-            # unindex the previous value
-            self.unindex_doc(docid)
+            if docid in self._not_indexed:
+                # nothing changed; don't write anything
+                return None
+
+            if self._is_indexed(docid):
+                # unindex the previous value
+                self.unindex_doc(docid)
 
             # Store docid in set of unindexed docids
             self._not_indexed.add(docid)
+            self._update_all_docids(docid)
 
             return None
 
@@ -97,10 +106,7 @@ class CatalogPathIndex(CatalogIndex):
             # Remove from set of unindexed docs if it was in there.
             self._not_indexed.remove(docid)
 
-        path = value
-
-        if isinstance(path, (list, tuple)):
-            path = '/' + '/'.join(path[1:])
+        path = self._path(value)
 
         comps = [_f for _f in path.split('/') if _f]
 
@@ -111,14 +117,24 @@ class CatalogPathIndex(CatalogIndex):
             self.insertEntry(comp, docid, idx)
 
         self._unindex[docid] = path
+        self._update_all_docids(docid)
         return 1
 
+    def _has_value(self, docid, value):
+        return self._unindex.get(docid) == self._path(value)
+
+    def _path(self, value):
+        if isinstance(value, (list, tuple)):
+            return '/' + '/'.join(value[1:])
+        return value
+
     def unindex_doc(self, docid):
         _not_indexed = self._not_indexed
         if docid in _not_indexed:
             _not_indexed.remove(docid)
 
         if docid not in self._unindex:
+            self._update_all_docids(docid)
             return
 
         comps = self._unindex[docid].split('/')
@@ -139,10 +155,14 @@ class CatalogPathIndex(CatalogIndex):
 
         self._length.change(-1)
         del self._unindex[docid]
+        self._update_all_docids(docid)
 
     def _indexed(self):
         return list(self._unindex.keys())
 
+    def _is_indexed(self, docid):
+        return docid in self._unindex
+
     def search(self, path, default_level=0):
         """
         path is either a string representing a
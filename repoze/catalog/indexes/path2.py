@@ -5,6 +5,7 @@ import BTrees
 from repoze.catalog.interfaces import ICatalogIndex
 from repoze.catalog.indexes.common import CatalogIndex
 from repoze.catalog.compat import text_type
+from repoze.catalog.setops import intersection
 from six.moves import range
 
 _marker = object()
@@ -346,7 +347,7 @@ class CatalogPathIndex2(CatalogIndex):  # pragma NO COVERAGE
         result = self.apply(query)
         if docids is None:
             return result
-        return self.family.IF.weightedIntersection(result, docids)[1]
+        return intersection([result, docids], self.family)
 
     def apply(self, query):
         """ Search the path index using the query.  If ``query`` is a
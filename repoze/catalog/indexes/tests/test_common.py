@@ -58,6 +58,10 @@ class TestCatalogIndex(unittest.TestCase):
             'applyNotInRange']:
             self.assertRaises(NotImplementedError, getattr(index, name))
 
+    def test_enable_compression_not_implemented(self):
+        index = self._getTargetClass()('foo')
+        self.assertRaises(NotImplementedError, index.enable_compression)
+
     def test_index_doc_callback_returns_nondefault(self):
         klass = self._getTargetClass()
         class Test(klass, DummyIndex):
@@ -185,6 +189,38 @@ class TestCatalogIndex(unittest.TestCase):
         self.assertEqual(index.value, 'abc')
         self.assertEqual(set(index.docids()), set([1]))
 
+    def test_reindex_doc_returns_changed(self):
+        klass = self._getTargetClass()
+        class Test(klass, DummyIndex):
+            pass
+        index = Test('abc')
+        index._docids = set()
+        class Dummy:
+            abc = 'abc'
+        self.assertEqual(index.reindex_doc(1, Dummy()), True)
+        self.assertEqual(index.reindex_doc(2, object()), True)
+        self.assertEqual(set(index._not_indexed), set([2]))
+        self.assertEqual(index.reindex_doc(2, object()), False)
+        self.assertEqual(index.reindex_doc(2, Dummy()), True)
+        self.assertEqual(set(index._not_indexed), set())
+
+    def test_reindex_doc_unchanged(self):
+        klass = self._getTargetClass()
+        class Test(klass, DummyIndex):
+            def _has_value(self, docid, value):
+                return docid in self._docids and self.value == value
+        index = Test('abc')
+        index._docids = set()
+        class Dummy:
+            abc = 'abc'
+        dummy = Dummy()
+        index.index_doc(1, dummy)
+        self.assertEqual(index.reindex_doc(1, dummy), False)
+        self.assertFalse(hasattr(index, 'unindexed'))
+        dummy.abc = 'def'
+        self.assertEqual(index.reindex_doc(1, dummy), True)
+        self.assertEqual(index.value, 'def')
+
     def test_migrate_to_0_8_0(self):
         klass = self._getTargetClass()
         class Test(klass, DummyIndex):
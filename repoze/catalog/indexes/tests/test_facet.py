@@ -111,6 +111,34 @@ class TestCatalogFacetIndex(unittest.TestCase):
         self.assertFalse('foo:bar' in index._fwd_index)
         self.assertFalse(1 in index._rev_index)
 
+    def test_index_docs(self):
+        OTHER_FACETS = ['foo', 'foo:bar', 'foo:baz']
+        def _discrimintator(obj, default):
+            return obj
+        index = self._makeOne(_discrimintator, OTHER_FACETS)
+        index.index_docs([(1, ['foo:bar']), (2, ['foo:baz'])])
+        self.assertEqual(list(index._fwd_index['foo']), [1, 2])
+        self.assertEqual(list(index._fwd_index['foo:bar']), [1])
+        self.assertEqual(list(index._rev_index[2]), ['foo', 'foo:baz'])
+
+    def test_reindex_doc_returns_changed(self):
+        OTHER_FACETS = ['foo', 'foo:bar', 'foo:baz']
+        class Dummy:
+            pass
+        dummy = Dummy()
+        dummy.facets = ['foo:bar']
+        index = self._makeOne('facets', OTHER_FACETS)
+        index.index_doc(1, dummy)
+        self.assertEqual(index.reindex_doc(1, dummy), False)
+        dummy.facets = ['foo:baz', 'other']
+        self.assertEqual(index.reindex_doc(1, dummy), True)
+        self.assertEqual(list(index._rev_index[1]), ['foo', 'foo:baz'])
+        self.assertFalse('foo:bar' in index._fwd_index)
+        dummy.facets = ['other']
+        self.assertEqual(index.reindex_doc(1, dummy), True)
+        self.assertFalse(1 in index._rev_index)
+        self.assertEqual(index.reindex_doc(1, dummy), False)
+
     def test_index_doc_persistent_value_raises(self):
         from persistent import Persistent
         OTHER_FACETS = ['foo', 'foo:bar', 'foo:baz']
@@ -225,6 +253,125 @@ class TestCatalogFacetIndex(unittest.TestCase):
         counts = index.counts(result, search)
         self.assertEqual(counts, {'size:large':1})
 
+    def test_counts_strategies_agree(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        include = index.family.OO.difference(
+            index.facets, index.family.OO.Set(['style']))
+        for docids in ([1, 2, 3, 4, 99], index.family.IF.Set([2, 4, 99])):
+            self.assertEqual(index._counts_by_facet(docids, include),
+                             index._counts_by_docid(docids, include))
+
+    def test_counts_many_docids(self):
+        index = self._makeOne()
+        for docid in range(3000):
+            if docid % 2:
+                index.index_doc(docid, ['color:blue'])
+            else:
+                index.index_doc(docid, ['style:gucci:handbag', 'color:red'])
+        docids = index.family.IF.Set(range(0, 4000, 2))
+        counts = index.counts(docids, ['color'])
+        self.assertEqual(counts, {'style': 1500, 'style:gucci': 1500,
+                                  'style:gucci:handbag': 1500,
+                                  'color:red': 1500})
+        include = index.family.OO.difference(
+            index.facets, index.family.OO.Set(['color']))
+        self.assertEqual(counts, index._counts_by_docid(docids, include))
+
+    def test_tree(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        root = index.tree([1, 2, 3, 4, 99])
+        self.assertEqual(root.facet, None)
+        self.assertEqual(root.name, None)
+        self.assertEqual(root.count, 5)
+        self.assertEqual([(node.facet, node.count) for node in root.children],
+                         [('color', 3), ('price', 3), ('style', 3),
+                          ('size', 1)])
+        color, price, style, size = root.children
+        self.assertEqual([(node.facet, node.count) for node in color.children],
+                         [('color:blue', 3), ('color:red', 1)])
+        gucci, = style.children
+        self.assertEqual(gucci.name, 'gucci')
+        self.assertEqual(sorted(gucci.docids), [1, 2, 3])
+        self.assertEqual([(node.name, node.count) for node in gucci.children],
+                         [('dress', 1), ('handbag', 1)])
+        self.assertEqual(gucci.children[0].children, [])
+        self.assertEqual(size.children[0].facet, 'size:large')
+
+    def test_tree_limit_and_depth(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        root = index.tree(index.family.IF.Set([1, 2, 3]), limit=2, depth=2)
+        self.assertEqual([node.facet for node in root.children],
+                         ['color', 'price'])
+        color = root.children[0]
+        self.assertEqual([node.facet for node in color.children],
+                         ['color:blue', 'color:red'])
+        self.assertEqual(color.children[0].children, [])
+
+    def test_tree_is_lazy(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        root = index.tree([1, 2])
+        root.children
+        index._fwd_index = None
+        self.assertEqual(len(root.children), 3)
+        self.assertRaises(AttributeError, lambda: root.children[0].children)
+
+    def test_tree_missing_intermediate_facet(self):
+        index = self._makeOne(facets=['a', 'a:b:c', 'd:e'])
+        index.index_doc(1, ['a:b:c', 'd:e'])
+        root = index.tree([1])
+        self.assertEqual([node.facet for node in root.children], ['a', 'd:e'])
+        self.assertEqual([node.facet for node in root.children[0].children],
+                         ['a:b:c'])
+
+    def test_tree_facets_changed(self):
+        index = self._makeOne(facets=['a'])
+        index.index_doc(1, ['a'])
+        self.assertEqual(index.tree([1]).children[0].children, [])
+        index.facets.insert('a:b')
+        index.index_doc(1, ['a:b'])
+        root = index.tree([1])
+        self.assertEqual([node.facet for node in root.children[0].children],
+                         ['a:b'])
+
+    def test_enable_compression(self):
+        from repoze.catalog.roaring import RoaringIFSet
+        index = self._makeOne()
+        index.index_doc(1, ['color:blue'])
+        index.enable_compression()
+        index.index_doc(2, ['color:red'])
+        for facet in ('color', 'color:blue', 'color:red'):
+            self.assertTrue(isinstance(index._fwd_index[facet], RoaringIFSet))
+        self.assertEqual(index.counts([1, 2]),
+                         {'color': 2, 'color:blue': 1, 'color:red': 1})
+
+    def test__expand(self):
+        index = self._makeOne()
+        self.assertEqual(
+            index._expand(['style:gucci:handbag', 'color:green', 'size']),
+            ['style', 'style:gucci', 'style:gucci:handbag', 'color', 'size'])
+        self.assertEqual(index._expand(['style:gucci:handbag']),
+                         ['style', 'style:gucci', 'style:gucci:handbag'])
+        self.assertEqual(index._expand(['nope:color']), [])
+
+    def test__expand_facets_replaced(self):
+        index = self._makeOne()
+        self.assertEqual(index._expand(['color:blue']),
+                         ['color', 'color:blue'])
+        index.facets = index.family.OO.Set(['color:blue'])
+        self.assertEqual(index._expand(['color:blue']), ['color:blue'])
+
+    def test__expand_facets_changed(self):
+        index = self._makeOne()
+        index.index_doc(1, ['style:gucci:shoe'])
+        index.facets.insert('style:gucci:shoe')
+        index.index_doc(2, ['style:gucci:shoe'])
+        self.assertEqual(list(index._rev_index[2]),
+                         ['style', 'style:gucci', 'style:gucci:shoe'])
+
     def test__indexed(self):
         index = self._makeOne()
         self._populateIndex(index)
@@ -243,3 +390,19 @@ class TestCatalogFacetIndex(unittest.TestCase):
         self.assertEqual(index.index_doc(20, 'foo'), 'foo')
         self.assertFalse(20 in index._not_indexed)
 
+
+class Test_count_by_facet(unittest.TestCase):
+
+    def _callFUT(self, numfacets, numdocids):
+        from repoze.catalog.indexes.facet import _count_by_facet
+        return _count_by_facet(numfacets, numdocids)
+
+    def test_few_docids(self):
+        self.assertFalse(self._callFUT(100, 10))
+        self.assertFalse(self._callFUT(100, 100))
+        self.assertFalse(self._callFUT(1000, 1000))
+
+    def test_many_docids(self):
+        self.assertTrue(self._callFUT(100, 1000))
+        self.assertTrue(self._callFUT(1000, 10000))
+        self.assertTrue(self._callFUT(10, 100000))
@@ -77,6 +77,26 @@ class TestCatalogFieldIndex(unittest.TestCase):
         self.assertEqual(index.documentCount(), 1)
         self.assertEqual(index._rev_index[5], 2)
 
+    def test_reindex_doc_returns_changed(self):
+        index = self._makeOne()
+        index.index_doc(5, 1)
+        self.assertEqual(index.reindex_doc(5, 1), False)
+        self.assertEqual(index.reindex_doc(5, 2), True)
+        self.assertEqual(index.reindex_doc(5, _marker), True)
+        self.assertEqual(index.documentCount(), 0)
+        self.assertEqual(index.reindex_doc(5, _marker), False)
+        self.assertEqual(index.reindex_doc(5, 2), True)
+        self.assertEqual(index._rev_index[5], 2)
+        self.assertFalse(5 in index._not_indexed)
+
+    def test_reindex_doc_None_value(self):
+        index = self._makeOne()
+        index.index_doc(5, None)
+        self.assertEqual(index.reindex_doc(5, None), False)
+        self.assertEqual(index.reindex_doc(5, 1), True)
+        self.assertEqual(index._rev_index[5], 1)
+        self.assertFalse(None in index._fwd_index)
+
     def test_reindex_doc_w_new_docid(self):
         index = self._makeOne()
         index.index_doc(5, 1)
@@ -109,6 +129,232 @@ class TestCatalogFieldIndex(unittest.TestCase):
         self.assertFalse(5 in index._rev_index)
         self.assertTrue(1 in index._fwd_index)
 
+    def test_index_docs_same_as_index_doc(self):
+        docs = [(5, 1), (2, 2), (1, 1), (3, None), (4, 2), (6, _marker)]
+        expected = self._makeOne()
+        for docid, obj in docs:
+            expected.index_doc(docid, obj)
+        index = self._makeOne()
+        index.index_docs(iter(docs))
+        self.assertEqual(index.documentCount(), 5)
+        self.assertEqual(list(index._rev_index.items()),
+                         list(expected._rev_index.items()))
+        self.assertEqual(
+            [(k, list(v)) for k, v in index._fwd_index.items()],
+            [(k, list(v)) for k, v in expected._fwd_index.items()])
+        self.assertEqual(list(index._not_indexed), [6])
+
+    def test_enable_compression(self):
+        from repoze.catalog.roaring import RoaringIFSet
+        index = self._makeOne()
+        index.index_doc(1, 'a')
+        index.index_doc(2, 'a')
+        index.enable_compression()
+        index.index_doc(3, 'b')
+        index.index_docs([(4, 'c'), (5, 'a')])
+        for value in ('a', 'b', 'c'):
+            self.assertTrue(isinstance(index._fwd_index[value], RoaringIFSet))
+        self.assertEqual(list(index.applyEq('a')), [1, 2, 5])
+        self.assertEqual(list(index.sort([5, 4, 3])), [5, 3, 4])
+        index.disable_compression()
+        self.assertFalse(isinstance(index._fwd_index['a'], RoaringIFSet))
+        self.assertEqual(list(index._fwd_index['a']), [1, 2, 5])
+
+    def test_index_docs_w_existing_docids(self):
+        index = self._makeOne()
+        index.index_doc(1, 1)
+        index.index_doc(2, 1)
+        index.index_doc(3, _marker)
+        index.index_docs([(1, 1), (2, 2), (3, 2), (4, 1)])
+        self.assertEqual(index.documentCount(), 4)
+        self.assertEqual(list(index._fwd_index[1]), [1, 4])
+        self.assertEqual(list(index._fwd_index[2]), [2, 3])
+        self.assertEqual(dict(index._rev_index), {1: 1, 2: 2, 3: 2, 4: 1})
+        self.assertEqual(len(index._not_indexed), 0)
+
+    def test_index_docs_missing_value_unindexes(self):
+        index = self._makeOne()
+        index.index_doc(1, 1)
+        index.index_docs([(1, _marker), (2, 1)])
+        self.assertEqual(index.documentCount(), 1)
+        self.assertEqual(list(index._fwd_index[1]), [2])
+        self.assertEqual(list(index._not_indexed), [1])
+
+    def test_index_docs_last_duplicate_wins(self):
+        index = self._makeOne()
+        index.index_docs([(1, 1), (1, _marker), (2, _marker), (2, 3)])
+        self.assertEqual(dict(index._rev_index), {2: 3})
+        self.assertEqual(list(index._not_indexed), [1])
+
+    def test_index_docs_persistent_value_raises(self):
+        from persistent import Persistent
+        index = self._makeOne()
+        self.assertRaises(ValueError, index.index_docs, [(1, Persistent())])
+
+    def test_index_docs_error_writes_nothing(self):
+        from persistent import Persistent
+        index = self._makeOne()
+        index.index_doc(1, 1)
+        index.index_doc(2, _marker)
+        for docs in ([(1, 2), (2, 3), (3, Persistent())],
+                     [(1, 2), (2, 3), (3, 'a')],
+                     [(1, _marker), (3, 2), (4, (1, 2))]):
+            self.assertRaises((TypeError, ValueError), index.index_docs, docs)
+            self.assertEqual(index.documentCount(), 1)
+            self.assertEqual(dict(index._rev_index), {1: 1})
+            self.assertEqual(list(index._fwd_index.keys()), [1])
+            self.assertEqual(list(index._not_indexed), [2])
+            self.assertEqual(list(index.docids()), [1, 2])
+
+    def test_estimate_eq(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(12, 1)
+        self.assertEqual(index.estimate('Eq', 1), 2)
+        self.assertEqual(index.estimate('Eq', 99), 0)
+
+    def test_estimate_not_eq(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(12, 1)
+        index.index_doc(13, _marker)
+        self.assertEqual(index.estimate('NotEq', 1), 11)
+
+    def test_estimate_any(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(index.estimate('Any', [1, 2, 99]), 2)
+
+    def test_estimate_eq_sequence_or_range(self):
+        from repoze.catalog import RangeValue
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(index.estimate('Eq', [1, 2]), None)
+        self.assertEqual(index.estimate('Eq', {'query': 1}), None)
+        self.assertEqual(index.estimate('Eq', RangeValue(1, 2)), None)
+        self.assertEqual(index.estimate('NotEq', [1, 2]), None)
+        self.assertEqual(index.estimate('Any', [RangeValue(1, 2), 4]), None)
+
+    def test_estimate_ranges(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(index.estimate('Gt', 5), 5)
+        self.assertEqual(index.estimate('Le', 5), 5)
+        self.assertEqual(index.estimate('InRange', 3, 5, False, True), 2)
+        self.assertEqual(index.estimate('NotInRange', 3, 5, False, True), 9)
+
+    def test_estimate_unsupported(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(index.estimate('Contains', 1), None)
+        self.assertEqual(index.estimate('DoesNotContain', 1), None)
+
+    def test_apply_intersect_op_no_docids(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(list(index.apply_intersect_op('Eq', None, 3)), [1])
+
+    def test_apply_intersect_op_probes_small_docids(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.applyGt = lambda *args: 1 / 0
+        result = index.apply_intersect_op('Gt', IFSet([1, 2, 3, 4]), 3)
+        self.assertEqual(list(result), [3, 4])
+
+    def test_apply_intersect_op_probes_negated_query(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(12, _marker)
+        index.applyNotEq = lambda *args: 1 / 0
+        result = index.apply_intersect_op('NotEq', IFSet([1, 2, 12, 99]), 3)
+        self.assertEqual(list(result), [2, 12])
+
+    def test_apply_intersect_op_probes_keep_weights(self):
+        from BTrees.IFBTree import IFBucket
+        index = self._makeOne()
+        self._populateIndex(index)
+        docids = IFBucket([(1, 0.5), (2, 1.5)])
+        result = index.apply_intersect_op('InRange', docids, 2, 3)
+        self.assertEqual(list(result.keys()), [1, 2])
+        self.assertTrue(hasattr(result, 'items'))
+
+    def test_apply_intersect_op_None_value(self):
+        # applyEq(None) matches every document with a value; probing
+        # docids must not match fewer
+        from BTrees.IFBTree import IFSet
+        from BTrees.IFBTree import intersection
+        index = self._makeOne()
+        for i in range(1000):
+            index.index_doc(i, i % 10 or None)
+        for docids in (IFSet([0, 1, 2, 3]), IFSet(range(500))):
+            for operator, arg in [('Eq', None), ('Any', [None, 3]),
+                                  ('NotEq', None), ('NotAny', [None, 3])]:
+                expected = intersection(
+                    getattr(index, 'apply%s' % operator)(arg), docids)
+                result = index.apply_intersect_op(operator, docids, arg)
+                self.assertEqual(list(result), list(expected))
+
+    def test_apply_intersect_op_materializes_large_docids(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        for i in range(1000):
+            index.index_doc(i, i % 10)
+        index._rev_index = None
+        result = index.apply_intersect_op('Eq', IFSet(range(500)), 3)
+        self.assertEqual(list(result), list(range(3, 500, 10)))
+
+    def test_apply_intersect_op_negated_large_docids(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        for i in range(1000):
+            index.index_doc(i, i % 10)
+        index.index_doc(1000, _marker)
+        index._rev_index = None
+        index.applyNotEq = lambda *args: 1 / 0
+        docids = IFSet(list(range(0, 2000, 2)) + [1000])
+        result = index.apply_intersect_op('NotEq', docids, 4)
+        self.assertEqual(list(result),
+                         [i for i in range(0, 1001, 2) if i % 10 != 4])
+
+    def test_apply_intersect_op_unmatchable_value(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        self._populateIndex(index)
+        index._rev_index = None
+        result = index.apply_intersect_op('Eq', IFSet([1, 2, 3]), [3, 4])
+        self.assertEqual(list(result), [1, 3])
+
+    def test_apply_intersect_probes(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog import RangeValue
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(12, None)
+        index.apply = lambda *args: 1 / 0
+        docids = IFSet([1, 2, 3, 4, 12])
+        self.assertEqual(list(index.apply_intersect(3, docids)), [1])
+        self.assertEqual(list(index.apply_intersect([2, 5], docids)), [2, 4])
+        self.assertEqual(list(index.apply_intersect((4, 5), docids)), [3, 4])
+        self.assertEqual(
+            list(index.apply_intersect({'query': RangeValue(None, 2)},
+                                       docids)),
+            [2, 12])
+
+    def test_apply_intersect_unprobeable_query(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog import RangeValue
+        index = self._makeOne()
+        self._populateIndex(index)
+        index._rev_index = None
+        docids = IFSet([1, 2, 3, 4])
+        result = index.apply_intersect(
+            {'query': [1, 2], 'operator': 'and'}, docids)
+        self.assertEqual(list(result), [])
+        result = index.apply_intersect([RangeValue(1, 2), 4], docids)
+        self.assertEqual(list(result), [2, 3])
+
     def test_sort_no_docids(self):
         from BTrees.IFBTree import IFSet
         index = self._makeOne()
@@ -252,6 +498,86 @@ class TestCatalogFieldIndex(unittest.TestCase):
         result = index.sort(c1, limit=3, sort_type=FWSCAN)
         self.assertEqual(list(result), [5, 2, 1])
 
+    def test_sort_force_rvscan(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.indexes.field import RVSCAN
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5, 99])
+        result = index.sort(c1, reverse=True, sort_type=RVSCAN)
+        self.assertEqual(list(result), [4, 3, 1, 2, 5]) # 99 not present
+        result = index.sort(c1, reverse=True, limit=2, sort_type=RVSCAN)
+        self.assertEqual(list(result), [4, 3])
+        result = index.sort(c1, reverse=True, limit=2, sort_type=RVSCAN,
+                            offset=2)
+        self.assertEqual(list(result), [1, 2])
+
+    def test_sort_force_rvscan_not_reversed_raises(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.indexes.field import RVSCAN
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5])
+        self.assertRaises(ValueError, index.sort, c1, sort_type=RVSCAN)
+
+    def test_sort_noforce_reverse_rvscan(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        for docid in range(5000):
+            index.index_doc(docid, docid // 3)
+        c1 = IFSet(range(0, 5000, 2))
+        called = []
+        scan_reverse = index.scan_reverse
+        def dummy_scan_reverse(docids, limit, offset):
+            called.append((limit, offset))
+            return scan_reverse(docids, limit, offset)
+        index.scan_reverse = dummy_scan_reverse
+        result = index.sort(c1, reverse=True, limit=4)
+        # ties are in ascending docid order, as with a forward scan
+        self.assertEqual(list(result), [4998, 4996, 4992, 4994])
+        self.assertEqual(called, [(4, 0)])
+
+    def test_scan_reverse_many_values(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        for docid in range(5000):
+            index.index_doc(docid, -docid)
+        result = index.scan_reverse(IFSet(range(5000)))
+        self.assertEqual(list(result), list(range(5000)))
+        result = index.scan_reverse(IFSet(range(5000)), limit=3, offset=10)
+        self.assertEqual(list(result), [10, 11, 12])
+
+    def test_scan_reverse_loads_ghosts(self):
+        import transaction
+        from BTrees.IFBTree import IFSet
+        from ZODB.DB import DB
+        from ZODB.MappingStorage import MappingStorage
+        db = DB(MappingStorage())
+        try:
+            conn = db.open()
+            index = self._makeOne('value')
+            class Content(object):
+                def __init__(self, value):
+                    self.value = value
+            for docid in range(2000):
+                index.index_doc(docid, Content(docid))
+            conn.root()['index'] = index
+            transaction.commit()
+            conn.close()
+            conn = db.open()
+            index = conn.root()['index']
+            result = index.scan_reverse(IFSet([5, 1500, 1999]))
+            self.assertEqual(list(result), [1999, 1500, 5])
+            conn.close()
+        finally:
+            transaction.abort()
+            db.close()
+
+    def test_scan_reverse_empty_index(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        self.assertEqual(list(index.scan_reverse(IFSet([1, 2]))), [])
+
     def test_sort_force_timsort_no_limit(self):
         from BTrees.IFBTree import IFSet
         from repoze.catalog.indexes.field import TIMSORT
@@ -361,6 +687,82 @@ class TestCatalogFieldIndex(unittest.TestCase):
         result = index.sort(c1, reverse=True, limit=3, sort_type=NBEST)
         self.assertEqual(list(result), [4, 3, 1])
 
+    def test_sort_bad_offset(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5])
+        self.assertRaises(ValueError, index.sort, c1, offset=-1)
+
+    def test_sort_offset_past_end(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5])
+        self.assertEqual(list(index.sort(c1, offset=5)), [])
+
+    def test_sort_noforce_offset(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5])
+        result = index.sort(c1, limit=2, offset=1)
+        self.assertEqual(list(result), [2, 1])
+        result = index.sort(c1, reverse=True, limit=2, offset=1)
+        self.assertEqual(list(result), [3, 1])
+
+    def test_sort_force_fwscan_offset(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.indexes.field import FWSCAN
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5, 99])
+        for offset in range(6):
+            result = index.sort(c1, sort_type=FWSCAN, offset=offset)
+            self.assertEqual(list(result), [5, 2, 1, 3, 4][offset:])
+        result = index.sort(c1, limit=2, sort_type=FWSCAN, offset=2)
+        self.assertEqual(list(result), [1, 3])
+
+    def test_sort_force_fwscan_offset_within_value(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.indexes.field import FWSCAN
+        index = self._makeOne()
+        for docid in range(10):
+            index.index_doc(docid, docid // 4)
+        c1 = IFSet([1, 2, 3, 5, 6, 8, 9])
+        result = index.sort(c1, limit=3, sort_type=FWSCAN, offset=2)
+        self.assertEqual(list(result), [3, 5, 6])
+        result = index.sort(c1, sort_type=FWSCAN, offset=5)
+        self.assertEqual(list(result), [8, 9])
+
+    def test_sort_force_timsort_offset(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.indexes.field import TIMSORT
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5, 99])
+        result = index.sort(c1, sort_type=TIMSORT, offset=3)
+        self.assertEqual(list(result), [3, 4])
+        result = index.sort(c1, limit=2, sort_type=TIMSORT, offset=1)
+        self.assertEqual(list(result), [2, 1])
+        result = index.sort(c1, reverse=True, limit=2, sort_type=TIMSORT,
+                            offset=1)
+        self.assertEqual(list(result), [3, 1])
+
+    def test_sort_force_nbest_offset(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.indexes.field import NBEST
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5, 99])
+        result = index.sort(c1, limit=2, sort_type=NBEST, offset=2)
+        self.assertEqual(list(result), [1, 3])
+        result = index.sort(c1, limit=3, sort_type=NBEST, offset=3)
+        self.assertEqual(list(result), [3, 4])
+        result = index.sort(c1, reverse=True, limit=2, sort_type=NBEST,
+                            offset=2)
+        self.assertEqual(list(result), [1, 2])
+
     def test_search_single_range_querymember_or(self):
         index = self._makeOne()
         self._populateIndex(index)
@@ -653,6 +1055,59 @@ class TestCatalogFieldIndex(unittest.TestCase):
             set(index.docids()),
             set((1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11)))
 
+    def test_docids_maintained(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(20, _marker)
+        index.index_docs([(21, 1), (22, _marker)])
+        index._indexed = lambda: 1/0
+        self.assertEqual(list(index.docids()),
+                         list(range(1, 12)) + [20, 21, 22])
+        self.assertTrue(index.docids() is index._all_docids)
+        index.unindex_doc(21)
+        index.unindex_doc(20)
+        index.clear()
+        self.assertEqual(list(index.docids()), [22])
+
+    def test_docids_of_old_index(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index._all_docids = None
+        self.assertEqual(list(index.docids()), list(range(1, 12)))
+        self.assertEqual(index._all_docids, None)
+        index.index_doc(20, _marker)
+        self.assertEqual(list(index._all_docids), list(range(1, 12)) + [20])
+
+    def test_index_doc_missing_value_again(self):
+        index = self._makeOne()
+        index.index_doc(1, _marker)
+        index.unindex_doc = lambda docid: 1 / 0
+        index._update_all_docids = lambda docid: 1 / 0
+        index.index_doc(1, _marker)
+        self.assertEqual(list(index._not_indexed), [1])
+        self.assertEqual(list(index.docids()), [1])
+
+    def test_index_doc_missing_value_after_value(self):
+        index = self._makeOne()
+        index.index_doc(1, 5)
+        index.index_doc(1, _marker)
+        self.assertEqual(list(index._not_indexed), [1])
+        self.assertEqual(list(index.applyEq(5)), [])
+        self.assertEqual(list(index.docids()), [1])
+
+    def test_negation_returns_copy_of_docids(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        for docid in range(500):
+            index.index_doc(docid, docid % 7)
+        result = index.applyNotEq(99)
+        self.assertFalse(result is index.docids())
+        for docid in result:
+            index.unindex_doc(docid)
+        self.assertEqual(list(index.docids()), [])
+        result = index.apply_intersect_op('NotEq', IFSet(range(5)), 99)
+        self.assertFalse(result is index.docids())
+
     def test_unindex_doc_removes_from_docids(self):
         index = self._makeOne()
         index.index_doc(20, _marker)
@@ -694,6 +1149,273 @@ class TestCatalogFieldIndex(unittest.TestCase):
         index.index_doc(2, _marker)
         self.assertEqual(set([1, 2]), set(index.docids()))
 
+    def _checkRanks(self, index):
+        # the rank table agrees with the forward and reverse indexes
+        ranks = index._ranks
+        value_ranks = index._value_ranks
+        self.assertEqual(list(value_ranks.keys()),
+                         list(index._fwd_index.keys()))
+        self.assertEqual(sorted(value_ranks.values()),
+                         list(value_ranks.values()))
+        self.assertEqual(len(set(value_ranks.values())), len(value_ranks))
+        self.assertEqual(list(ranks.keys()), list(index._rev_index.keys()))
+        for docid, value in index._rev_index.items():
+            self.assertEqual(ranks[docid], value_ranks[value])
+
+    def test_enable_ranks(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.enable_ranks()
+        self._checkRanks(index)
+        index.index_doc(20, 5)
+        index.index_doc(21, 5.5)
+        index.index_doc(22, 0)
+        index.index_doc(23, 100)
+        index.index_doc(5, 4.5)
+        index.unindex_doc(4)
+        index.index_doc(6, _marker)
+        self._checkRanks(index)
+        self.assertFalse(9 in index._value_ranks)
+        self.assertFalse(1 in index._value_ranks)
+        index.reindex_doc(2, 50)
+        self._checkRanks(index)
+        index.disable_ranks()
+        self.assertEqual(index._ranks, None)
+        index.index_doc(24, 3)
+        self.assertEqual(index._value_ranks, None)
+
+    def test_ranks_renumbered_when_gap_used_up(self):
+        from repoze.catalog.indexes.field import RANK_STEP
+        index = self._makeOne()
+        index.enable_ranks()
+        index.index_doc(1, 0)
+        index.index_doc(2, 1)
+        self.assertEqual(index._ranks[2] - index._ranks[1], RANK_STEP)
+        value = 1.0
+        for docid in range(3, 40):
+            # always insert right above the smallest value
+            value /= 2
+            index.index_doc(docid, value)
+        self._checkRanks(index)
+        # appending values keeps working once the range is used up
+        for docid in range(40, 100):
+            index.index_doc(docid, docid * 2 ** 26)
+        self._checkRanks(index)
+
+    def test_ranks_index_docs(self):
+        index = self._makeOne()
+        index.enable_ranks()
+        index.index_docs([(docid, docid % 7) for docid in range(50)])
+        self._checkRanks(index)
+        index.index_docs([(docid, docid % 5 + 0.5)
+                          for docid in range(0, 60, 2)])
+        self._checkRanks(index)
+
+    def test_ranks_clear(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.enable_ranks()
+        index.clear()
+        self.assertEqual(len(index._ranks), 0)
+        self.assertEqual(len(index._value_ranks), 0)
+
+    def test_sort_w_ranks(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.indexes.field import FWSCAN
+        from repoze.catalog.indexes.field import NBEST
+        from repoze.catalog.indexes.field import RVSCAN
+        from repoze.catalog.indexes.field import TIMSORT
+        index = self._makeOne()
+        for docid in range(200):
+            index.index_doc(docid, (docid * 37) % 50)
+        c1 = IFSet(range(0, 300, 3))
+        expected = {}
+        cases = [(False, FWSCAN), (False, NBEST), (False, TIMSORT),
+                 (True, RVSCAN), (True, NBEST), (True, TIMSORT)]
+        for reverse, sort_type in cases:
+            for limit, offset in ((None, 0), (5, 0), (5, 10), (None, 60)):
+                if sort_type == NBEST and limit is None:
+                    continue
+                expected[reverse, sort_type, limit, offset] = list(
+                    index.sort(c1, reverse=reverse, limit=limit,
+                               sort_type=sort_type, offset=offset))
+        index.enable_ranks()
+        for (reverse, sort_type, limit, offset), result in expected.items():
+            self.assertEqual(
+                list(index.sort(c1, reverse=reverse, limit=limit,
+                                sort_type=sort_type, offset=offset)),
+                result)
+
+    def test_sort_w_ranks_None_value(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.indexes.field import FWSCAN
+        from repoze.catalog.indexes.field import TIMSORT
+        index = self._makeOne()
+        for docid in range(10):
+            index.index_doc(docid, docid % 5 + 1)
+        index.enable_ranks()
+        index.index_doc(10, None)
+        c1 = IFSet(range(11))
+        expected = list(index.sort(c1, sort_type=FWSCAN))
+        self.assertEqual(expected[0], 10)
+        self.assertEqual(list(index.sort(c1, sort_type=TIMSORT)), expected)
+        self.assertTrue(index._ranks[10] < index._ranks[0])
+
+    def test_sort_groups(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        for docid in range(30):
+            index.index_doc(docid, docid % 4)
+        c1 = IFSet([1, 2, 5, 6, 9, 12, 99])
+        groups = [list(group) for group in index.sort_groups(c1)]
+        self.assertEqual(groups, [[12], [1, 5, 9], [2, 6]])
+        groups = [list(group) for group in
+                  index.sort_groups(c1, reverse=True, limit=2)]
+        self.assertEqual(groups, [[2, 6]])
+        groups = [list(group) for group in
+                  index.sort_groups(c1, reverse=True, limit=3)]
+        self.assertEqual(groups, [[2, 6], [1, 5, 9]])
+        self.assertEqual(list(index.sort_groups(IFSet())), [])
+
+    def test_sort_groups_without_scan(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        for docid in range(5000):
+            index.index_doc(docid, docid % 1000)
+        c1 = IFSet([1, 1001, 2001, 7, 8, 1008])
+        for limit in (None, 1, 2):
+            groups = [list(group) for group in
+                      index.sort_groups(c1, limit=limit)]
+            self.assertEqual(groups, [[1, 1001, 2001], [7], [8, 1008]][
+                :limit and 1])
+        groups = [list(group) for group in
+                  index.sort_groups(c1, reverse=True, limit=4)]
+        self.assertEqual(groups, [[8, 1008], [7], [1, 1001, 2001]])
+
+    def test_calibrate_sort(self):
+        import random
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.indexes.field import FWSCAN
+        from repoze.catalog.indexes.field import NBEST
+        from repoze.catalog.indexes.field import RVSCAN
+        from repoze.catalog.indexes.field import TIMSORT
+        index = self._makeOne()
+        for docid in range(100):
+            index.index_doc(docid, 100 - docid)
+        table = index.calibrate_sort(repeat=1, random=random.Random(0))
+        self.assertTrue(index.sort_table is table)
+        self.assertEqual(table['numdocs'], 100)
+        forward = table['forward']
+        self.assertEqual([row[0] for row in forward], [0.04, 0.16, 0.64, 1.0])
+        self.assertEqual(forward[0][1], ())
+        self.assertEqual([ratio for ratio, sort_type in forward[-1][1]],
+                         [0.04, 0.16, 0.64])
+        for row in forward:
+            self.assertTrue(row[2] in (FWSCAN, TIMSORT))
+            for ratio, sort_type in row[1]:
+                self.assertTrue(sort_type in (FWSCAN, NBEST, TIMSORT))
+        for row in table['reverse']:
+            self.assertTrue(row[2] in (RVSCAN, TIMSORT))
+            for ratio, sort_type in row[1]:
+                self.assertTrue(sort_type in (RVSCAN, NBEST, TIMSORT))
+        c1 = IFSet([3, 1, 2])
+        self.assertEqual(list(index.sort(c1)), [3, 2, 1])
+        self.assertEqual(list(index.sort(c1, limit=1)), [3])
+        self.assertEqual(list(index.sort(c1, reverse=True, limit=2)), [1, 2])
+
+    def test_calibrate_sort_empty_index(self):
+        index = self._makeOne()
+        self.assertRaises(ValueError, index.calibrate_sort)
+
+    def test_sort_uses_sort_table(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.indexes.field import FWSCAN
+        from repoze.catalog.indexes.field import NBEST
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.sort_table = {
+            'numdocs': 10,
+            'forward': ((0.5, ((0.1, NBEST),), FWSCAN),),
+            'reverse': ((0.5, (), NBEST),),
+            }
+        called = []
+        def scan_forward(docids, limit, offset):
+            called.append('scan_forward')
+            return []
+        def nbest_ascending(docids, limit, offset):
+            called.append('nbest_ascending')
+            return []
+        def nbest_descending(docids, limit, offset):
+            called.append('nbest_descending')
+            return []
+        index.scan_forward = scan_forward
+        index.nbest_ascending = nbest_ascending
+        index.nbest_descending = nbest_descending
+        c1 = IFSet([1, 2, 3, 4, 5])
+        index.sort(c1)
+        index.sort(c1, limit=1)
+        index.sort(c1, reverse=True, limit=1)
+        self.assertEqual(called, ['scan_forward', 'nbest_ascending',
+                                  'nbest_descending'])
+
+
+class Test_rank_between(unittest.TestCase):
+
+    def _callFUT(self, lo, hi):
+        import BTrees
+        from repoze.catalog.indexes.field import _rank_between
+        return _rank_between(lo, hi, BTrees.family32)
+
+    def test_no_neighbours(self):
+        self.assertEqual(self._callFUT(None, None), 0)
+
+    def test_between(self):
+        self.assertEqual(self._callFUT(0, 10), 5)
+        self.assertEqual(self._callFUT(-3, 0), -2)
+        self.assertEqual(self._callFUT(0, 1), None)
+
+    def test_ends(self):
+        from repoze.catalog.indexes.field import RANK_STEP
+        self.assertEqual(self._callFUT(0, None), RANK_STEP)
+        self.assertEqual(self._callFUT(None, 0), -RANK_STEP)
+        self.assertEqual(self._callFUT(2 ** 31 - 3, None), 2 ** 31 - 2)
+        self.assertEqual(self._callFUT(2 ** 31 - 1, None), None)
+        self.assertEqual(self._callFUT(None, -2 ** 31 + 1), -2 ** 31)
+        self.assertEqual(self._callFUT(None, -2 ** 31), None)
+
+
+class Test_choose_sort_type(unittest.TestCase):
+
+    def _callFUT(self, table, limit, rlen, numdocs):
+        from repoze.catalog.indexes.field import choose_sort_type
+        return choose_sort_type(table, limit, rlen, numdocs)
+
+    table = (
+        (0.01, ((0.001, 'a'), (0.005, 'b')), 'c'),
+        (0.1, ((0.001, 'd'), (0.05, 'e')), 'f'),
+        (1.0, (), 'g'),
+        )
+
+    def test_no_limit(self):
+        self.assertEqual(self._callFUT(self.table, None, 10, 1000), 'c')
+        self.assertEqual(self._callFUT(self.table, None, 100, 1000), 'f')
+        self.assertEqual(self._callFUT(self.table, None, 1000, 1000), 'g')
+
+    def test_nearest_rlen(self):
+        self.assertEqual(self._callFUT(self.table, None, 1, 1000), 'c')
+        self.assertEqual(self._callFUT(self.table, None, 32, 1000), 'f')
+        self.assertEqual(self._callFUT(self.table, None, 31, 1000), 'c')
+        self.assertEqual(self._callFUT(self.table, None, 5000, 1000), 'g')
+
+    def test_w_limit(self):
+        self.assertEqual(self._callFUT(self.table, 1, 10, 1000), 'a')
+        self.assertEqual(self._callFUT(self.table, 4, 10, 1000), 'b')
+        self.assertEqual(self._callFUT(self.table, 40, 100, 1000), 'e')
+        self.assertEqual(self._callFUT(self.table, 10, 1000, 1000), 'g')
+
+    def test_limit_ge_rlen(self):
+        self.assertEqual(self._callFUT(self.table, 10, 10, 1000), 'c')
+
 
 class Test_fwscan_wins(unittest.TestCase):
 
@@ -63,6 +63,21 @@ class TestCatalogKeywordIndex(unittest.TestCase):
         self.assertTrue(1 in index._fwd_index[3])
         self.assertFalse(4 in index._fwd_index)
 
+    def test_reindex_doc_returns_changed(self):
+        index = self._makeOne()
+        index.index_doc(1, [1, 2, 3])
+        index.unindex_doc = lambda *args, **kw: 1 / 0
+        self.assertEqual(index.reindex_doc(1, (3, 2, 1, 1)), False)
+        del index.unindex_doc
+        self.assertEqual(index.reindex_doc(1, [1, 2]), True)
+        self.assertEqual(list(index._rev_index[1]), [1, 2])
+        self.assertEqual(index.reindex_doc(1, []), True)
+        self.assertFalse(1 in index._rev_index)
+        self.assertEqual(index.reindex_doc(1, []), False)
+        self.assertEqual(index.reindex_doc(1, _marker), True)
+        self.assertEqual(index.reindex_doc(1, []), True)
+        self.assertFalse(1 in index._not_indexed)
+
     def test_reindex_doc_different_values(self):
         index = self._makeOne()
         index.index_doc(1, [1, 2, 3])
@@ -75,6 +90,85 @@ class TestCatalogKeywordIndex(unittest.TestCase):
         self.assertTrue(1 in index._fwd_index[3])
         self.assertTrue(1 in index._fwd_index[4])
 
+    def test_index_docs_same_as_index_doc(self):
+        docs = [(1, [1, 2]), (2, (2, 3)), (3, []), (4, _marker), (5, [3])]
+        expected = self._makeOne()
+        for docid, obj in docs:
+            expected.index_doc(docid, obj)
+        index = self._makeOne()
+        index.index_docs(iter(docs))
+        self.assertEqual(index.documentCount(), 3)
+        self.assertEqual(
+            [(k, list(v)) for k, v in index._rev_index.items()],
+            [(k, list(v)) for k, v in expected._rev_index.items()])
+        self.assertEqual(
+            [(k, list(v)) for k, v in index._fwd_index.items()],
+            [(k, list(v)) for k, v in expected._fwd_index.items()])
+        self.assertEqual(list(index._not_indexed), [4])
+
+    def test_index_docs_w_existing_docids(self):
+        index = self._makeOne()
+        index.index_doc(1, [1, 2])
+        index.index_doc(2, [1])
+        index.index_doc(3, [3])
+        index.index_docs([(1, [1, 2]), (2, [2]), (3, []), (4, [1])])
+        self.assertEqual(index.documentCount(), 3)
+        self.assertEqual(list(index._fwd_index[1]), [1, 4])
+        self.assertEqual(list(index._fwd_index[2]), [1, 2])
+        self.assertFalse(3 in index._fwd_index)
+        self.assertFalse(3 in index._rev_index)
+
+    def test_index_docs_converts_to_treeset(self):
+        from BTrees.IFBTree import IFTreeSet
+        index = self._makeOne()
+        index.tree_threshold = 4
+        index.index_docs([(1, [1, 2]), (2, [1])])
+        self.assertFalse(isinstance(index._fwd_index[1], IFTreeSet))
+        index.index_docs([(docid, [1]) for docid in range(3, 6)])
+        self.assertTrue(isinstance(index._fwd_index[1], IFTreeSet))
+        self.assertEqual(list(index._fwd_index[1]), [1, 2, 3, 4, 5])
+        index.index_docs([(docid, [2]) for docid in range(6, 10)])
+        self.assertTrue(isinstance(index._fwd_index[2], IFTreeSet))
+
+    def test_enable_compression(self):
+        from BTrees.IFBTree import IFSet
+        from BTrees.IFBTree import IFTreeSet
+        from repoze.catalog.roaring import RoaringIFSet
+        index = self._makeOne()
+        index.tree_threshold = 3
+        index.index_doc(1, [1, 2])
+        index.enable_compression()
+        index.index_doc(2, [1, 3])
+        index.index_docs([(docid, [1]) for docid in range(3, 6)])
+        for word in (1, 2, 3):
+            self.assertTrue(isinstance(index._fwd_index[word], RoaringIFSet))
+        self.assertEqual(list(index.applyAny([1])), [1, 2, 3, 4, 5])
+        index.disable_compression()
+        self.assertTrue(isinstance(index._fwd_index[1], IFTreeSet))
+        self.assertTrue(isinstance(index._fwd_index[2], IFSet))
+        self.assertEqual(list(index._fwd_index[1]), [1, 2, 3, 4, 5])
+
+    def test_index_docs_string_raises(self):
+        index = self._makeOne()
+        self.assertRaises(TypeError, index.index_docs, [(1, 'abc')])
+
+    def test_index_docs_error_writes_nothing(self):
+        from persistent import Persistent
+        index = self._makeOne()
+        index.index_doc(1, ['a', 'b'])
+        index.index_doc(2, _marker)
+        for docs in ([(1, ['c']), (2, ['a']), (3, 'abc')],
+                     [(1, ['c']), (2, []), (3, Persistent())],
+                     [(1, ['c']), (2, _marker), (3, [1])]):
+            self.assertRaises((TypeError, ValueError), index.index_docs, docs)
+            self.assertEqual(index.documentCount(), 1)
+            self.assertEqual(dict((k, list(v))
+                                  for k, v in index._rev_index.items()),
+                             {1: ['a', 'b']})
+            self.assertEqual(list(index._fwd_index.keys()), ['a', 'b'])
+            self.assertEqual(list(index._not_indexed), [2])
+            self.assertEqual(list(index.docids()), [1, 2])
+
     def test_apply_doesnt_mutate_query(self):
         # Some previous version of zope.index munged the query dict
         index = self._makeOne()
@@ -178,6 +272,60 @@ class TestCatalogKeywordIndex(unittest.TestCase):
         result = index.applyNotEq(5)
         self.assertEqual(list(result), [1, 2, 3, 4, 5, 6])
 
+    def test_estimate(self):
+        index = self._makeOne()
+        index.index_doc(1, [1, 2, 3])
+        index.index_doc(2, [3, 4, 5])
+        index.index_doc(3, [5, 6, 7])
+        index.index_doc(4, _marker)
+        self.assertEqual(index.estimate('Eq', 3), 2)
+        self.assertEqual(index.estimate('NotEq', 3), 2)
+        self.assertEqual(index.estimate('Any', [1, 3, 5]), 3)
+        self.assertEqual(index.estimate('All', [1, 5]), 1)
+        self.assertEqual(index.estimate('All', []), 0)
+        self.assertEqual(index.estimate('InRange', 1, 3), None)
+
+    def test_apply_intersect_op_probes(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        index.index_doc(1, [1, 2, 3])
+        index.index_doc(2, [3, 4, 5])
+        index.index_doc(3, [5, 6, 7])
+        index.index_doc(4, _marker)
+        index.apply = lambda *args: 1 / 0
+        docids = IFSet([1, 2, 4])
+        self.assertEqual(list(index.apply_intersect_op('Eq', docids, 3)),
+                         [1, 2])
+        self.assertEqual(list(index.apply_intersect_op('NotEq', docids, 1)),
+                         [2, 4])
+        self.assertEqual(
+            list(index.apply_intersect_op('Any', docids, [1, 5])), [1, 2])
+        self.assertEqual(
+            list(index.apply_intersect_op('All', docids, [3, 5])), [2])
+        self.assertEqual(
+            list(index.apply_intersect_op('All', docids, [])), [])
+
+    def test_apply_intersect_probes(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        index.index_doc(1, ['a', 'b'])
+        index.index_doc(2, ['b', 'c'])
+        index.apply = lambda *args: 1 / 0
+        docids = IFSet([1, 2])
+        self.assertEqual(list(index.apply_intersect('a', docids)), [1])
+        self.assertEqual(list(index.apply_intersect(['a', 'b'], docids)), [1])
+        self.assertEqual(
+            list(index.apply_intersect(
+                {'query': ['a', 'c'], 'operator': 'or'}, docids)),
+            [1, 2])
+
+    def test_apply_intersect_bad_operator(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        index.index_doc(1, ['a', 'b'])
+        self.assertRaises(TypeError, index.apply_intersect,
+                          {'query': ['a'], 'operator': 'xor'}, IFSet([1]))
+
     def test_docids(self):
         index = self._makeOne()
         index.index_doc(1, [1, 2, 3])
@@ -189,6 +337,16 @@ class TestCatalogKeywordIndex(unittest.TestCase):
         self.assertEqual(set(index.docids()),
                          set((1, 2, 3, 4, 5, 6)))
 
+    def test_docids_empty_value(self):
+        index = self._makeOne()
+        index.index_docs([(1, _marker), (2, [1])])
+        self.assertEqual(list(index.docids()), [1, 2])
+        index.index_docs([(1, []), (2, [])])
+        self.assertEqual(list(index.docids()), [])
+        index.index_doc(3, _marker)
+        index.index_doc(3, [])
+        self.assertEqual(list(index.docids()), [])
+
     def test_unindex_doc_removes_from_docids(self):
         index = self._makeOne()
         index.index_doc(20, [1, 2, 3])
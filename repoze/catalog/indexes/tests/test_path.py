@@ -69,6 +69,18 @@ class PathIndexTests(unittest.TestCase):
         self.assertEqual(index.getEntryForObject(1), None)
         self.assertEqual(index._depth, 0)
 
+    def test_enable_compression(self):
+        from repoze.catalog.roaring import RoaringIFSet
+        index = self._makeOne(VALUES)
+        index.enable_compression()
+        index.insertEntry('zzz', 100, 0)
+        for levels in index._index.values():
+            for docids in levels.values():
+                self.assertTrue(isinstance(docids, RoaringIFSet))
+        self.assertEqual(list(index.search('/zzz')), [100])
+        index.disable_compression()
+        self.assertFalse(isinstance(index._index['zzz'][0], RoaringIFSet))
+
     def test_insertEntry_new_component_new_level(self):
         index = self._makeOne()
         index.insertEntry('aaa', 1, 1)
@@ -187,6 +199,18 @@ class PathIndexTests(unittest.TestCase):
         index.index_doc(1, o)
         self.assertEqual(index.numObjects(), 1)
 
+    def test_reindex_doc_returns_changed(self):
+        index = self._makeOne()
+        o = Dummy('/foo/bar')
+        index.index_doc(1, o)
+        index.unindex_doc = lambda *args, **kw: 1 / 0
+        self.assertEqual(index.reindex_doc(1, o), False)
+        del index.unindex_doc
+        self.assertEqual(index.reindex_doc(1, Dummy('/foo/baz')), True)
+        self.assertEqual(index.numObjects(), 1)
+        self.assertEqual(index._unindex[1], '/foo/baz')
+        self.assertFalse('bar' in index._index)
+
     def test_unindex_nomatch_doesnt_raise(self):
         index = self._makeOne()
         # this should not raise an error
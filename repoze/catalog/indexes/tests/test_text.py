@@ -56,6 +56,19 @@ class TestCatalogTextIndex(unittest.TestCase):
         index.unindex_doc = lambda *args, **kw: 1/0
         index.reindex_doc(5, 'now is the time')
 
+    def test_reindex_doc_returns_changed(self):
+        index = self._makeOne()
+        index.index_doc(5, 'now is the time')
+        wordcount = index.lexicon.wordCount()
+        self.assertEqual(index.reindex_doc(5, 'now is the time'), False)
+        self.assertEqual(index.reindex_doc(5, 'now is the hour'), True)
+        self.assertEqual(index.lexicon.wordCount(), wordcount + 1)
+        self.assertEqual(set(index.applyContains('hour')), set([5]))
+        self.assertEqual(index.reindex_doc(5, 'now is the time'), True)
+        self.assertEqual(set(index.applyContains('hour')), set())
+        self.assertEqual(index.reindex_doc(6, 'now is the time'), True)
+        self.assertEqual(index.reindex_doc(6, 'now is the time'), False)
+
     def test_sort_no_results(self):
         index = self._makeOne()
         self.assertEqual([], index.sort([]))
@@ -82,6 +95,29 @@ class TestCatalogTextIndex(unittest.TestCase):
         expect = [-2, 0]
         self.assertEqual(index.sort(results, limit=2), expect)
 
+    def test_sort_limited_reverse(self):
+        index = self._makeOne()
+        results = {-2: 5.0, 3: 3.0, 0: 4.5}
+        self.assertEqual(index.sort(results, reverse=True, limit=2), [3, 0])
+
+    def test_sort_limited_matches_full_sort(self):
+        from BTrees.IFBTree import IFBucket
+        index = self._makeOne()
+        results = IFBucket([(docid, float(docid % 7)) for docid in range(50)])
+        for reverse in (False, True):
+            expected = index.sort(results, reverse=reverse)
+            for limit, offset in ((1, 0), (10, 0), (10, 5), (100, 0)):
+                self.assertEqual(
+                    index.sort(results, reverse=reverse, limit=limit,
+                               offset=offset),
+                    expected[offset:offset + limit])
+
+    def test_sort_offset(self):
+        index = self._makeOne()
+        results = {-2: 5.0, 3: 3.0, 0: 4.5}
+        self.assertEqual(index.sort(results, offset=1), [0, 3])
+        self.assertEqual(index.sort(results, limit=1, offset=1), [0])
+
     def test_applyDoesNotContain(self):
         index = self._makeOne()
         index.index_doc(1, u'now is the time')
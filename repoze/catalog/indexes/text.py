@@ -1,7 +1,10 @@
+import heapq
+
 from zope.interface import implementer
 
 from zope.index.interfaces import IIndexSort
 from zope.index.text import TextIndex
+from zope.index.text import widcode
 
 from repoze.catalog.interfaces import ICatalogIndex
 from repoze.catalog.indexes.common import CatalogIndex
@@ -33,14 +36,31 @@ class CatalogTextIndex(CatalogIndex, TextIndex):
         TextIndex.__init__(self, lexicon, index)
         self.clear()
 
-    def reindex_doc(self, docid, object):
+    def _reindex_value(self, docid, value):
         # index_doc knows enough about reindexing to do the right thing
-        return self.index_doc(docid, object)
+        self._index_value(docid, value)
+
+    def _has_value(self, docid, value):
+        docwords = self.index._docwords.get(docid)
+        if docwords is None:
+            return False
+        if value is None:
+            value = ''
+        # unlike sourceToWordIds, termToWordIds doesn't add unknown
+        # words to the lexicon; it maps them to 0
+        wids = self.lexicon.termToWordIds(value)
+        if 0 in wids:
+            return False
+        return widcode.encode(wids) == docwords
 
     def _indexed(self):
         return list(self.index._docwords.keys())
 
-    def sort(self, result, reverse=False, limit=None, sort_type=None):
+    def _is_indexed(self, docid):
+        return docid in self.index._docwords
+
+    def sort(self, result, reverse=False, limit=None, sort_type=None,
+             offset=0):
         """Sort by text relevance.
 
         This only works if the query includes at least one text query,
@@ -50,7 +70,7 @@ class CatalogTextIndex(CatalogIndex, TextIndex):
         A weighted result is a dictionary-ish object that has docids
         as keys and floating point weights as values.  This method
         sorts the dictionary by weight and returns the sorted
-        docids as a list.
+        docids as a list, skipping the first ``offset`` of them.
         """
         if not result:
             return result
@@ -61,14 +81,19 @@ class CatalogTextIndex(CatalogIndex, TextIndex):
                 "result does not contain weights. To produce a weighted "
                 "result, include a text search in the query.")
 
-        items = [(weight, docid) for (docid, weight) in result.items()]
-        # when reverse is false, output largest weight first.
-        # when reverse is true, output smallest weight first.
-        items.sort(reverse=not reverse)
-        result = [docid for (weight, docid) in items]
+        items = zip(result.values(), result.keys())
         if limit:
-            result = result[:limit]
-        return result
+            # only the best offset + limit docids are needed: keep them
+            # in a heap instead of sorting all of the docids
+            if reverse:
+                items = heapq.nsmallest(offset + limit, items)
+            else:
+                items = heapq.nlargest(offset + limit, items)
+        else:
+            # when reverse is false, output largest weight first.
+            # when reverse is true, output smallest weight first.
+            items = sorted(items, reverse=not reverse)
+        return [docid for (weight, docid) in items[offset:]]
 
     def applyContains(self, value):
         return self.apply(value)
@@ -10,6 +10,10 @@ class ICatalog(IIndexSearch, IInjection):
         name, each query value is the value that the index expects as
         a query term."""
 
+    def index_docs(docs):
+        """Index each ``(docid, obj)`` pair in the iterable ``docs``;
+        equivalent to calling ``index_doc`` for every pair."""
+
 class ICatalogIndex(IIndexSearch, IInjection):
     """ An index that adapts objects to an attribute or callable value
     on an object """
@@ -20,7 +24,8 @@ class ICatalogIndex(IIndexSearch, IInjection):
 
     def reindex_doc(docid, obj):
         """ Reindex the document numbered ``docid`` using in the
-        information on object ``obj``"""
+        information on object ``obj``.  Return False if the index was
+        left unchanged, True otherwise."""
 
 class ICatalogAdapter(Interface):
     def __call__(default):
@@ -3,6 +3,12 @@ import BTrees
 import sys
 from six.moves import range
 
+from repoze.catalog import RangeValue
+from repoze.catalog.cache import LRUCache
+from repoze.catalog.setops import PROBE_LIMIT
+from repoze.catalog.setops import intersection
+from repoze.catalog.setops import union
+
 try:
     import ast
     ast_support = True
@@ -19,6 +25,7 @@ class Query(object):
     """
     __parent__ = None
     __name__ = None
+    family = BTrees.family32
 
     def __and__(self, right):
         self._check_type("and", right)
@@ -49,6 +56,45 @@ class Query(object):
         """
         return self
 
+    def _estimate(self, catalog, names):
+        """
+        Return an estimate of the number of docids this query will return
+        when applied to ``catalog``, or ``None`` if no estimate can be made
+        cheaply.
+        """
+        return None
+
+    def _apply_intersect(self, catalog, names, docids):
+        """
+        Apply this query and return its results intersected with ``docids``.
+        If ``docids`` is None, return the bare query results.
+        """
+        result = self._apply(catalog, names)
+        if docids is None:
+            return result
+        return intersection([result, docids], self.family)
+
+    def _apply_once(self, catalog, names):
+        """
+        Apply this query, or return the results of an identical query
+        already applied while the catalog evaluates the current query.
+        """
+        return self._apply(catalog, names)
+
+    def _cache_key(self, names):
+        """
+        Return a hashable key identifying the results of this query once
+        the names in it are resolved using ``names``, or ``None`` if the
+        results of this query can't be cached.
+        """
+        return None
+
+    def _index_names(self):
+        """
+        Return the set of names of the indexes this query uses.
+        """
+        return set()
+
 
 class Comparator(Query):
     """
@@ -62,6 +108,63 @@ class Comparator(Query):
     def _get_index(self, catalog):
         return catalog[self.index_name]
 
+    def _get_args(self, names):
+        return (self._get_value(names),)
+
+    def _estimate(self, catalog, names):
+        index = self._get_index(catalog)
+        estimate = getattr(index, 'estimate', None)
+        if estimate is None:
+            return None
+        return estimate(type(self).__name__, *self._get_args(names))
+
+    def _apply_intersect(self, catalog, names, docids):
+        results, key = self._shared_results(catalog, names)
+        if results is not None:
+            if docids is None:
+                return self._apply_once(catalog, names)
+            if key in results:
+                return intersection([results[key], docids], self.family)
+        # Let the index decide whether to probe docids one by one or to
+        # compute the full result and intersect it.
+        index = self._get_index(catalog)
+        apply_intersect_op = getattr(index, 'apply_intersect_op', None)
+        if apply_intersect_op is None:
+            return Query._apply_intersect(self, catalog, names, docids)
+        return apply_intersect_op(
+            type(self).__name__, docids, *self._get_args(names))
+
+    def _apply_once(self, catalog, names):
+        results, key = self._shared_results(catalog, names)
+        if results is None:
+            return self._apply(catalog, names)
+        result = results.get(key)
+        if result is None:
+            result = results[key] = self._apply(catalog, names)
+        return result
+
+    def _shared_results(self, catalog, names):
+        # The results of the comparators applied so far while the catalog
+        # evaluates the current query (see ``Catalog._evaluate``), and the
+        # key of this comparator in them; (None, None) outside of such an
+        # evaluation or if the key can't be hashed.
+        results = getattr(catalog, '_v_shared_results', None)
+        if results is None:
+            return None, None
+        key = self._cache_key(names)
+        try:
+            hash(key)
+        except TypeError:
+            return None, None
+        return results, key
+
+    def _cache_key(self, names):
+        return (type(self).__name__, self.index_name,
+                _freeze(self._get_args(names)))
+
+    def _index_names(self):
+        return set([self.index_name])
+
     def _get_value(self, names, value=_marker):
         if value is _marker:
             value = self._value
@@ -270,6 +373,15 @@ class NotAll(Comparator):
         index = self._get_index(catalog)
         return index.applyAll(self._get_value(names))
 
+    def _apply_intersect(self, catalog, names, docids):
+        # _apply above returns what applyAll does, so the index isn't
+        # asked to probe docids for NotAll: that would check them against
+        # the complement and so give different results than _apply.
+        result = self._apply_once(catalog, names)
+        if docids is None:
+            return result
+        return intersection([result, docids], self.family)
+
     def negate(self):
         return All(self.index_name, self._value)
 
@@ -323,6 +435,10 @@ class _Range(Comparator):
             return names[name]
         return value
 
+    def _get_args(self, names):
+        return (self._get_start(names), self._get_end(names),
+                self.start_exclusive, self.end_exclusive)
+
     def __str__(self):
         s = [repr(self._start)]
         if self.start_exclusive:
@@ -390,7 +506,6 @@ class BoolOp(Query):
     """
     Base class for Or and And operators.
     """
-    family = BTrees.family32
 
     def __init__(self, *queries):
         arguments = []
@@ -410,8 +525,34 @@ class BoolOp(Query):
         for query in self.queries:
             yield query
 
+    def _cache_key(self, names):
+        keys = []
+        for query in self.queries:
+            key = query._cache_key(names)
+            if key is None:
+                return None
+            keys.append(key)
+        # the results don't depend on the order of the children, nor on
+        # how many times a child is repeated
+        return (type(self).__name__, frozenset(keys))
+
+    def _index_names(self):
+        names = set()
+        for query in self.queries:
+            names.update(query._index_names())
+        return names
+
     def _optimize(self):
         self.queries = [query._optimize() for query in self.queries]
+        new_me = self._optimize_contradictions()
+        if new_me is not None:
+            return new_me
+        new_me = self._optimize_duplicates()
+        if new_me is not None:
+            return new_me
+        new_me = self._optimize_common()
+        if new_me is not None:
+            return new_me
         new_me = self._optimize_eq()
         if new_me is not None:
             return new_me
@@ -420,6 +561,68 @@ class BoolOp(Query):
             return new_me
         return self
 
+    def _optimize_contradictions(self):
+        # An And with a contradiction among its queries is a contradiction
+        # itself, while an Or can do without them.
+        queries = [query for query in self.queries
+                   if type(query) != _Contradiction]
+        if len(queries) == len(self.queries):
+            return None
+        if type(self) == And or not queries:
+            return _Contradiction(self)
+        if len(queries) == 1:
+            return queries[0]
+        self.queries = queries
+        return None
+
+    def _optimize_duplicates(self):
+        # A comparator which occurs more than once among the queries needs
+        # to be applied only once.
+        queries = []
+        for query in self.queries:
+            if not _contains(queries, query):
+                queries.append(query)
+        if len(queries) == 1:
+            return queries[0]
+        self.queries = queries
+        return None
+
+    def _optimize_common(self):
+        # Comparators common to all of the queries can be factored out:
+        # (A & B) | (A & C) is A & (B | C), and (A | B) & (A | C) is
+        # A | (B & C).  If one of the queries is made up of the common
+        # comparators alone, they are all there is left: A | (A & B) is A.
+        if type(self) == Or:
+            inner = And
+        else:
+            inner = Or
+        groups = []
+        for query in self.queries:
+            if type(query) == inner:
+                groups.append(query.queries)
+            else:
+                groups.append([query])
+        common = [query for query in groups[0]
+                  if isinstance(query, Comparator) and
+                  all(_contains(group, query) for group in groups[1:])]
+        if not common:
+            return None
+        rests = []
+        for group in groups:
+            rest = [query for query in group if not _contains(common, query)]
+            if not rest:
+                rests = None
+                break
+            if len(rest) == 1:
+                rests.append(rest[0])
+            else:
+                rests.append(inner(*rest))
+        if rests is not None:
+            common.append(type(self)(*rests))
+        if len(common) == 1:
+            return common[0]._optimize()
+        return inner(*common)._optimize()
+
     def _optimize_eq(self):
         # If all queries are Eq operators for the same index, we can replace
         # this And or Or with an All or Any node.
@@ -461,26 +664,38 @@ class BoolOp(Query):
         return NotAny(index_name, values)
 
 
+def _contains(queries, query):
+    # Comparators are compared using their ``__eq__``, which ignores their
+    # type; other queries only ever equal themselves.
+    for other in queries:
+        if other is query:
+            return True
+        if (isinstance(query, Comparator) and type(other) == type(query)
+                and other == query):
+            return True
+    return False
+
+
 class Or(BoolOp):
     """Boolean Or of multiple queries."""
 
     def _apply(self, catalog, names):
-        # XXX Try to figure out when we need weightedOr and when we can
-        # just use union or multiunion.
-        queries = self.queries
-        result = queries[0]._apply(catalog, names)
-        for query in queries[1:]:
-            next_result = query._apply(catalog, names)
-            if len(result) == 0:
-                result = next_result
-            elif len(next_result) > 0:
-                _, result = self.family.IF.weightedUnion(result, next_result)
-        return result
+        # Unless a text index contributes weights, the results are merged
+        # in a single multiunion rather than copied once per subquery.
+        results = [query._apply_once(catalog, names)
+                   for query in self.queries]
+        return union(results, self.family)
 
     def negate(self):
         neg_queries = [query.negate() for query in self.queries]
         return And(*neg_queries)
 
+    def _estimate(self, catalog, names):
+        estimates = [query._estimate(catalog, names) for query in self.queries]
+        if None in estimates:
+            return None
+        return sum(estimates)
+
     def _optimize(self):
         new_self = BoolOp._optimize(self)
         if self is not new_self:
@@ -527,58 +742,83 @@ class And(BoolOp):
     """Boolean And of multiple queries."""
 
     def _apply(self, catalog, names):
-        # XXX Try to figure out when we need weightedIntersection and when we
-        # can just use intersection.
+        return self._apply_intersect(catalog, names, None)
+
+    def _apply_intersect(self, catalog, names, docids):
         IF = self.family.IF
-        queries = self.queries
-        result = queries[0]._apply(catalog, names)
-        for query in queries[1:]:
-            if len(result) == 0:
-                return IF.Set()
-            next_result = query._apply(catalog, names)
-            if len(next_result) == 0:
+        # Evaluate the most selective children first, so that the running
+        # result shrinks (and we can bail out on an empty one) as early as
+        # possible.  Each child is handed the running result, so indexes can
+        # check a small one docid by docid instead of computing their whole
+        # result.  Children which can't be estimated come last; while the
+        # running result is large they are evaluated on their own and their
+        # results intersected smallest first, until one of them is small
+        # enough to be handed to the rest.
+        result = docids
+        pending = []
+        for estimate, query in self._plan(catalog, names):
+            if result is not None and len(result) == 0:
                 return IF.Set()
-            _, result = IF.weightedIntersection(result, next_result)
+            if estimate is not None or (
+                    result is not None and len(result) <= PROBE_LIMIT):
+                result = query._apply_intersect(catalog, names, result)
+                continue
+            pending.append(query._apply_once(catalog, names))
+            if len(pending[-1]) <= PROBE_LIMIT:
+                result = intersection([result] + pending, self.family)
+                pending = []
+        if pending:
+            result = intersection([result] + pending, self.family)
         return result
 
+    def _plan(self, catalog, names):
+        """
+        Return ``(estimate, query)`` pairs for the child queries in the
+        order they should be evaluated: cheapest (smallest estimated
+        result) first.  Children which can't be estimated are evaluated
+        last, in the order they were given.
+        """
+        plan = []
+        for i, query in enumerate(self.queries):
+            estimate = query._estimate(catalog, names)
+            plan.append((estimate is None, estimate or 0, i, estimate, query))
+        plan.sort(key=lambda x: x[:3])
+        return [(estimate, query) for _, _, _, estimate, query in plan]
+
     def negate(self):
         neg_queries = [query.negate() for query in self.queries]
         return Or(*neg_queries)
 
+    def _estimate(self, catalog, names):
+        estimates = [query._estimate(catalog, names) for query in self.queries]
+        estimates = [estimate for estimate in estimates if estimate is not None]
+        if not estimates:
+            return None
+        return min(estimates)
+
     def _optimize(self):
         new_self = BoolOp._optimize(self)
         if self is not new_self:
             return new_self
 
-        # There might be a combination of Gt/Ge and Lt/Le operators for the
-        # same index that could be used to compose an InRange.
-        uppers = {}
-        lowers = {}
-        queries = list(self.queries)
-
-        def process_range(i_lower, query_lower, i_upper, query_upper):
-            queries[i_lower] = InRange.fromGTLT(query_lower, query_upper)
-            queries[i_upper] = None
-
-        for i in range(len(queries)):
-            query = queries[i]
-            if type(query) in (Gt, Ge):
-                match = uppers.get(query.index_name)
-                if match is not None:
-                    i_upper, query_upper = match
-                    process_range(i, query, i_upper, query_upper)
-                else:
-                    lowers[query.index_name] = (i, query)
-
-            elif type(query) in (Lt, Le):
-                match = lowers.get(query.index_name)
-                if match is not None:
-                    i_lower, query_lower = match
-                    process_range(i_lower, query_lower, i, query)
-                else:
-                    uppers[query.index_name] = (i, query)
+        # Comparators against the same index are combined into one (see
+        # _combine), or the whole And into a contradiction if no value can
+        # satisfy all of them.
+        groups = {}
+        for query in self.queries:
+            if type(query) in _COMBINABLE:
+                groups.setdefault(query.index_name, []).append(query)
+        queries = []
+        for query in self.queries:
+            group = groups.get(getattr(query, 'index_name', None), ())
+            if not [member for member in group if member is query]:
+                queries.append(query)
+            elif query is group[0]:
+                combined = _combine(group)
+                if combined is None:
+                    return _Contradiction(self)
+                queries.extend(combined)
 
-        queries = list([_f for _f in queries if _f])
         if len(queries) == 1:
             return queries[0]
 
@@ -586,6 +826,177 @@ class And(BoolOp):
         return self
 
 
+_COMBINABLE = (Eq, Any, Gt, Ge, Lt, Le, InRange)
+
+
+def _is_literal(query):
+    # The values of comparators given by a Name aren't known until the
+    # query is applied, and indexes treat lists, tuples, dicts and
+    # RangeValues given as a value as Any or range queries (see the
+    # _matchEq method of the field index), so those can't be compared.
+    if isinstance(query, _Range):
+        values = [query._start, query._end]
+    elif type(query) == Any:
+        if not isinstance(query._value, (list, tuple)):
+            return False
+        values = query._value
+    else:
+        values = [query._value]
+    for value in values:
+        if isinstance(value, (Name, dict, list, tuple, RangeValue)):
+            return False
+    return True
+
+
+def _combine(queries):
+    # Combine the Eq, Any, Gt, Ge, Lt, Le and InRange comparators
+    # ``queries`` against a single index and return the comparators to
+    # replace them with, or None if no value satisfies all of them.
+    #
+    # Like the Gt/Lt into InRange merge before it, this relies on indexes
+    # which support ranges (the field index) holding one value per
+    # document.  Without a range among ``queries`` nothing says so: a
+    # keyword index matches both a == 1 and a == 2 for a document with
+    # both keywords.  Then only queries implied by another are dropped.
+    if len(queries) == 1:
+        return queries
+    literal = [query for query in queries if _is_literal(query)]
+    if len(literal) < len(queries):
+        others = [query for query in queries if not _is_literal(query)]
+        if literal:
+            literal = _combine(literal)
+            if literal is None:
+                return None
+        return _pair_ranges(literal + others)
+    index_name = queries[0].index_name
+    value_sets = []
+    lower = upper = None
+    try:
+        for query in queries:
+            if type(query) == Eq:
+                value_sets.append([query._value])
+            elif type(query) == Any:
+                value_sets.append(list(query._value))
+            elif type(query) in (Gt, Ge):
+                lower = _max_lower(lower, (query._value, type(query) == Gt))
+            elif type(query) in (Lt, Le):
+                upper = _min_upper(upper, (query._value, type(query) == Lt))
+            else:
+                if query._start is not None:
+                    lower = _max_lower(
+                        lower, (query._start, query.start_exclusive))
+                if query._end is not None:
+                    upper = _min_upper(
+                        upper, (query._end, query.end_exclusive))
+
+        if lower is None and upper is None:
+            return _drop_implied(queries, value_sets)
+        if lower is not None and upper is not None:
+            if lower[0] > upper[0] or (
+                    lower[0] == upper[0] and (lower[1] or upper[1])):
+                return None
+        if value_sets:
+            values = value_sets[0]
+            for other in value_sets[1:]:
+                values = [value for value in values if value in other]
+            values = [value for value in values
+                      if _within(value, lower, upper)]
+    except TypeError:
+        # values which can't be compared with each other
+        return _pair_ranges(queries)
+
+    if value_sets:
+        if not values:
+            return None
+        if len(values) == 1:
+            return [Eq(index_name, values[0])]
+        return [Any(index_name, values)]
+    if lower is None:
+        return [(Lt if upper[1] else Le)(index_name, upper[0])]
+    if upper is None:
+        return [(Gt if lower[1] else Ge)(index_name, lower[0])]
+    return [InRange(index_name, lower[0], upper[0], lower[1], upper[1])]
+
+
+def _pair_ranges(queries):
+    # Without comparing their values, each Gt or Ge can still be paired
+    # with a Lt or Le into an InRange.
+    result = list(queries)
+    lowers = [i for i, query in enumerate(queries) if type(query) in (Gt, Ge)]
+    uppers = [i for i, query in enumerate(queries) if type(query) in (Lt, Le)]
+    for i, j in zip(lowers, uppers):
+        result[min(i, j)] = InRange.fromGTLT(queries[i], queries[j])
+        result[max(i, j)] = None
+    return [query for query in result if query is not None]
+
+
+def _max_lower(bound, other):
+    # bounds are (value, exclusive) pairs
+    if bound is None or other[0] > bound[0]:
+        return other
+    if other[0] == bound[0]:
+        return (bound[0], bound[1] or other[1])
+    return bound
+
+
+def _min_upper(bound, other):
+    if bound is None or other[0] < bound[0]:
+        return other
+    if other[0] == bound[0]:
+        return (bound[0], bound[1] or other[1])
+    return bound
+
+
+def _within(value, lower, upper):
+    if lower is not None:
+        if value < lower[0] or (value == lower[0] and lower[1]):
+            return False
+    if upper is not None:
+        if value > upper[0] or (value == upper[0] and upper[1]):
+            return False
+    return True
+
+
+def _drop_implied(queries, value_sets):
+    # Any(a, [1]) implies Any(a, [1, 2]) whatever the index, so the latter
+    # can go; of two queries for the same values the first one is kept.
+    def subset(values, other):
+        return not [value for value in values if value not in other]
+
+    result = []
+    for i, query in enumerate(queries):
+        for j, other in enumerate(value_sets):
+            if j == i or not subset(other, value_sets[i]):
+                continue
+            if j < i or not subset(value_sets[i], other):
+                break
+        else:
+            result.append(query)
+    return result
+
+
+class _Contradiction(Query):
+    """
+    Stands in for ``query``, which the optimizer found can't match any
+    document, without applying it.
+    """
+
+    def __init__(self, query):
+        self.query = query
+
+    def __str__(self):
+        return 'Contradiction'
+
+    def negate(self):
+        return self.query.negate()
+
+    def _apply(self, catalog, names):
+        return self.family.IF.Set()
+
+    def _estimate(self, catalog, names):
+        return 0
+
+
 class Not(Query):
     """Negation of a query."""
 
@@ -604,6 +1015,18 @@ class Not(Query):
     def _apply(self, catalog, names):
         return self.query.negate()._apply(catalog, names)
 
+    def _estimate(self, catalog, names):
+        return self.query.negate()._estimate(catalog, names)
+
+    def _apply_intersect(self, catalog, names, docids):
+        return self.query.negate()._apply_intersect(catalog, names, docids)
+
+    def _cache_key(self, names):
+        return self.query.negate()._cache_key(names)
+
+    def _index_names(self):
+        return self.query._index_names()
+
     def _optimize(self):
         return self.query.negate()._optimize()
 
@@ -647,6 +1070,22 @@ class Name(object):
         return False
 
 
+def _freeze(value):
+    """
+    Return a hashable stand-in for a query value, for use in cache keys.
+    """
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple([_freeze(child) for child in value]))
+    elif isinstance(value, (set, frozenset)):
+        return (type(value), frozenset([_freeze(child) for child in value]))
+    elif isinstance(value, dict):
+        return (type(value), frozenset(
+            [(_freeze(k), _freeze(v)) for k, v in value.items()]))
+    elif isinstance(value, RangeValue):
+        return (RangeValue, _freeze(value.as_tuple()))
+    return value
+
+
 class _AstParser(object):
     """
     Uses Python's ast module to parse an expression into an abstract syntax
@@ -929,6 +1368,25 @@ def parse_query(expr, optimize_query=True):
     return query
 
 
+# Parsed and optimized queries by expression string, shared by all callers
+# of parse_query_cached; its hits and misses attributes count lookups.
+parse_cache = LRUCache(1000)
+
+
+def parse_query_cached(expr):
+    """
+    Like ``parse_query(expr)``, but the query object returned may come from
+    (and is kept in) the ``parse_cache`` shared by all threads, so it must
+    not be modified.  Use ``Name`` placeholders for the values which vary
+    between queries, so that their expressions can share a cache entry.
+    """
+    query = parse_cache.get(expr)
+    if query is None:
+        query = parse_query(expr)
+        parse_cache.set(expr, query)
+    return query
+
+
 def _print_ast(expr):  # pragma NO COVERAGE
     """
     Useful method for visualizing AST trees while debugging.
@@ -0,0 +1,171 @@
+""" Docid sets which are stored compressed.
+
+The sets in this module are ordinary ``IF.Set`` (``LF.Set`` for the
+64-bit family) docid sets in memory, so they can be passed to any of the
+``family.IF`` set operations, but they are pickled the way roaring
+bitmaps are laid out: the docids are split into chunks of 65536 by their
+upper bits and each chunk is stored as whichever of a sorted array of
+its docids, a bitmap, or a list of runs of consecutive docids is the
+smallest.  A dense set like the docids of all published documents
+pickles to a few bytes per 65536 docids instead of five bytes per docid.
+
+Loading and storing a compressed set costs more CPU than loading and
+storing a plain one, and a set is stored as one ZODB record however big
+it is, so they pay off for large, dense sets that change rarely.
+"""
+import sys
+from array import array
+from itertools import repeat
+from operator import sub
+
+from BTrees.IFBTree import IFSet
+from BTrees.LFBTree import LFSet
+import BTrees
+
+# the ways a chunk of docids can be stored
+ARRAY = 0
+BITMAP = 1
+RUN = 2
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+
+# chunks of at most this many docids are stored as bare docids
+MAX_BARE = 3
+
+# the number of bytes of a bitmap chunk
+BITMAP_BYTES = CHUNK_SIZE // 8
+
+# the bits set in each byte value
+_BITS = [tuple([bit for bit in range(8) if byte >> bit & 1])
+         for byte in range(256)]
+
+
+class _RoaringSet(object):
+    # the compressed pickle state of the set types below
+
+    def __getstate__(self):
+        return (_encode(self),)
+
+    def __setstate__(self, state):
+        self._set_type.__setstate__(self, (tuple(_decode(state[0])),))
+
+
+class RoaringIFSet(_RoaringSet, IFSet):
+    """ An ``IFSet`` which is pickled compressed. """
+    _set_type = IFSet
+
+
+class RoaringLFSet(_RoaringSet, LFSet):
+    """ An ``LFSet`` which is pickled compressed. """
+    _set_type = LFSet
+
+
+def roaring_set_type(family=BTrees.family32):
+    """ Return the compressed docid set type of ``family``. """
+    if family is BTrees.family64:
+        return RoaringLFSet
+    return RoaringIFSet
+
+
+def _encode(docids):
+    # Return the chunks of the sorted docid set ``docids`` as a tuple of
+    # ``(high, kind, data)`` tuples, or of the bare docids of chunks
+    # holding so few of them that a tuple wouldn't save space.
+    if not docids:
+        return ()
+    chunks = []
+    high = docids.minKey() >> CHUNK_BITS
+    last = docids.maxKey() >> CHUNK_BITS
+    while True:
+        base = high << CHUNK_BITS
+        values = docids.keys(base, base + CHUNK_MASK)
+        if len(values) <= MAX_BARE:
+            chunks.extend(values)
+        else:
+            chunks.append(_encode_chunk(high, base, values))
+        if high == last:
+            break
+        # skip to the chunk of the next docid
+        high = docids.minKey(base + CHUNK_SIZE) >> CHUNK_BITS
+    return tuple(chunks)
+
+
+def _encode_chunk(high, base, values):
+    n = len(values)
+    if values[-1] - values[0] + 1 == n:
+        # a single run
+        return (high, RUN, _pack([values[0] - base, n - 1]))
+    steps = list(map(sub, values[1:], values[:-1]))
+    numruns = n - steps.count(1)
+    # two bytes per array entry, four per run
+    array_size = 2 * n
+    run_size = 4 * numruns
+    lows = list(map(sub, values, repeat(base, n)))
+    if run_size < min(array_size, BITMAP_BYTES):
+        runs = []
+        start = previous = lows[0]
+        for low in lows:
+            if low > previous + 1:
+                runs.append(start)
+                runs.append(previous - start)
+                start = low
+            previous = low
+        runs.append(start)
+        runs.append(previous - start)
+        return (high, RUN, _pack(runs))
+    if array_size <= BITMAP_BYTES:
+        return (high, ARRAY, _pack(lows))
+    bitmap = bytearray(BITMAP_BYTES)
+    for low in lows:
+        bitmap[low >> 3] |= 1 << (low & 7)
+    return (high, BITMAP, bytes(bitmap))
+
+
+def _decode(chunks):
+    # Return the docids stored in ``chunks`` (see ``_encode``) as a
+    # sorted list.
+    docids = []
+    extend = docids.extend
+    for chunk in chunks:
+        if not isinstance(chunk, tuple):
+            docids.append(chunk)
+            continue
+        high, kind, data = chunk
+        base = high << CHUNK_BITS
+        if kind == BITMAP:
+            for offset, byte in enumerate(bytearray(data)):
+                if byte:
+                    first = base + (offset << 3)
+                    extend([first + bit for bit in _BITS[byte]])
+        elif kind == RUN:
+            runs = _unpack(data)
+            for i in range(0, len(runs), 2):
+                start = base + runs[i]
+                extend(range(start, start + runs[i + 1] + 1))
+        else:
+            extend([base + low for low in _unpack(data)])
+    return docids
+
+
+def _pack(values):
+    # uint16 values as little endian bytes
+    packed = array('H', values)
+    if sys.byteorder == 'big':  # pragma: no cover
+        packed.byteswap()
+    try:
+        return packed.tobytes()
+    except AttributeError:  # pragma: no cover
+        return packed.tostring()
+
+
+def _unpack(data):
+    unpacked = array('H')
+    try:
+        unpacked.frombytes(data)
+    except AttributeError:  # pragma: no cover
+        unpacked.fromstring(data)
+    if sys.byteorder == 'big':  # pragma: no cover
+        unpacked.byteswap()
+    return unpacked
@@ -0,0 +1,74 @@
+import unittest
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from repoze.catalog.cache import LRUCache
+        return LRUCache
+
+    def _makeOne(self, maxsize=3, maxcost=None):
+        return self._getTargetClass()(maxsize, maxcost)
+
+    def test_ctor_bad_maxsize(self):
+        self.assertRaises(ValueError, self._makeOne, 0)
+
+    def test_get_miss(self):
+        cache = self._makeOne()
+        marker = object()
+        self.assertTrue(cache.get('a', marker) is marker)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 0)
+
+    def test_set_get(self):
+        cache = self._makeOne()
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(len(cache), 1)
+        self.assertTrue('a' in cache)
+
+    def test_evicts_least_recently_used(self):
+        cache = self._makeOne()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        cache.get('a')
+        cache.set('d', 4)
+        self.assertEqual(sorted(cache._data), ['a', 'c', 'd'])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_set_replaces(self):
+        cache = self._makeOne(maxcost=10)
+        cache.set('a', 1, 5)
+        cache.set('a', 2, 3)
+        self.assertEqual(cache.get('a'), 2)
+        self.assertEqual(cache.cost, 3)
+        self.assertEqual(len(cache), 1)
+
+    def test_maxcost(self):
+        cache = self._makeOne(maxsize=10, maxcost=10)
+        cache.set('a', 1, 4)
+        cache.set('b', 2, 4)
+        cache.set('c', 3, 4)
+        self.assertEqual(sorted(cache._data), ['b', 'c'])
+        self.assertEqual(cache.cost, 8)
+        cache.set('d', 4, 11)
+        self.assertFalse('d' in cache)
+        self.assertEqual(cache.cost, 8)
+
+    def test_invalidate(self):
+        cache = self._makeOne(maxcost=10)
+        cache.set('a', 1, 5)
+        cache.invalidate('a')
+        cache.invalidate('b')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.cost, 0)
+
+    def test_clear(self):
+        cache = self._makeOne()
+        cache.set('a', 1)
+        cache.get('a')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits, 0)
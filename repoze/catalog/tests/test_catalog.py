@@ -57,6 +57,29 @@ class TestCatalog(unittest.TestCase):
         catalog['name'] = idx
         self.assertRaises(ValueError, catalog.index_doc, 'abc', 'value')
 
+    def test_index_docs(self):
+        catalog = self._makeOne()
+        idx = DummyIndex()
+        catalog['name'] = idx
+        catalog.index_docs([(1, 'value1'), (2, 'value2')])
+        self.assertEqual(idx.docid, 2)
+        self.assertEqual(idx.value, 'value2')
+
+    def test_index_docs_batches(self):
+        catalog = self._makeOne()
+        idx = DummyBulkIndex()
+        catalog['name'] = idx
+        docs = [(1, 'value1'), (2, 'value2'), (3, 'value3')]
+        catalog.index_docs(iter(docs), batch_size=2)
+        self.assertEqual(idx.batches, [docs[:2], docs[2:]])
+
+    def test_index_docs_nonint_docid(self):
+        catalog = self._makeOne()
+        idx = DummyBulkIndex()
+        catalog['name'] = idx
+        self.assertRaises(ValueError, catalog.index_docs, [('abc', 'value')])
+        self.assertEqual(idx.batches, [])
+
     def test_reindex_doc(self):
         catalog = self._makeOne()
         idx = DummyIndex()
@@ -65,6 +88,16 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(idx.reindexed_docid, 1)
         self.assertEqual(idx.reindexed_ob, 'value')
 
+    def test_reindex_doc_returns_changed_names(self):
+        catalog = self._makeOne()
+        catalog['changed'] = DummyIndex()
+        catalog['maybe'] = DummyIndex()
+        catalog['unchanged'] = DummyIndex()
+        catalog['changed'].reindex_doc = lambda docid, obj: True
+        catalog['unchanged'].reindex_doc = lambda docid, obj: False
+        self.assertEqual(sorted(catalog.reindex_doc(1, 'value')),
+                         ['changed', 'maybe'])
+
     def test_unindex_doc(self):
         catalog = self._makeOne()
         idx = DummyIndex()
@@ -90,6 +123,20 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(numdocs.total, 1)
         self.assertEqual(list(result), [3])
 
+    def test_search_small_result_checked_against_rest(self):
+        from BTrees.IFBTree import IFSet
+        catalog = self._makeOne()
+        idx1 = DummyIndex(IFSet(range(5000)))
+        catalog['name1'] = idx1
+        idx2 = DummyIndex(IFSet([3, 4, 5, 6000]))
+        catalog['name2'] = idx2
+        idx3 = DummyIndex(IFSet([4, 5, 6]))
+        idx3.apply = lambda query: 1 / 0
+        catalog['name3'] = idx3
+        numdocs, result = catalog.search(name1={}, name2={}, name3={})
+        self.assertEqual(numdocs, 2)
+        self.assertEqual(list(result), [4, 5])
+
     def test_search_index_returns_empty(self):
         from BTrees.IFBTree import IFSet
         catalog = self._makeOne()
@@ -216,6 +263,271 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(numdocs.total, 5)
         self.assertEqual(idx1.limit, 1)
 
+    def test_sort_result_offset(self):
+        from BTrees.IFBTree import IFSet
+        catalog = self._makeCached()
+        numdocs, result = catalog.sort_result(
+            IFSet([0, 1, 2, 3, 4]), sort_index='field', limit=2, offset=1)
+        self.assertEqual(numdocs, 2)
+        self.assertEqual(numdocs.total, 5)
+        self.assertEqual(list(result), [2, 4])
+        numdocs, result = catalog.sort_result(
+            IFSet([0, 1, 2, 3, 4]), sort_index='field', offset=4)
+        self.assertEqual(numdocs, 1)
+        self.assertEqual(list(result), [3])
+
+    def test_query_offset(self):
+        from repoze.catalog.query import Eq
+        catalog = self._makeCached()
+        numdocs, result = catalog.query(Eq('field', 0), sort_index='field',
+                                        limit=2, offset=1)
+        self.assertEqual(numdocs, 2)
+        self.assertEqual(numdocs.total, 3)
+        self.assertEqual(list(result), [2, 4])
+        numdocs, result = catalog.query(Eq('field', 0), sort_index='field',
+                                        offset=5)
+        self.assertEqual(numdocs, 0)
+        self.assertEqual(list(result), [])
+        # like limit, offset is only used when sorting
+        numdocs, result = catalog.query(Eq('field', 0), offset=1)
+        self.assertEqual(numdocs, 3)
+        self.assertEqual(list(result), [0, 2, 4])
+
+    def test_query_sort_by_several_indexes(self):
+        from repoze.catalog.query import Eq
+        from repoze.catalog.indexes.field import CatalogFieldIndex
+        catalog = self._makeCached()
+        catalog['order'] = CatalogFieldIndex(
+            lambda content, default: content.keyword[0])
+        for docid in range(5):
+            catalog.index_doc(docid, DummyContent(docid % 2, [-docid]))
+        numdocs, result = catalog.query(
+            Eq('field', 0) | Eq('field', 1),
+            sort_index=[('field', True), ('order', False)])
+        self.assertEqual(list(result), [3, 1, 4, 2, 0])
+        numdocs, result = catalog.query(
+            Eq('field', 0) | Eq('field', 1),
+            sort_index=[('field', True), ('order', False)],
+            limit=2, offset=1, reverse=True)
+        self.assertEqual(numdocs, 2)
+        self.assertEqual(list(result), [2, 4])
+        numdocs, result = catalog.sort_result(
+            catalog['field'].docids(),
+            sort_index=[('field', False), ('order', True)], limit=3)
+        self.assertEqual(list(result), [0, 2, 4])
+
+    def test_query_no_offset_not_passed_to_sort(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.query import Eq
+        catalog = self._makeOne()
+        c1 = IFSet([1, 2, 3])
+        idx1 = DummyIndex(c1)
+        catalog['name1'] = idx1
+        idx1.applyEq = lambda value: c1
+        numdocs, result = catalog.query(Eq('name1', 1), sort_index='name1',
+                                        limit=2)
+        self.assertEqual(list(result), ['sorted1', 'sorted2'])
+        self.assertEqual(idx1.limit, 2)
+
+    def test_query_offset_sort_index_without_offset(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.query import Eq
+        catalog = self._makeOne()
+        c1 = IFSet([1, 2, 3])
+        idx1 = DummyIndex(c1)
+        catalog['name1'] = idx1
+        idx1.applyEq = lambda value: c1
+        numdocs, result = catalog.query(Eq('name1', 1), sort_index='name1',
+                                        limit=1, offset=1)
+        self.assertEqual(list(result), ['sorted2'])
+        self.assertEqual(idx1.limit, 2)
+        numdocs, result = catalog.query(Eq('name1', 1), sort_index='name1')
+        self.assertEqual(result[2:3], ['sorted3'])
+        self.assertEqual(idx1.limit, 3)
+
+    def _makeCached(self):
+        from repoze.catalog.indexes.field import CatalogFieldIndex
+        from repoze.catalog.indexes.keyword import CatalogKeywordIndex
+        catalog = self._makeOne()
+        catalog['field'] = CatalogFieldIndex('field')
+        catalog['keyword'] = CatalogKeywordIndex('keyword')
+        catalog.enable_query_cache(10)
+        for docid in range(5):
+            catalog.index_doc(docid, DummyContent(docid % 2, [docid]))
+        return catalog
+
+    def test_query_applies_repeated_comparator_once(self):
+        from repoze.catalog.query import Any
+        from repoze.catalog.query import Eq
+        catalog = self._makeCached()
+        catalog.disable_query_cache()
+        index = catalog['field']
+        applied = []
+        def applyEq(value, applyEq=index.applyEq):
+            applied.append(value)
+            return applyEq(value)
+        index.applyEq = applyEq
+        query = ((Eq('field', 1) & Any('keyword', [1, 2])) |
+                 (Any('keyword', [3, 4]) &
+                  (Eq('field', 1) | Any('keyword', [0]))))
+        numdocs, result = catalog.query(query)
+        self.assertEqual(list(result), [1, 3])
+        self.assertEqual(applied, [1])
+        self.assertFalse(hasattr(catalog, '_v_shared_results'))
+
+    def test_query_sequence_and_range_values(self):
+        from repoze.catalog import RangeValue
+        from repoze.catalog.indexes.field import CatalogFieldIndex
+        from repoze.catalog.query import And
+        from repoze.catalog.query import Any
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import NotEq
+        catalog = self._makeOne()
+        catalog['field'] = CatalogFieldIndex('field')
+        catalog['keyword'] = CatalogFieldIndex('keyword')
+        for docid in range(20):
+            catalog.index_doc(docid, DummyContent(docid % 5, docid % 2))
+        odd = [docid for docid in range(20) if docid % 2]
+        for query, expected in [
+                (And(Eq('field', [1, 2]), Eq('keyword', 1)),
+                 [docid for docid in odd if docid % 5 in (1, 2)]),
+                (And(NotEq('field', [1, 2]), Eq('keyword', 1)),
+                 [docid for docid in odd if docid % 5 not in (1, 2)]),
+                (And(Any('field', [RangeValue(1, 2), 4]), Eq('keyword', 1)),
+                 [docid for docid in odd if docid % 5 in (1, 2, 4)])]:
+            numdocs, result = catalog.query(query)
+            self.assertEqual(sorted(result), expected)
+
+    def test_query_contradiction(self):
+        from repoze.catalog.query import Gt
+        from repoze.catalog.query import Lt
+        from repoze.catalog.query import optimize
+        catalog = self._makeCached()
+        index = catalog['field']
+        index.applyGt = index.applyLt = index.applyInRange = lambda *a: 1 / 0
+        index.estimate = lambda *a: 1 / 0
+        numdocs, result = catalog.query(
+            optimize(Gt('field', 1) & Lt('field', 0)))
+        self.assertEqual(numdocs, 0)
+        self.assertEqual(list(result), [])
+
+    def test_query_cache_disabled(self):
+        catalog = self._makeOne()
+        self.assertEqual(catalog.query_cache, None)
+        catalog.enable_query_cache(5, 50)
+        cache = catalog.query_cache
+        self.assertEqual((cache.maxsize, cache.maxcost), (5, 50))
+        self.assertTrue(catalog.query_cache is cache)
+        catalog.disable_query_cache()
+        self.assertEqual(catalog.query_cache, None)
+        self.assertEqual(catalog._generations, None)
+
+    def test_query_cache_hit(self):
+        from repoze.catalog.query import Eq
+        catalog = self._makeCached()
+        numdocs, result = catalog.query(Eq('field', 1))
+        self.assertEqual(list(result), [1, 3])
+        numdocs, result2 = catalog.query(Eq('field', 1), sort_index='field')
+        self.assertEqual(catalog.query_cache.hits, 1)
+        self.assertEqual(list(result2), [1, 3])
+
+    def test_query_lazy_sort(self):
+        from repoze.catalog.query import Eq
+        catalog = self._makeCached()
+        sorted_with = []
+        index = catalog['field']
+        def sort(docids, reverse=False, limit=None, sort_type=None):
+            sorted_with.append((reverse, limit, sort_type))
+            return list(reversed(docids))[:limit]
+        index.sort = sort
+        numdocs, result = catalog.query(Eq('field', 0), sort_index='field',
+                                        limit=2, reverse=True)
+        self.assertEqual(numdocs, 2)
+        self.assertEqual(numdocs.total, 3)
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result.total, 3)
+        self.assertEqual(sorted_with, [])
+        self.assertEqual(result[:1], [4])
+        self.assertEqual(list(result), [4, 2])
+        self.assertEqual(sorted_with, [(True, 1, None), (True, 2, None)])
+
+    def test_query_string_uses_parse_cache(self):
+        from repoze.catalog.query import parse_cache
+        catalog = self._makeCached()
+        parse_cache.clear()
+        try:
+            numdocs, result = catalog.query('field == f', names={'f': 0})
+            self.assertEqual(list(result), [0, 2, 4])
+            numdocs, result = catalog.query('field == f', names={'f': 1})
+            self.assertEqual(list(result), [1, 3])
+            self.assertEqual(parse_cache.hits, 1)
+        finally:
+            parse_cache.clear()
+
+    def test_query_cache_canonical_key(self):
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import Any
+        from repoze.catalog.query import Name
+        catalog = self._makeCached()
+        catalog.query(Eq('field', 1) & Any('keyword', [1, 2]))
+        catalog.query(Any('keyword', Name('kw')) & Eq('field', Name('f')),
+                      names={'kw': [1, 2], 'f': 1})
+        self.assertEqual(catalog.query_cache.hits, 1)
+        catalog.query(Eq('field', 1) & Any('keyword', (1, 2)))
+        self.assertEqual(catalog.query_cache.hits, 1)
+
+    def test_query_cache_invalidated_per_index(self):
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import Any
+        catalog = self._makeCached()
+        catalog.query(Eq('field', 1))
+        catalog.query(Any('keyword', [1, 5]))
+        catalog['keyword'].reindex_doc = lambda docid, obj: False
+        self.assertEqual(catalog.reindex_doc(5, DummyContent(1, [5])),
+                         ['field'])
+        numdocs, result = catalog.query(Eq('field', 1))
+        self.assertEqual(list(result), [1, 3, 5])
+        numdocs, result = catalog.query(Any('keyword', [1, 5]))
+        self.assertEqual(list(result), [1])
+        self.assertEqual(catalog.query_cache.hits, 1)
+        catalog.invalidate_index('keyword')
+        numdocs, result = catalog.query(Any('keyword', [1, 5]))
+        self.assertEqual(catalog.query_cache.hits, 1)
+
+    def test_query_cache_unhashable_value(self):
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.query import Eq
+        catalog = self._makeCached()
+        idx = catalog['dummy'] = DummyIndex(IFSet([1]))
+        idx.applyEq = lambda value: idx.arg[0]
+        numdocs, result = catalog.query(Eq('dummy', DummyUnhashable()))
+        self.assertEqual(list(result), [1])
+        self.assertEqual(len(catalog.query_cache), 0)
+
+    def test_query_cache_skipped_for_uncommitted_changes(self):
+        import transaction
+        from ZODB.DB import DB
+        from ZODB.MappingStorage import MappingStorage
+        from repoze.catalog.query import Eq
+        db = DB(MappingStorage())
+        try:
+            conn = db.open()
+            catalog = conn.root()['catalog'] = self._makeCached()
+            transaction.commit()
+            catalog.query(Eq('field', 1))
+            catalog.query(Eq('field', 1))
+            self.assertEqual(catalog.query_cache.hits, 1)
+            catalog.index_doc(7, DummyContent(1, []))
+            numdocs, result = catalog.query(Eq('field', 1))
+            self.assertEqual(list(result), [1, 3, 7])
+            transaction.abort()
+            numdocs, result = catalog.query(Eq('field', 1))
+            self.assertEqual(list(result), [1, 3])
+            self.assertEqual(catalog.query_cache.hits, 2)
+        finally:
+            transaction.abort()
+            db.close()
+
     def _test_functional_merge(self, **extra):
         catalog = self._makeOne()
         from repoze.catalog.indexes.field import CatalogFieldIndex
@@ -274,6 +586,225 @@ class TestCatalog(unittest.TestCase):
         return self._test_functional_merge(
             index_query_order=['field', 'keyword', 'text', 'path'])
 
+class TestResultSet(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from repoze.catalog.catalog import ResultSet
+        return ResultSet
+
+    def _makeOne(self, docids, limit=None, sort=True, offset=0):
+        self.limits = []
+        def _sort(docids, limit, offset):
+            self.limits.append((limit, offset))
+            result = sorted(docids, reverse=True)[offset:]
+            if limit:
+                result = result[:limit]
+            return iter(result)
+        numdocs = max(len(docids) - offset, 0)
+        if limit:
+            numdocs = min(numdocs, limit)
+        return self._getTargetClass()(docids, numdocs, sort and _sort or None,
+                                      limit, offset)
+
+    def test_len_and_total(self):
+        results = self._makeOne([1, 2, 3, 4, 5], limit=3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results.total, 5)
+        self.assertTrue(results)
+        self.assertFalse(self._makeOne([]))
+        self.assertEqual(self.limits, [])
+
+    def test_iter(self):
+        results = self._makeOne([1, 2, 3, 4, 5])
+        self.assertEqual(self.limits, [])
+        self.assertEqual(list(results), [5, 4, 3, 2, 1])
+        self.assertEqual(list(results), [5, 4, 3, 2, 1])
+        self.assertEqual(self.limits, [(None, 0)])
+
+    def test_iter_w_limit(self):
+        results = self._makeOne([1, 2, 3, 4, 5], limit=2)
+        self.assertEqual(list(results), [5, 4])
+        self.assertEqual(self.limits, [(2, 0)])
+
+    def test_iter_unsorted(self):
+        results = self._makeOne([1, 2, 3], sort=False)
+        self.assertEqual(list(results), [1, 2, 3])
+        self.assertEqual(results[1:], [2, 3])
+
+    def test_slice_sorts_only_what_it_needs(self):
+        results = self._makeOne(list(range(100)))
+        self.assertEqual(results[:13], [99 - i for i in range(13)])
+        self.assertEqual(self.limits, [(13, 0)])
+        self.assertEqual(results[10:13], [89, 88, 87])
+        self.assertEqual(results[:5], [99, 98, 97, 96, 95])
+        self.assertEqual(self.limits, [(13, 0)])
+        self.assertEqual(results[13:15], [86, 85])
+        self.assertEqual(self.limits, [(13, 0), (15, 0)])
+        self.assertEqual(results[-1], 0)
+        self.assertEqual(self.limits, [(13, 0), (15, 0), (None, 0)])
+        self.assertEqual(results[5:2], [])
+
+    def test_slice_later_page_skips_rows(self):
+        results = self._makeOne(list(range(100)))
+        self.assertEqual(results[20:23], [79, 78, 77])
+        self.assertEqual(results[20:26:2], [79, 77, 75])
+        self.assertEqual(self.limits, [(3, 20), (6, 20)])
+        self.assertEqual(results[0], 99)
+        self.assertEqual(self.limits, [(3, 20), (6, 20), (1, 0)])
+
+    def test_slice_negative_step(self):
+        results = self._makeOne(list(range(100)))
+        self.assertEqual(results[40:10:-10], [59, 69, 79])
+        self.assertEqual(self.limits, [(41, 0)])
+        self.assertEqual(results[::-1], list(range(100)))
+        self.assertEqual(results[10:40:-1], [])
+        results = self._makeOne(list(range(10)), limit=3, offset=4)
+        self.assertEqual(results[::-1], [3, 4, 5])
+        self.assertEqual(self._makeOne([])[::-1], [])
+
+    def test_sort_again_keeps_rows(self):
+        # a sort which orders ties differently depending on the limit
+        def _sort(docids, limit, offset):
+            if limit is None or limit % 2 == 0:
+                return sorted(docids, key=lambda d: (d // 2, d))[:limit]
+            return sorted(docids, key=lambda d: (d // 2, -d))[:limit]
+        results = self._getTargetClass()(list(range(10)), 10, _sort)
+        self.assertEqual(results[:3], [1, 0, 3])
+        self.assertEqual(results[3], 2)
+        self.assertEqual(results[:5], [1, 0, 3, 2, 5])
+        self.assertEqual(list(results), [1, 0, 3, 2, 5, 4, 6, 7, 8, 9])
+
+    def test_offset(self):
+        results = self._makeOne(list(range(10)), limit=3, offset=4)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results.total, 10)
+        self.assertEqual(list(results), [5, 4, 3])
+        self.assertEqual(results[1:], [4, 3])
+        self.assertEqual(self.limits, [(3, 4)])
+        self.assertEqual(results[-1], 3)
+        results = self._makeOne(list(range(10)), offset=8)
+        self.assertEqual(results[1:2], [0])
+        self.assertEqual(self.limits, [(1, 9)])
+        self.assertEqual(len(self._makeOne([1, 2], offset=3)), 0)
+
+    def test_iter_after_slice(self):
+        results = self._makeOne(list(range(10)))
+        self.assertEqual(results[:2], [9, 8])
+        self.assertEqual(len(list(results)), 10)
+        self.assertEqual(self.limits, [(2, 0), (None, 0)])
+
+    def test_getitem(self):
+        results = self._makeOne([1, 2, 3], limit=2)
+        self.assertEqual(results[0], 3)
+        self.assertEqual(results[-1], 2)
+        self.assertRaises(IndexError, results.__getitem__, 2)
+        self.assertRaises(IndexError, results.__getitem__, -3)
+
+    def test_getitem_sort_drops_docids(self):
+        results = self._getTargetClass()([1, 2, 3], 3, lambda d, l, o: [1])
+        self.assertRaises(IndexError, results.__getitem__, 1)
+        self.assertEqual(list(results), [1])
+
+    def test_contains(self):
+        results = self._makeOne([1, 2, 3, 4], limit=2)
+        self.assertTrue(4 in results)
+        self.assertFalse(1 in results)
+        results = self._makeOne([1, 2, 3, 4])
+        self.assertTrue(1 in results)
+        self.assertEqual(self.limits, [])
+
+
+class TestMultiIndexSort(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from repoze.catalog.catalog import MultiIndexSort
+        return MultiIndexSort
+
+    def _makeOne(self, *keys):
+        return self._getTargetClass()(keys)
+
+    def _makeIndexes(self):
+        from repoze.catalog.indexes.field import CatalogFieldIndex
+        self.values = {}
+        first = CatalogFieldIndex('first')
+        second = CatalogFieldIndex('second')
+        third = CatalogFieldIndex('third')
+        for docid in range(100):
+            content = DummyContent(None, None)
+            content.first = docid % 3
+            content.third = docid % 2
+            if docid % 10:
+                # some documents have no second value
+                content.second = docid % 7
+            first.index_doc(docid, content)
+            second.index_doc(docid, content)
+            third.index_doc(docid, content)
+            self.values[docid] = content
+        return first, second, third
+
+    def _keys(self, docids, reverse1, reverse2):
+        # the sort key of each of docids; the order of docids with the
+        # same sort key depends on the sort algorithm chosen
+        def key(docid):
+            content = self.values[docid]
+            first = content.first
+            second = getattr(content, 'second', None)
+            return (-first if reverse1 else first,
+                    second is None,
+                    -(second or 0) if reverse2 else (second or 0))
+        return [key(docid) for docid in docids]
+
+    def test_no_keys(self):
+        self.assertRaises(ValueError, self._makeOne)
+
+    def test_sort_type(self):
+        from repoze.catalog.indexes.field import FWSCAN
+        first, second, third = self._makeIndexes()
+        sort = self._makeOne((first, False), (second, False))
+        self.assertRaises(ValueError, sort.sort, [1, 2], sort_type=FWSCAN)
+
+    def test_cannot_break_ties(self):
+        first, second, third = self._makeIndexes()
+        self.assertRaises(ValueError, self._makeOne,
+                          (DummyIndex(), False), (first, False))
+
+    def test_sort(self):
+        from BTrees.IFBTree import IFSet
+        first, second, third = self._makeIndexes()
+        docids = IFSet(range(0, 100, 2))
+        for reverse1 in (False, True):
+            for reverse2 in (False, True):
+                sort = self._makeOne((first, reverse1), (second, reverse2))
+                expected = sorted(self._keys(docids, reverse1, reverse2))
+                result = list(sort.sort(docids))
+                self.assertEqual(sorted(result), list(docids))
+                self.assertEqual(self._keys(result, reverse1, reverse2),
+                                 expected)
+                result = list(sort.sort(docids, limit=20))
+                self.assertEqual(self._keys(result, reverse1, reverse2),
+                                 expected[:20])
+                result = list(sort.sort(docids, limit=5, offset=18))
+                self.assertEqual(self._keys(result, reverse1, reverse2),
+                                 expected[18:23])
+                result = list(sort.sort(docids, reverse=True))
+                self.assertEqual(
+                    self._keys(result, not reverse1, not reverse2),
+                    sorted(self._keys(docids, not reverse1, not reverse2)))
+
+    def test_sort_three_keys(self):
+        from BTrees.IFBTree import IFSet
+        first, second, third = self._makeIndexes()
+        docids = IFSet(range(100))
+        sort = self._makeOne((third, True), (first, False), (second, False))
+        result = list(sort.sort(docids, limit=10))
+        values = [(self.values[docid].third, self.values[docid].first)
+                  for docid in result]
+        self.assertEqual(values, [(1, 0)] * 10)
+        result = list(sort.sort(docids))
+        self.assertEqual(len(result), 100)
+        self.assertEqual(result[:3], [21, 63, 15])
+
+
 class TestFileStorageCatalogFactory(unittest.TestCase):
     def _getTargetClass(self):
         from repoze.catalog.catalog import FileStorageCatalogFactory
@@ -418,7 +949,7 @@ class DummyIndex(object):
     def apply(self, query):
         return self.arg[0]
 
-    def apply_intersect(self, query, docids): # pragma: no cover
+    def apply_intersect(self, query, docids):
         if docids is None:
             return self.arg[0]
         L = []
@@ -433,3 +964,25 @@ class DummyIndex(object):
         if reverse:
             return ['sorted3', 'sorted2', 'sorted1']
         return ['sorted1', 'sorted2', 'sorted3']
+
+
+class DummyBulkIndex(DummyIndex):
+
+    def __init__(self, *arg, **kw):
+        DummyIndex.__init__(self, *arg, **kw)
+        self.batches = []
+
+    def index_docs(self, docs):
+        self.batches.append(list(docs))
+
+
+class DummyContent(object):
+
+    def __init__(self, field, keyword):
+        self.field = field
+        self.keyword = keyword
+
+
+class DummyUnhashable(object):
+
+    __hash__ = None
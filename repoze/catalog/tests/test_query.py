@@ -71,6 +71,12 @@ class TestQuery(unittest.TestCase):
         self.assertEqual(buf.getvalue(), 'A\n  B\n  C\n')
 
 
+    def test_cache_key(self):
+        a = self._makeOne()
+        self.assertEqual(a._cache_key(None), None)
+        self.assertEqual(a._index_names(), set())
+
+
 class TestComparator(ComparatorTestBase):
 
     def _getTargetClass(self):
@@ -82,6 +88,35 @@ class TestComparator(ComparatorTestBase):
         self.assertEqual(inst.index_name, 'index')
         self.assertEqual(inst._value, 'val')
 
+    def test_estimate(self):
+        index = DummyIndex()
+        index.estimate = lambda operator, *args: (operator, args)
+        inst = self._makeOne('index', 'val')
+        self.assertEqual(inst._estimate(DummyCatalog(index), None),
+                         ('Comparator', ('val',)))
+
+    def test_estimate_index_cant_estimate(self):
+        inst = self._makeOne('index', 'val')
+        self.assertEqual(inst._estimate(DummyCatalog(), None), None)
+
+    def test_apply_intersect(self):
+        index = DummyIndex()
+        def apply_intersect_op(operator, docids, *args):
+            return (operator, docids, args)
+        index.apply_intersect_op = apply_intersect_op
+        inst = self._makeOne('index', 'val')
+        self.assertEqual(
+            inst._apply_intersect(DummyCatalog(index), None, 'docids'),
+            ('Comparator', 'docids', ('val',)))
+
+    def test_cache_key(self):
+        from repoze.catalog.query import Name
+        inst = self._makeOne('index', [Name('foo'), 'b'])
+        self.assertEqual(inst._cache_key({'foo': 'a'}),
+                         ('Comparator', 'index',
+                          (tuple, ((list, ('a', 'b')),))))
+        self.assertEqual(inst._index_names(), set(['index']))
+
     def test_eq(self):
         inst = self._makeOne('index', 'val')
         self.assertEqual(inst, self._makeOne('index', 'val'))
@@ -164,6 +199,15 @@ class TestEq(ComparatorTestBase):
         inst = self._makeOne('index', 'val')
         self.assertEqual(str(inst), "index == 'val'")
 
+    def test_apply_intersect_index_cant_intersect(self):
+        from BTrees.IFBTree import IFSet
+        catalog = DummyCatalog()
+        inst = self._makeOne('index', IFSet([1, 2, 3]))
+        result = inst._apply_intersect(catalog, None, IFSet([2, 3, 4]))
+        self.assertEqual(list(result), [2, 3])
+        result = inst._apply_intersect(catalog, None, None)
+        self.assertEqual(list(result), [1, 2, 3])
+
     def test_negate(self):
         from repoze.catalog.query import NotEq
         inst = self._makeOne('index', 'val')
@@ -321,6 +365,16 @@ class TestNotAll(ComparatorTestBase):
         self.assertEqual(result, 'val')
         self.assertEqual(catalog.index.all, 'val')
 
+    def test_apply_intersect(self):
+        from BTrees.IFBTree import IFSet
+        catalog = DummyCatalog()
+        inst = self._makeOne('index', IFSet([1, 2, 3]))
+        result = inst._apply_intersect(catalog, None, IFSet([2, 3, 4]))
+        self.assertEqual(list(result), [2, 3])
+        self.assertEqual(list(catalog.index.all), [1, 2, 3])
+        result = inst._apply_intersect(catalog, None, None)
+        self.assertEqual(list(result), [1, 2, 3])
+
     def test_to_str(self):
         inst = self._makeOne('index', [1, 2, 3])
         self.assertEqual(str(inst), "index not in all([1, 2, 3])")
@@ -432,6 +486,13 @@ class TestInRange(ComparatorTestBase):
         self.assertEqual(
             catalog.index.range, ('begin', 'end', False, False))
 
+    def test_cache_key(self):
+        from repoze.catalog.query import Name
+        inst = self._makeOne('index', Name('foo'), 'end', True)
+        self.assertEqual(inst._cache_key({'foo': 'begin'}),
+                         ('InRange', 'index',
+                          (tuple, ('begin', 'end', True, False))))
+
     def test_apply_w_names(self):
         from repoze.catalog.query import Name
         catalog = DummyCatalog()
@@ -575,7 +636,8 @@ class TestOr(BoolOpTestBase):
         self.assertEqual(o._apply(None, None), set([1, 2, 3, 4]))
         self.assertTrue(left.applied)
         self.assertTrue(right.applied)
-        self.assertEqual(o.family.union, (left.results, right.results))
+        self.assertEqual(o.family.unioned, [left.results, right.results])
+        self.assertEqual(o.family.union, None)
 
     def test_apply_left_empty(self):
         left = DummyQuery(set())
@@ -585,7 +647,7 @@ class TestOr(BoolOpTestBase):
         self.assertEqual(o._apply(None, None), set([3, 4]))
         self.assertTrue(left.applied)
         self.assertTrue(right.applied)
-        self.assertEqual(o.family.union, None)
+        self.assertEqual(o.family.unioned, None)
 
     def test_apply_right_empty(self):
         left = DummyQuery(set([1, 2]))
@@ -595,8 +657,43 @@ class TestOr(BoolOpTestBase):
         self.assertEqual(o._apply(None, None), set([1, 2]))
         self.assertTrue(left.applied)
         self.assertTrue(right.applied)
+        self.assertEqual(o.family.unioned, None)
+
+    def test_apply_many(self):
+        queries = [DummyQuery(set([i, i + 1])) for i in range(50)]
+        o = self._getTargetClass()(*queries)
+        o.family = DummyFamily()
+        self.assertEqual(o._apply(None, None), set(range(51)))
+        self.assertEqual(len(o.family.unioned), 50)
         self.assertEqual(o.family.union, None)
 
+    def test_apply_weighted(self):
+        from BTrees.IFBTree import IFBucket
+        from BTrees.IFBTree import IFSet
+        left = DummyQuery(IFBucket({1: 0.5, 2: 1.5}))
+        right = DummyQuery(IFSet([2, 3]))
+        o = self._makeOne(left, right)
+        result = o._apply(None, None)
+        self.assertEqual(list(result.items()), [(1, 0.5), (2, 2.5), (3, 1.0)])
+
+    def test_apply_in_given_order(self):
+        # every child is applied anyway, so none are estimated
+        left = DummyQuery(set([1, 2, 3]), estimate=3)
+        right = DummyQuery(set([4]), estimate=1)
+        left._estimate = right._estimate = None
+        o = self._makeOne(left, right)
+        o.family = DummyFamily()
+        self.assertEqual(o._apply(None, None), set([1, 2, 3, 4]))
+        self.assertEqual(o.family.unioned, [left.results, right.results])
+
+    def test_estimate(self):
+        o = self._makeOne(DummyQuery(None, 3), DummyQuery(None, 4))
+        self.assertEqual(o._estimate(None, None), 7)
+
+    def test_estimate_unknown(self):
+        o = self._makeOne(DummyQuery(None, 3), DummyQuery(None))
+        self.assertEqual(o._estimate(None, None), None)
+
     def test_negate(self):
         from repoze.catalog.query import And
         left = DummyQuery('foo')
@@ -627,7 +724,8 @@ class TestAnd(BoolOpTestBase):
         self.assertEqual(o._apply(None, None), set([3]))
         self.assertTrue(left.applied)
         self.assertTrue(right.applied)
-        self.assertEqual(o.family.intersection, (left.results, right.results))
+        self.assertEqual(left.intersected, None)
+        self.assertEqual(right.intersected, left.results)
 
     def test_apply_left_empty(self):
         left = DummyQuery(set([]))
@@ -649,6 +747,75 @@ class TestAnd(BoolOpTestBase):
         self.assertTrue(right.applied)
         self.assertEqual(o.family.intersection, None)
 
+    def test_apply_smallest_estimate_first(self):
+        left = DummyQuery(set([1, 2, 3]), estimate=3)
+        right = DummyQuery(set(), estimate=0)
+        o = self._makeOne(left, right)
+        o.family = DummyFamily()
+        self.assertEqual(o._apply(None, None), set())
+        self.assertFalse(left.applied)
+        self.assertTrue(right.applied)
+
+    def test_apply_unknown_estimate_last(self):
+        left = DummyQuery(set([1, 2, 3]))
+        right = DummyQuery(set([3, 4, 5]), estimate=1000)
+        o = self._makeOne(left, right)
+        o.family = DummyFamily()
+        self.assertEqual(o._apply(None, None), set([3]))
+        self.assertEqual(left.intersected, right.results)
+
+    def test_apply_unknown_estimates_smallest_first(self):
+        from BTrees.IFBTree import IFSet
+        big = DummyQuery(IFSet(range(5000)))
+        bigger = DummyQuery(IFSet(range(1, 10000, 2)))
+        small = DummyQuery(IFSet([3, 4, 5, 6, 9999]))
+        last = DummyQuery(set([3, 5, 7]))
+        o = self._getTargetClass()(big, bigger, small, last)
+        self.assertEqual(list(o._apply(None, None)), [3, 5])
+        self.assertEqual(big.intersected, None)
+        self.assertEqual(bigger.intersected, None)
+        self.assertEqual(small.intersected, None)
+        self.assertEqual(list(last.intersected), [3, 5])
+
+    def test_apply_unknown_estimates_large(self):
+        from BTrees.IFBTree import IFSet
+        left = DummyQuery(IFSet(range(5000)))
+        right = DummyQuery(IFSet(range(2500, 7500)))
+        o = self._makeOne(left, right)
+        self.assertEqual(list(o._apply(None, None)), list(range(2500, 5000)))
+        self.assertEqual(right.intersected, None)
+
+    def test_apply_intersect(self):
+        left = DummyQuery(set([1, 2, 3]))
+        right = DummyQuery(set([3, 4, 5]))
+        o = self._makeOne(left, right)
+        o.family = DummyFamily()
+        self.assertEqual(o._apply_intersect(None, None, set([2, 3])),
+                         set([3]))
+        self.assertEqual(left.intersected, set([2, 3]))
+        self.assertEqual(right.intersected, set([2, 3]))
+
+    def test_apply_intersect_empty_docids(self):
+        left = DummyQuery(set([1, 2, 3]))
+        right = DummyQuery(set([3, 4, 5]))
+        o = self._makeOne(left, right)
+        o.family = DummyFamily()
+        self.assertEqual(o._apply_intersect(None, None, set()), set())
+        self.assertFalse(left.applied)
+        self.assertFalse(right.applied)
+
+    def test_estimate(self):
+        o = self._makeOne(DummyQuery(None, 3), DummyQuery(None, 4))
+        self.assertEqual(o._estimate(None, None), 3)
+
+    def test_estimate_partially_unknown(self):
+        o = self._makeOne(DummyQuery(None), DummyQuery(None, 4))
+        self.assertEqual(o._estimate(None, None), 4)
+
+    def test_estimate_unknown(self):
+        o = self._makeOne(DummyQuery(None), DummyQuery(None))
+        self.assertEqual(o._estimate(None, None), None)
+
     def test_negate(self):
         from repoze.catalog.query import Or
         left = DummyQuery('foo')
@@ -661,6 +828,187 @@ class TestAnd(BoolOpTestBase):
         self.assertTrue(right.negated)
 
 
+class TestBoolOpCacheKey(unittest.TestCase):
+
+    def test_cache_key_ignores_order_and_repeats(self):
+        from repoze.catalog.query import And
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import Or
+        a = And(Eq('a', 1), Or(Eq('b', 2), Eq('c', 3)))
+        b = And(Or(Eq('c', 3), Eq('b', 2)), Eq('a', 1), Eq('a', 1))
+        self.assertEqual(a._cache_key(None), b._cache_key(None))
+        self.assertNotEqual(a._cache_key(None),
+                            Or(Eq('a', 1), Or(Eq('b', 2), Eq('c', 3)))
+                            ._cache_key(None))
+        self.assertEqual(a._index_names(), set(['a', 'b', 'c']))
+
+    def test_cache_key_uncacheable_child(self):
+        from repoze.catalog.query import And
+        from repoze.catalog.query import Eq
+        o = And(Eq('a', 1), DummyQuery(None))
+        self.assertEqual(o._cache_key(None), None)
+
+
+class Test_optimize(unittest.TestCase):
+
+    def _callFUT(self, query):
+        from repoze.catalog.query import optimize
+        return optimize(query)
+
+    def test_duplicates(self):
+        from repoze.catalog.query import And
+        from repoze.catalog.query import Contains
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import NotEq
+        query = And(Eq('a', 1), Contains('b', 2), Eq('a', 1), NotEq('a', 1))
+        result = self._callFUT(query)
+        self.assertEqual([type(q) for q in result.queries],
+                         [Eq, Contains, NotEq])
+        self.assertEqual(self._callFUT(And(Eq('a', 1), Eq('a', 1))),
+                         Eq('a', 1))
+
+    def test_common_and(self):
+        from repoze.catalog.query import And
+        from repoze.catalog.query import Any
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import Or
+        query = (Eq('a', 1) & Eq('b', 2)) | (Eq('b', 3) & Eq('a', 1))
+        result = self._callFUT(query)
+        self.assertTrue(isinstance(result, And))
+        a, b = result.queries
+        self.assertEqual((type(a), a.index_name, a._value), (Eq, 'a', 1))
+        self.assertEqual((type(b), b.index_name, b._value),
+                         (Any, 'b', [2, 3]))
+
+    def test_common_or(self):
+        from repoze.catalog.query import And
+        from repoze.catalog.query import Contains
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import Or
+        query = ((Eq('a', 1) | Contains('b', 2)) &
+                 (Eq('a', 1) | Contains('c', 3) | Contains('d', 4)))
+        result = self._callFUT(query)
+        self.assertTrue(isinstance(result, Or))
+        a, rest = result.queries
+        self.assertEqual(a, Eq('a', 1))
+        self.assertTrue(isinstance(rest, And))
+        b, cd = rest.queries
+        self.assertEqual(b, Contains('b', 2))
+        self.assertTrue(isinstance(cd, Or))
+        self.assertEqual(len(cd.queries), 2)
+
+    def test_common_absorbs(self):
+        from repoze.catalog.query import Contains
+        from repoze.catalog.query import Eq
+        query = Eq('a', 1) | (Contains('b', 2) & Eq('a', 1))
+        self.assertEqual(self._callFUT(query), Eq('a', 1))
+
+    def test_ranges(self):
+        from repoze.catalog.query import Ge
+        from repoze.catalog.query import Gt
+        from repoze.catalog.query import InRange
+        from repoze.catalog.query import Le
+        from repoze.catalog.query import Lt
+        query = Gt('a', 1) & Ge('a', 4) & Le('a', 9) & InRange('a', 0, 20)
+        self.assertEqual(self._callFUT(query), InRange('a', 4, 9))
+        query = Ge('a', 4) & Gt('a', 4) & Lt('a', 9) & Le('a', 9)
+        self.assertEqual(self._callFUT(query),
+                         InRange('a', 4, 9, True, True))
+        self.assertEqual(self._callFUT(Gt('a', 1) & Gt('a', 4)), Gt('a', 4))
+        result = self._callFUT(Le('a', 1) & Lt('a', 4))
+        self.assertEqual((type(result), result._value), (Le, 1))
+
+    def test_values_within_range(self):
+        from repoze.catalog.query import Any
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import Gt
+        from repoze.catalog.query import InRange
+        query = (Any('a', [1, 2, 3, 5]) & InRange('a', 2, 5, False, True) &
+                 Any('a', [5, 3, 9, 2]))
+        result = self._callFUT(query)
+        self.assertEqual((type(result), result._value), (Any, [2, 3]))
+        result = self._callFUT(Eq('a', 3) & Gt('a', 2))
+        self.assertEqual((type(result), result._value), (Eq, 3))
+
+    def test_values_without_range(self):
+        from repoze.catalog.query import All
+        from repoze.catalog.query import And
+        from repoze.catalog.query import Any
+        from repoze.catalog.query import Eq
+        # a keyword index may hold both values for a document
+        result = self._callFUT(Eq('a', 1) & Eq('a', 2))
+        self.assertEqual((type(result), result._value), (All, [1, 2]))
+        result = self._callFUT(Any('a', [1, 2]) & Any('a', [2, 3]))
+        self.assertTrue(isinstance(result, And))
+        result = self._callFUT(Any('a', [1, 2, 3]) & Eq('a', 2) &
+                               Any('a', [2, 3]))
+        self.assertEqual((type(result), result._value), (Eq, 2))
+
+    def test_names(self):
+        from repoze.catalog.query import And
+        from repoze.catalog.query import Any
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import Gt
+        from repoze.catalog.query import InRange
+        from repoze.catalog.query import Lt
+        from repoze.catalog.query import Name
+        result = self._callFUT(Gt('a', Name('x')) & Lt('a', 1))
+        self.assertEqual(result, InRange('a', Name('x'), 1, True, True))
+        result = self._callFUT(Any('a', Name('x')) & Lt('a', 1) &
+                               Eq('a', 0))
+        self.assertTrue(isinstance(result, And))
+        self.assertEqual([type(q) for q in result.queries], [Eq, Any])
+
+    def test_sequence_values(self):
+        from repoze.catalog import RangeValue
+        from repoze.catalog.query import And
+        from repoze.catalog.query import Any
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import Gt
+        for query in [Eq('f', [1, 7]) & Gt('f', 5),
+                      Eq('f', {'query': 1}) & Gt('f', 0),
+                      Eq('f', RangeValue(1, 3)) & Gt('f', 5),
+                      Any('f', [(1, 2), 3]) & Eq('f', 3)]:
+            result = self._callFUT(query)
+            self.assertTrue(isinstance(result, And))
+            self.assertEqual(len(result.queries), 2)
+
+    def test_contradictions(self):
+        from repoze.catalog.query import Any
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import Ge
+        from repoze.catalog.query import Gt
+        from repoze.catalog.query import Le
+        from repoze.catalog.query import Lt
+        from repoze.catalog.query import _Contradiction
+        for query in [Eq('a', 1) & Eq('a', 2) & Gt('a', 0),
+                      Gt('a', 3) & Lt('a', 1),
+                      Ge('a', 3) & Lt('a', 3),
+                      Any('a', [1, 2]) & Ge('a', 3) & Eq('b', 1),
+                      (Gt('a', 3) & Le('a', 1)) | (Gt('b', 3) & Le('b', 1))]:
+            self.assertTrue(isinstance(self._callFUT(query), _Contradiction))
+        query = (Gt('a', 3) & Le('a', 1)) | Eq('b', 1)
+        self.assertEqual(self._callFUT(query), Eq('b', 1))
+
+    def test_contradiction_applied(self):
+        from repoze.catalog.query import Gt
+        from repoze.catalog.query import Le
+        from repoze.catalog.query import Or
+        query = self._callFUT(Gt('a', 3) & Le('a', 1))
+        self.assertEqual(list(query._apply(None, None)), [])
+        self.assertEqual(query._estimate(None, None), 0)
+        self.assertEqual(query._cache_key(None), None)
+        self.assertTrue(isinstance(query.negate(), Or))
+
+    def test_nothing_common(self):
+        from repoze.catalog.query import Contains
+        from repoze.catalog.query import Eq
+        from repoze.catalog.query import NotEq
+        query = (Eq('a', 1) & Contains('b', 2)) | (NotEq('a', 1) &
+                                                   Contains('c', 2))
+        self.assertTrue(self._callFUT(query) is query)
+
+
 class TestNot(BoolOpTestBase):
 
     def _makeOne(self, query):
@@ -678,6 +1026,26 @@ class TestNot(BoolOpTestBase):
         self.assertTrue(query.negated)
         self.assertTrue(query.applied)
 
+    def test_estimate(self):
+        query = DummyQuery('foo', estimate=5)
+        o = self._makeOne(query)
+        self.assertEqual(o._estimate(None, None), 5)
+        self.assertTrue(query.negated)
+
+    def test_apply_intersect(self):
+        query = DummyQuery(set([1, 2]))
+        o = self._makeOne(query)
+        self.assertEqual(o._apply_intersect(None, None, set([2, 3])),
+                         set([2]))
+        self.assertTrue(query.negated)
+        self.assertEqual(query.intersected, set([2, 3]))
+
+    def test_cache_key(self):
+        from repoze.catalog.query import Eq
+        o = self._makeOne(Eq('index', 1))
+        self.assertEqual(o._cache_key(None), ('NotEq', 'index', (tuple, (1,))))
+        self.assertEqual(o._index_names(), set(['index']))
+
     def test_negate(self):
         query = DummyQuery('foo')
         o = self._makeOne(query)
@@ -707,6 +1075,53 @@ class TestName(unittest.TestCase):
         self.assertFalse(o1 == 'foo')
 
 
+class Test_parse_query_cached(unittest.TestCase):
+
+    def setUp(self):
+        from repoze.catalog.query import parse_cache
+        parse_cache.clear()
+
+    tearDown = setUp
+
+    def _callFUT(self, expr):
+        from repoze.catalog.query import parse_query_cached
+        return parse_query_cached(expr)
+
+    def test_it(self):
+        from repoze.catalog.query import And
+        from repoze.catalog.query import Name
+        from repoze.catalog.query import parse_cache
+        query = self._callFUT('a == x and b == y')
+        self.assertTrue(isinstance(query, And))
+        self.assertEqual(query.queries[0]._value, Name('x'))
+        self.assertTrue(self._callFUT('a == x and b == y') is query)
+        self.assertFalse(self._callFUT('a == x or b == y') is query)
+        self.assertEqual((parse_cache.hits, parse_cache.misses), (1, 2))
+
+    def test_parse_error_not_cached(self):
+        from repoze.catalog.query import parse_cache
+        self.assertRaises(ValueError, self._callFUT, 'a = x')
+        self.assertEqual(len(parse_cache), 0)
+
+
+class Test_freeze(unittest.TestCase):
+
+    def _callFUT(self, value):
+        from repoze.catalog.query import _freeze
+        return _freeze(value)
+
+    def test_hashable(self):
+        self.assertEqual(self._callFUT('a'), 'a')
+
+    def test_containers(self):
+        from repoze.catalog import RangeValue
+        key = self._callFUT([{'a': set([1])}, RangeValue(1, 2)])
+        hash(key)
+        self.assertEqual(
+            key, (list, ((dict, frozenset([('a', (set, frozenset([1])))])),
+                         (RangeValue, (tuple, (1, 2))))))
+
+
 class Test_parse_query(unittest.TestCase):
 
     def tearDown(self):
@@ -1203,6 +1618,7 @@ class DummyIndex(object):
 
 class DummyFamily(object):
     union = None
+    unioned = None
     intersection = None
     diff = None
 
@@ -1214,6 +1630,10 @@ class DummyFamily(object):
         self.union = (left, right)
         return None, left | right
 
+    def multiunion(self, sets):
+        self.unioned = sets
+        return set().union(*sets)
+
     def weightedIntersection(self, left, right):
         self.intersection = (left, right)
         return None, left & right
@@ -1225,14 +1645,32 @@ class DummyFamily(object):
 class DummyQuery(object):
     applied = False
     negated = False
+    intersected = None
 
-    def __init__(self, results):
+    def __init__(self, results, estimate=None):
         self.results = results
+        self.estimate = estimate
 
     def _apply(self, catalog, names):
         self.applied = True
         return self.results
 
+    def _apply_once(self, catalog, names):
+        return self._apply(catalog, names)
+
+    def _estimate(self, catalog, names):
+        return self.estimate
+
+    def _cache_key(self, names):
+        return None
+
+    def _apply_intersect(self, catalog, names, docids):
+        self.intersected = docids
+        result = self._apply(catalog, names)
+        if docids is None:
+            return result
+        return result & docids
+
     def negate(self):
         self.negated = True
         return self
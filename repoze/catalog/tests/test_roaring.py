@@ -0,0 +1,110 @@
+import unittest
+
+
+class TestRoaringIFSet(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from repoze.catalog.roaring import RoaringIFSet
+        return RoaringIFSet
+
+    def _makeOne(self, docids=()):
+        return self._getTargetClass()(docids)
+
+    def _roundtrip(self, docids):
+        import pickle
+        s = self._makeOne(docids)
+        data = pickle.dumps(s)
+        loaded = pickle.loads(data)
+        self.assertTrue(isinstance(loaded, self._getTargetClass()))
+        self.assertEqual(list(loaded), sorted(set(docids)))
+        return data
+
+    def test_is_an_IFSet(self):
+        from BTrees.IFBTree import IFSet
+        from BTrees.IFBTree import intersection
+        from BTrees.IFBTree import multiunion
+        s = self._makeOne([1, 2, 3])
+        self.assertTrue(isinstance(s, IFSet))
+        self.assertEqual(list(intersection(s, IFSet([2, 5]))), [2])
+        self.assertEqual(list(multiunion([s, IFSet([5])])), [1, 2, 3, 5])
+
+    def test_roundtrip_empty(self):
+        self._roundtrip([])
+
+    def test_roundtrip_sparse(self):
+        self._roundtrip([-2**31, -5, 0, 7, 2**31 - 1])
+
+    def test_roundtrip_array_chunk(self):
+        from repoze.catalog.roaring import ARRAY
+        s = self._makeOne(range(0, 1000, 7))
+        self.assertEqual(s.__getstate__()[0][0][1], ARRAY)
+        self._roundtrip(range(0, 1000, 7))
+
+    def test_roundtrip_bitmap_chunk(self):
+        from repoze.catalog.roaring import BITMAP
+        docids = [docid for docid in range(100000) if docid % 3]
+        s = self._makeOne(docids)
+        self.assertEqual([chunk[1] for chunk in s.__getstate__()[0]],
+                         [BITMAP, BITMAP])
+        self._roundtrip(docids)
+
+    def test_roundtrip_run_chunks(self):
+        from repoze.catalog.roaring import RUN
+        docids = list(range(-70000, 100)) + list(range(200, 300))
+        s = self._makeOne(docids)
+        self.assertEqual([chunk[1] for chunk in s.__getstate__()[0]],
+                         [RUN, RUN, RUN])
+        self._roundtrip(docids)
+
+    def test_dense_set_is_small(self):
+        import pickle
+        from BTrees.IFBTree import IFSet
+        docids = range(200000)
+        data = self._roundtrip(docids)
+        self.assertTrue(len(data) * 1000 < len(pickle.dumps(IFSet(docids))))
+
+    def test_stored_in_zodb(self):
+        import transaction
+        from ZODB.DB import DB
+        from ZODB.MappingStorage import MappingStorage
+        db = DB(MappingStorage())
+        try:
+            conn = db.open()
+            conn.root()['docids'] = self._makeOne(range(100000))
+            transaction.commit()
+            conn.root()['docids'].insert(-1)
+            transaction.commit()
+            conn.close()
+            conn = db.open()
+            docids = conn.root()['docids']
+            self.assertTrue(isinstance(docids, self._getTargetClass()))
+            self.assertEqual(list(docids), list(range(-1, 100000)))
+            conn.close()
+        finally:
+            transaction.abort()
+            db.close()
+
+
+class TestRoaringLFSet(unittest.TestCase):
+
+    def test_roundtrip(self):
+        import pickle
+        from repoze.catalog.roaring import RoaringLFSet
+        docids = [-2**50, 2**40, 2**40 + 1, 2**40 + 2, 2**40 + 3]
+        loaded = pickle.loads(pickle.dumps(RoaringLFSet(docids)))
+        self.assertEqual(list(loaded), docids)
+
+
+class Test_roaring_set_type(unittest.TestCase):
+
+    def _callFUT(self, *arg):
+        from repoze.catalog.roaring import roaring_set_type
+        return roaring_set_type(*arg)
+
+    def test_families(self):
+        import BTrees
+        from repoze.catalog.roaring import RoaringIFSet
+        from repoze.catalog.roaring import RoaringLFSet
+        self.assertTrue(self._callFUT() is RoaringIFSet)
+        self.assertTrue(self._callFUT(BTrees.family32) is RoaringIFSet)
+        self.assertTrue(self._callFUT(BTrees.family64) is RoaringLFSet)
@@ -0,0 +1,127 @@
+import unittest
+
+
+class Test_intersection(unittest.TestCase):
+
+    def _callFUT(self, sets):
+        from repoze.catalog.setops import intersection
+        return intersection(sets)
+
+    def _check(self, sets):
+        from BTrees.IFBTree import weightedIntersection
+        expected = None
+        for docids in sets:
+            expected = weightedIntersection(expected, docids)[1]
+        result = self._callFUT(sets)
+        if hasattr(expected, 'items'):
+            self.assertEqual(list(result.items()), list(expected.items()))
+        else:
+            self.assertEqual(list(result), list(expected))
+        return result
+
+    def test_none(self):
+        from BTrees.IFBTree import IFSet
+        self.assertEqual(self._callFUT([None, None]), None)
+        docids = IFSet([1, 2])
+        self.assertTrue(self._callFUT([None, docids]) is docids)
+
+    def test_merge(self):
+        from BTrees.IFBTree import IFSet
+        from BTrees.IFBTree import IFTreeSet
+        self._check([IFSet(range(0, 100, 2)), IFTreeSet(range(0, 100, 3)),
+                     IFSet(range(50))])
+
+    def test_merge_unweighted(self):
+        import BTrees
+        from BTrees.IFBTree import IFSet
+        from repoze.catalog.setops import intersection
+
+        class DummyFamily(object):
+            # no weightedIntersection
+            class IF(object):
+                intersection = staticmethod(BTrees.family32.IF.intersection)
+
+        result = intersection([IFSet([1, 2, 3]), IFSet([2, 3, 4])],
+                              DummyFamily)
+        self.assertEqual(list(result), [2, 3])
+
+    def test_probe(self):
+        from BTrees.IFBTree import IFSet
+        from BTrees.IFBTree import IFTreeSet
+        result = self._check([IFTreeSet(range(10000)), IFSet([-1, 5, 77])])
+        self.assertEqual(list(result), [5, 77])
+
+    def test_probe_weighted(self):
+        from BTrees.IFBTree import IFBucket
+        from BTrees.IFBTree import IFBTree
+        from BTrees.IFBTree import IFSet
+        from BTrees.IFBTree import IFTreeSet
+        small = IFBucket({5: 2.5, 77: 1.0, -1: 3.0})
+        big_weights = IFBTree([(docid, 0.5) for docid in range(10000)])
+        self._check([small, IFTreeSet(range(10000))])
+        self._check([small, big_weights])
+        self._check([IFSet([5, 6, -1]), big_weights])
+
+    def test_empty(self):
+        from BTrees.IFBTree import IFSet
+        result = self._callFUT([IFSet(), IFSet([1]), IFSet([1, 2])])
+        self.assertEqual(list(result), [])
+
+
+class Test_union(unittest.TestCase):
+
+    def _callFUT(self, sets):
+        from repoze.catalog.setops import union
+        return union(sets)
+
+    def test_nothing(self):
+        from BTrees.IFBTree import IFSet
+        self.assertEqual(list(self._callFUT([None, IFSet()])), [])
+
+    def test_one(self):
+        from BTrees.IFBTree import IFSet
+        docids = IFSet([1, 2])
+        self.assertTrue(self._callFUT([None, docids]) is docids)
+
+    def test_unweighted(self):
+        from BTrees.IFBTree import IFSet
+        from BTrees.IFBTree import IFTreeSet
+        result = self._callFUT([IFSet([1, 5]), IFTreeSet([2, 5]), IFSet([9])])
+        self.assertEqual(list(result), [1, 2, 5, 9])
+
+    def test_weighted(self):
+        from BTrees.IFBTree import IFBucket
+        from BTrees.IFBTree import IFSet
+        result = self._callFUT([IFBucket({1: 2.0, 5: 1.5}), IFSet([5, 7])])
+        self.assertEqual(list(result.items()), [(1, 2.0), (5, 2.5), (7, 1.0)])
+
+
+class Test_difference(unittest.TestCase):
+
+    def _callFUT(self, docids, others):
+        from repoze.catalog.setops import difference
+        return difference(docids, others)
+
+    def test_merge(self):
+        from BTrees.IFBTree import IFSet
+        result = self._callFUT(IFSet(range(10)),
+                               [IFSet([1, 2]), None, IFSet([2, 3, 11])])
+        self.assertEqual(list(result), [0, 4, 5, 6, 7, 8, 9])
+
+    def test_probe(self):
+        from BTrees.IFBTree import IFSet
+        from BTrees.IFBTree import IFTreeSet
+        result = self._callFUT(IFSet([-1, 5, 77, 20000]),
+                               [IFTreeSet(range(10000))])
+        self.assertEqual(list(result), [-1, 20000])
+
+    def test_probe_weighted(self):
+        from BTrees.IFBTree import IFBucket
+        from BTrees.IFBTree import IFTreeSet
+        result = self._callFUT(IFBucket({-1: 2.0, 5: 1.0}),
+                               [IFTreeSet(range(10000))])
+        self.assertEqual(list(result.items()), [(-1, 2.0)])
+
+    def test_empty(self):
+        from BTrees.IFBTree import IFSet
+        self.assertEqual(list(self._callFUT(IFSet(), [IFSet([1])])), [])